@@ -15,6 +15,7 @@ import org.springframework.web.bind.annotation.PathVariable;
 import org.springframework.web.bind.annotation.PostMapping;
 import org.springframework.web.bind.annotation.RequestBody;
 import org.springframework.web.bind.annotation.RequestMapping;
+import org.springframework.web.bind.annotation.RequestParam;
 import org.springframework.web.bind.annotation.ResponseStatus;
 import org.springframework.web.bind.annotation.RestController;
 
@@ -178,4 +179,29 @@ public class SearchDataController {
     List<SearchData> searchDataList = searchDataService.findAllSearchData();
     return searchDataList.stream().map(dtoService::convertEntityToDto).toList();
   }
+
+  /**
+   * REST request to retrieve a batch of search data, ordered by their id
+   *
+   * @param after Search data id after which the batch starts
+   * @param size Maximum number of search data objects in the batch
+   * @return List of search data objects, empty if there are no more search data objects
+   */
+  @Operation(
+    summary = "Retrieve a batch of search data",
+    description = "Retrieves at most size search data objects with an ID greater than after, ordered by their ID. " +
+      "Passing the ID of the last object of each batch as after iterates over all search data objects. " +
+      "Yields an empty list after the last batch."
+  )
+  @GetMapping(
+    value = "/get-batch",
+    produces = MediaType.APPLICATION_JSON_VALUE
+  )
+  public List<SearchDataDto> getSearchDataBatch(
+    @RequestParam(value = "after", defaultValue = "-1") Integer after,
+    @RequestParam(value = "size", defaultValue = "100") Integer size
+  ) {
+    List<SearchData> searchDataList = searchDataService.findSearchDataBatch(after, size);
+    return searchDataList.stream().map(dtoService::convertEntityToDto).toList();
+  }
 }
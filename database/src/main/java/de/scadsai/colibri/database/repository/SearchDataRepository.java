@@ -1,8 +1,10 @@
 package de.scadsai.colibri.database.repository;
 
 import de.scadsai.colibri.database.entity.SearchData;
+import org.springframework.data.domain.Limit;
 import org.springframework.data.repository.CrudRepository;
 
+import java.util.List;
 import java.util.Optional;
 
 public interface SearchDataRepository extends CrudRepository<SearchData, Integer> {
@@ -19,4 +21,12 @@ public interface SearchDataRepository extends CrudRepository<SearchData, Integer
    * @param drawingId Drawing id
    */
   void deleteSearchDataByDrawing_DrawingId(int drawingId);
+
+  /**
+   * Retrieve the searchData with an id greater than the given one, ordered by their id
+   * @param searchDataId SearchData id after which the retrieved searchData start
+   * @param limit Maximum number of retrieved searchData
+   * @return searchData ordered by their id
+   */
+  List<SearchData> findBySearchDataIdGreaterThanOrderBySearchDataIdAsc(int searchDataId, Limit limit);
 }
@@ -42,6 +42,15 @@ public interface SearchDataService {
    */
   List<SearchData> findAllSearchData();
 
+  /**
+   * Retrieve a batch of search data entities from the database, ordered by their id.
+   * Iterating with the id of the last entity of each batch retrieves all entities without loading them at once.
+   * @param afterId SearchData id after which the batch starts
+   * @param size Maximum number of search data entities in the batch
+   * @return Collection of search data entities with an id greater than afterId
+   */
+  List<SearchData> findSearchDataBatch(int afterId, int size);
+
   /**
    * Delete a search data entity from the database by its id
    * @param id SearchData id
@@ -8,6 +8,7 @@ import de.scadsai.colibri.database.repository.DrawingRepository;
 import de.scadsai.colibri.database.repository.SearchDataRepository;
 import org.springframework.beans.factory.annotation.Autowired;
 import org.springframework.dao.DataAccessException;
+import org.springframework.data.domain.Limit;
 import org.springframework.data.util.Streamable;
 import org.springframework.stereotype.Service;
 import org.springframework.transaction.annotation.Transactional;
@@ -69,6 +70,11 @@ public class SearchDataServiceImpl implements SearchDataService {
     return Streamable.of(searchDataIterable).stream().toList();
   }
 
+  @Override
+  public List<SearchData> findSearchDataBatch(int afterId, int size) {
+    return searchDataRepository.findBySearchDataIdGreaterThanOrderBySearchDataIdAsc(afterId, Limit.of(size));
+  }
+
   @Override
   @Transactional
   public void deleteSearchDataById(int id) {
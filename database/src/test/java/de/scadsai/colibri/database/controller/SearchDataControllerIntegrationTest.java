@@ -42,6 +42,7 @@ class SearchDataControllerIntegrationTest extends SpringIntegrationTest {
   private static final String GET_SEARCHDATA = "/searchdata/get/{id}";
   private static final String GET_FOR_DRAWING = "/searchdata/get-for-drawing/{id}";
   private static final String GET_SEARCHDATALIST = "/searchdata/get-all";
+  private static final String GET_SEARCHDATA_BATCH = "/searchdata/get-batch?after={after}&size={size}";
 
   private static final int DRAWING_ID_1 = 1;
   private static final int DRAWING_ID_2 = 2;
@@ -327,4 +328,33 @@ class SearchDataControllerIntegrationTest extends SpringIntegrationTest {
       .andExpect(content().string(expected))
       .andExpect(allowOrigin());
   }
+
+  @Test
+  void testGetSearchDataBatch() throws Exception {
+    drawingRepository.saveAll(List.of(drawing1, drawing2));
+    searchDataRepository.saveAll(List.of(searchData1, searchData2));
+    assertEquals(2L, drawingRepository.count());
+    assertEquals(2L, searchDataRepository.count());
+
+    SearchDataDto searchData1Dto = dtoService.convertEntityToDto(searchData1);
+    SearchDataDto searchData2Dto = dtoService.convertEntityToDto(searchData2);
+    ObjectMapper objectMapper = new ObjectMapper();
+
+    mockMvc.perform(corsGet(GET_SEARCHDATA_BATCH, 0, 1))
+      .andExpect(status().isOk())
+      .andExpect(content().contentType(MediaType.APPLICATION_JSON))
+      .andExpect(content().string(objectMapper.writeValueAsString(List.of(searchData1Dto))))
+      .andExpect(allowOrigin());
+
+    mockMvc.perform(corsGet(GET_SEARCHDATA_BATCH, SEARCHDATA_ID_1, 1))
+      .andExpect(status().isOk())
+      .andExpect(content().contentType(MediaType.APPLICATION_JSON))
+      .andExpect(content().string(objectMapper.writeValueAsString(List.of(searchData2Dto))))
+      .andExpect(allowOrigin());
+
+    mockMvc.perform(corsGet(GET_SEARCHDATA_BATCH, SEARCHDATA_ID_2, 1))
+      .andExpect(status().isOk())
+      .andExpect(content().string("[]"))
+      .andExpect(allowOrigin());
+  }
 }
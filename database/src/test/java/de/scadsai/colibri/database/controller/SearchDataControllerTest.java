@@ -90,4 +90,11 @@ class SearchDataControllerTest {
     Mockito.when(searchDataService.findAllSearchData()).thenReturn(List.of(searchData, searchData));
     assertArrayEquals(List.of(searchDataDto, searchDataDto).toArray(), searchDataController.getAllSearchData().toArray());
   }
+
+  @Test
+  void testGetSearchDataBatch() {
+    Mockito.when(dtoService.convertEntityToDto(searchData)).thenReturn(searchDataDto);
+    Mockito.when(searchDataService.findSearchDataBatch(1, 2)).thenReturn(List.of(searchData, searchData));
+    assertArrayEquals(List.of(searchDataDto, searchDataDto).toArray(), searchDataController.getSearchDataBatch(1, 2).toArray());
+  }
 }
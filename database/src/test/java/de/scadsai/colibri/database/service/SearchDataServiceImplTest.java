@@ -9,6 +9,7 @@ import org.mockito.InjectMocks;
 import org.mockito.Mock;
 import org.mockito.Mockito;
 import org.springframework.boot.test.context.SpringBootTest;
+import org.springframework.data.domain.Limit;
 
 import java.util.List;
 import java.util.Optional;
@@ -102,6 +103,17 @@ class SearchDataServiceImplTest {
     Mockito.verifyNoMoreInteractions(searchDataRepository);
   }
 
+  @Test
+  void testFindSearchDataBatch() {
+    List<SearchData> searchDataList = List.of(searchData1, searchData2);
+    Mockito.when(searchDataRepository.findBySearchDataIdGreaterThanOrderBySearchDataIdAsc(0, Limit.of(2)))
+      .thenReturn(searchDataList);
+
+    assertIterableEquals(searchDataList, searchDataService.findSearchDataBatch(0, 2));
+    Mockito.verify(searchDataRepository).findBySearchDataIdGreaterThanOrderBySearchDataIdAsc(0, Limit.of(2));
+    Mockito.verifyNoMoreInteractions(searchDataRepository);
+  }
+
   @Test
   void testDeleteSearchDataById() {
     final int searchDataId = 1;
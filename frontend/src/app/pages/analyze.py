@@ -20,9 +20,9 @@ from app.technical_drawing import (
 from app.utils import (
     convert_bytestring_to_cv2,
     get_drawing_data_for_drawing_ids,
+    preprocess_drawing,
     send_request_to_database,
     send_request_to_llm_backend,
-    send_request_to_preprocessor,
 )
 
 LOGGER = logging.getLogger(__name__)
@@ -31,6 +31,7 @@ register_page(__name__, path="/")
 
 search_engine = None
 SHAPE_SCALE_FACTOR = 6  # this represents how much more the shape information is weighted in the search engine
+DEFAULT_WEIGHTS = [1.0, 1.0, 1.0, 1.0, 1.0, 1.0, SHAPE_SCALE_FACTOR]
 
 
 def get_inspect_modal_content(technical_drawing: TechnicalDrawing):
@@ -132,13 +133,10 @@ layout = dcc.Loading(
                     "source": "",
                 },
             ),
+            # weights of the search engine chosen by the user, the search engine itself is shared by all users
             dcc.Store(
-                id="store_dataset",
-                data=[],
-            ),
-            dcc.Store(
-                id="store_ids",
-                data=[],
+                id="store_weights",
+                data=DEFAULT_WEIGHTS,
             ),
             dcc.Store(
                 id="store_response_data",
@@ -490,6 +488,7 @@ def update_weight_plot(mat_weight, tol_weight, surface_weight, gdt_weight, norm_
 
 @callback(
     Output("searchEngineStatus", "children", allow_duplicate=True),
+    Output("store_weights", "data"),
     Input("weightModalCloseButton", "n_clicks"),
     State("matWeightSlider", "value"),
     State("tolWeightSlider", "value"),
@@ -498,15 +497,16 @@ def update_weight_plot(mat_weight, tol_weight, surface_weight, gdt_weight, norm_
     State("normWeightSlider", "value"),
     State("dimWeightSlider", "value"),
     State("formWeightSlider", "value"),
-    State("store_dataset", "data"),
-    State("store_ids", "data"),
     prevent_initial_call=True,
 )
-def update_search_engine(
-    n_clicks, mat_weight, tol_weight, surface_weight, gdt_weight, norm_weight, dim_weight, form_weight, dataset, ids
+def update_search_weights(
+    n_clicks, mat_weight, tol_weight, surface_weight, gdt_weight, norm_weight, dim_weight, form_weight
 ):
-    global search_engine
-
+    """
+    Stores the weights of the sliders for the search of this user. The new status of the search engine makes
+    update_output query the search engine again with the new weights, without calling the preprocessor again.
+    :return: time of the update, normalized weights
+    """
     weights = [
         mat_weight,
         tol_weight,
@@ -526,21 +526,17 @@ def update_search_engine(
             scaled_weights.append(weight / weights_sum)
     LOGGER.info("Set new weights: %s", repr(scaled_weights))
 
-    search_engine = SearchEngine(dataset, ids, "colibri_distance", scaled_weights)
-
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S"), scaled_weights
 
 
 @callback(
     Output("searchEngineStatus", "children"),
-    Output("store_dataset", "data"),
-    Output("store_ids", "data"),
     Input("dummy", "children"),
 )
 def init_search_engine(dummy):
     """
      Initializes the search engine in a global variable. For this a request is made to the database to get all
-     search data vectors. Also, inits the dataset.
+     search data vectors.
     :param dummy: status of the dummy div. This will only change upon loading the site
     :return: "loaded" when init is done
     """
@@ -554,7 +550,7 @@ def init_search_engine(dummy):
         LOGGER.info("Database request successful, request time: %s", time_spent.total_seconds())
     except Exception as e:
         LOGGER.error("Error for database request: %s", e if isinstance(e, str) else repr(e))
-        return "error", [], []
+        return "error"
 
     # reshape data
     dataset = []
@@ -565,18 +561,13 @@ def init_search_engine(dummy):
     # init the search engine with retrieved data
     try:
         start = datetime.now()
-        search_engine = SearchEngine(
-            dataset=dataset,
-            ids=ids,
-            metric="colibri_distance",
-            weights=[1.0, 1.0, 1.0, 1.0, 1.0, 1.0, SHAPE_SCALE_FACTOR]
-        )
+        search_engine = SearchEngine(dataset=dataset, ids=ids, metric="colibri_distance")
         time_spent = datetime.now() - start
         LOGGER.info("Search engine initialized. Initialization time: %s", time_spent.total_seconds())
     except Exception as e:
         LOGGER.error("Error during search engine initialization: %s", e if isinstance(e, str) else repr(e))
-        return "error", [], []
-    return "loaded", dataset, ids
+        return "error"
+    return "loaded"
 
 
 def get_query_tile(technical_drawing: TechnicalDrawing, n_cols, id):
@@ -919,9 +910,10 @@ def remove_output(n_clicks):
     State("update_results_source", "data"),
     State("store_response_data", "data"),
     State("store_input_drawing", "data"),
+    State("store_weights", "data"),
     prevent_initial_call=True,
 )
-def update_output(content, searchengine_status, filename, source, response_data, input_drawing):
+def update_output(content, searchengine_status, filename, source, response_data, input_drawing, weights):
     """
 
     :param content: content
@@ -930,12 +922,13 @@ def update_output(content, searchengine_status, filename, source, response_data,
     :param source: dash source
     :param response_data: response data
     :param input_drawing: input drawing
+    :param weights: weights of the search engine chosen by the user
     :return: html.Div containing the thumbnails and a table for the search results of the given drawing
     """
     # check that file is not emtpy and search engine has been initialized
     if content is not None and content != "0" and search_engine is not None:
-        # we need to save response_data globally (dcc.store), so that when search engine changes due to new weights
-        # preprocessor does not have to be called again
+        # we need to save response_data globally (dcc.store), so that when the weights change the preprocessor does
+        # not have to be called again, the search engine reuses the distances it computed for the same search vector
         content_type, content_string = content.split(",")  # split into header + content
         file_data = {"file_name": filename, "file_content": content_string, "file_type": content_type}
 
@@ -944,7 +937,7 @@ def update_output(content, searchengine_status, filename, source, response_data,
             # only send request to the preprocessor if new image is uploaded, else use old image
             if callback_context.triggered_id == "uploadImage":
                 start = datetime.now()
-                response_data = send_request_to_preprocessor(resource="/image_to_vector", method="post", payload=file_data)
+                response_data = preprocess_drawing(file_data)
                 input_drawing = convert_technical_drawing_to_dict(
                     convert_preprocessor_response_to_technical_drawing(response_data)
                 )
@@ -980,8 +973,8 @@ def update_output(content, searchengine_status, filename, source, response_data,
             shape_vector = response_data["shape_vector"]
             # combine them
             search_vector = ocr_vector + shape_vector
-            # query the search tree for the nearest vectors
-            query_result, dist = search_engine.query([search_vector], 5)
+            # query the search engine for the nearest vectors
+            query_result, dist = search_engine.query([search_vector], 5, weights)
             time_spent = datetime.now() - start
             LOGGER.info("Search engine query runtime: %s", time_spent.total_seconds())
             LOGGER.info("Search engine query result: %s %s", repr(query_result), repr(dist))
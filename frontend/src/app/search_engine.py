@@ -1,40 +1,164 @@
 import itertools
+import threading
+from collections import OrderedDict
 
 import numpy as np
 from scipy.spatial import distance
-from sklearn.neighbors import BallTree
+
+# names and lengths of the sections of the search vectors, see split_search_vector
+SECTION_NAMES = ["material", "tolerances", "surfaces", "gdt", "norm", "dim", "shape"]
+SECTION_LENGTHS = [116, 7, 1, 12, 52, 3, 512]
+# z score means and standard deviations of the surface and outer dimension sections
+SURFACE_MEANS = [7.047478619876142]
+SURFACE_STDS = [0.92944175211206]
+DIMENSION_MEANS = [41.90041286, 133.08905338, 0]
+DIMENSION_STDS = [88.95143844, 232.11359118, 1.0]
+# number of query vectors whose section distances are kept, e.g. the current drawings of several users
+SECTION_DISTANCE_CACHE_SIZE = 8
+
+
+class SearchIndex:
+    def __init__(self, dataset):
+        """
+        Search vectors of the dataset, split into their sections and prepared for computing the distance of a query
+        vector to all of them at once:
+        material, tolerances and norms as 0/1 matrices with the number of non-zero entries per row (jaccard),
+        surfaces and outer dimensions as z scores,
+        gdts and shape as matrices with the sum and the euclidean norm of each row (cosine).
+        :param dataset: array of vectors in the search space. shape: (n_samples, n_vector_dimenions)
+        """
+        dataset = np.asarray(dataset, dtype=np.float64).reshape(-1, sum(SECTION_LENGTHS))
+        material, tolerances, surfaces, gdt, norm, dim, shape = split_search_vector(dataset.T)
+        self.size = len(dataset)
+
+        self.sets = [(section.T != 0).astype(np.float32) for section in (material, tolerances, norm)]
+        self.set_sizes = [matrix.sum(axis=1) for matrix in self.sets]
+
+        self.surfaces = ((surfaces.T - SURFACE_MEANS) / SURFACE_STDS)[:, 0]
+        self.dims = (dim.T - DIMENSION_MEANS) / DIMENSION_STDS
+
+        self.gdt = np.ascontiguousarray(gdt.T)
+        self.shape = shape.T.astype(np.float32)
+        self.vector_sums = [section.sum(axis=0) for section in (gdt, shape)]
+        self.vector_norms = [np.sqrt(np.einsum("ij,ij->j", section, section)) for section in (gdt, shape)]
+
+    def section_distances(self, query_vector):
+        """
+        Computes the distance of each section of the query vector to the same section of every vector in the index,
+        the same distances colibri_distance computes for a single pair of vectors.
+        :param query_vector: search vector
+        :return: array of shape (n_samples, 7) with the distances in the order of SECTION_NAMES
+        """
+        material, tolerances, surfaces, gdt, norm, dim, shape = split_search_vector(
+            np.asarray(query_vector, dtype=np.float64)
+        )
+        distances = np.empty((self.size, len(SECTION_NAMES)))
+
+        # jaccard: share of the entries that are non-zero in only one of the vectors among those non-zero in any
+        for column, matrix, set_sizes, section in zip(
+            (0, 1, 4), self.sets, self.set_sizes, (material, tolerances, norm), strict=True
+        ):
+            query_set = (section != 0).astype(np.float32)
+            intersection = matrix @ query_set
+            union = set_sizes + query_set.sum() - intersection
+            with np.errstate(divide="ignore", invalid="ignore"):
+                distances[:, column] = np.where(union > 0, (union - intersection) / union, 0.0)
+
+        distances[:, 2] = np.abs((surfaces[0] - SURFACE_MEANS[0]) / SURFACE_STDS[0] - self.surfaces)
+
+        # dimension_distance: the best of all permutations of the query dimensions, but not more than 1
+        permutations = (np.array(list(itertools.permutations(dim))) - DIMENSION_MEANS) / DIMENSION_STDS
+        differences = self.dims[:, np.newaxis, :] - permutations[np.newaxis, :, :]
+        dim_distances = np.sqrt(np.einsum("ijk,ijk->ij", differences, differences)) / len(dim)
+        distances[:, 5] = np.fmin(np.fmin.reduce(dim_distances, axis=1), 1.0)
+
+        for column, matrix, vector_sums, vector_norms, section in zip(
+            (3, 6),
+            (self.gdt, self.shape),
+            self.vector_sums,
+            self.vector_norms,
+            (gdt, shape),
+            strict=True,
+        ):
+            distances[:, column] = self.cosine_distances(matrix, vector_sums, vector_norms, section)
+        return distances
+
+    @staticmethod
+    def cosine_distances(matrix, vector_sums, vector_norms, query):
+        """
+        Vectorized cosine_distance_no_nans of the query to each row of the matrix.
+        """
+        if query.sum() == 0.0:
+            return np.ones(len(matrix))
+        products = matrix @ query.astype(matrix.dtype)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cosine = np.clip(1.0 - products / (vector_norms * np.linalg.norm(query)), 0.0, 2.0)
+        return np.where(vector_sums == 0.0, 1.0, cosine)
+
 
 class SearchEngine:
-    def __init__(self, dataset, ids, metric, weights):
+    def __init__(self, dataset, ids, metric):
         """
-        Class encapsulating a sklearn BallTree.
-        This search tree uses hyperspheres to recursively divide the search space, similar to a kd-tree.
+        Brute force search over a SearchIndex: computes the distances of the query to all vectors of the dataset at
+        once and selects the closest ones.
+        The index is not changed by queries, so one search engine can be shared by all users. The weights of the
+        sections are passed with each query. The section distances of the last queried vectors are cached, so querying
+        the same vector again with other weights only weights the cached distances and ranks them again.
         :param dataset: array of vectors in the search space. shape: (n_samples, n_vector_dimenions)
         :param ids: list of ids to return when searching. should be of same length as the dataset
-        :param metric: should be one of BallTree.valid_metrics
-        :param weights: array of weights to use when computing distances. should be of length 7
+        :param metric: has to be "colibri_distance"
         """
+        if metric != "colibri_distance":
+            raise Exception("unsupported metric: " + str(metric))
         self.ids = ids
-        if metric == "colibri_distance":
-            metric = self.colibri_distance
-        self.weights = weights
-        self.search_tree = BallTree(dataset, metric=metric)
+        self.index = SearchIndex(dataset)
+        self.section_distance_cache = OrderedDict()
+        self.cache_lock = threading.Lock()
 
-    def query(self, query_vector, k):
+    def query(self, query_vector, k, weights):
         """
-        Query the search tree using the query vector and return the ids of the k closest vectors.
-        :param query_vector: search vector
+        Query the search index using the query vector and return the ids of the k closest vectors.
+        :param query_vector: search vector, or a list with the search vector
         :param k: number of closest ids to return
-        :return: k closest ids
+        :param weights: array of weights to use when computing distances. should be of length 7
+        :return: k closest ids, array of shape (1, k) with their distances
         """
-        dist, ind = self.search_tree.query(query_vector, k)
-        return [self.ids[i] for i in ind[0]], dist
+        if len(weights) != len(SECTION_NAMES):
+            raise Exception("weights should be of same length as vector sections")
+        dist = self.section_distances(query_vector) @ np.asarray(weights, dtype=np.float64)
+        ind = top_k(dist, k)
+        return [self.ids[i] for i in ind], dist[ind][np.newaxis, :]
 
-    def colibri_distance(self, v1, v2):
+    def section_distances(self, query_vector):
+        """
+        Section distances of the query vector to all vectors of the index, see SearchIndex.section_distances.
+        They are computed once for the last SECTION_DISTANCE_CACHE_SIZE query vectors.
+        :param query_vector: search vector, or a list with the search vector
+        :return: read-only array of shape (n_samples, 7)
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float64).reshape(-1)
+        key = query_vector.tobytes()
+        with self.cache_lock:
+            distances = self.section_distance_cache.get(key)
+            if distances is not None:
+                self.section_distance_cache.move_to_end(key)
+                return distances
+
+        distances = self.index.section_distances(query_vector)
+        distances.flags.writeable = False
+        with self.cache_lock:
+            self.section_distance_cache[key] = distances
+            while len(self.section_distance_cache) > SECTION_DISTANCE_CACHE_SIZE:
+                self.section_distance_cache.popitem(last=False)
+        return distances
+
+    @staticmethod
+    def colibri_distance(v1, v2, weights):
         """
         Computes distance between search vectors.
         :param v1: vector 1
         :param v2: vector 2
+        :param weights: array of weights of the distances of the sections. should be of length 7
         :return: distance between v1 and v2
         """
         v1_split = split_search_vector(v1)
@@ -57,21 +181,31 @@ class SearchEngine:
             cosine_distance_no_nans,
         ]
 
-        names = ["material","tolerances","surfaces","gdt","norm","dim", "shape"]
-
-        if not len(v1_split) == len(v2_split) == len(distance_functions) == len(self.weights):
+        if not len(v1_split) == len(v2_split) == len(distance_functions) == len(weights):
             raise Exception("weights should be of same length as vector sections")
 
         distances = []
-        for distance_function, v1_part_vector, v2_part_vector, weight, name in zip(
-            distance_functions, v1_split, v2_split, self.weights, names, strict=True
+        for distance_function, v1_part_vector, v2_part_vector, weight in zip(
+            distance_functions, v1_split, v2_split, weights, strict=True
         ):
             dist = distance_function(v1_part_vector, v2_part_vector) * weight
             distances.append(dist)
 
+        return sum(distances)
 
 
-        return sum(distances)
+def top_k(dist, k):
+    """
+    Selects the k smallest distances without sorting all of them.
+    :param dist: array of distances
+    :param k: number of distances to select, at most all of them
+    :return: indices of the k smallest distances, ordered by distance and by index for equal distances
+    """
+    k = min(k, len(dist))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    candidates = np.argpartition(dist, k - 1)[:k] if k < len(dist) else np.arange(len(dist))
+    return candidates[np.lexsort((candidates, dist[candidates]))]
 
 
 def split_search_vector(search_vector):
@@ -87,28 +221,10 @@ def split_search_vector(search_vector):
 
     and returns a list of those vectors.
     """
-    # lengths of the sections of the vectors
-    mat_length = 116
-    tol_length = 7
-    n_grade_length = 1
-    gdt_length = 12
-    norm_length = 52
-    outer_measure_length = 3
-    clip_length = 512
-    section_lengths = [
-        mat_length,
-        tol_length,
-        n_grade_length,
-        gdt_length,
-        norm_length,
-        outer_measure_length,
-        clip_length,
-    ]
-
     # iterate over the section, split them into separate vectors
     current_pointer = 0
     split_search_vector = []
-    for length in section_lengths:
+    for length in SECTION_LENGTHS:
         split_search_vector.append(search_vector[current_pointer : current_pointer + length])
         current_pointer += length
     return split_search_vector
@@ -144,9 +260,7 @@ def surface_distance(v1, v2):
     Computes the surface distance between two vectors.
     Runs standardize_and_compute_l2_dist with the mean and stds of the surface vector
     """
-    means = [7.047478619876142]
-    stds = [0.92944175211206]
-    return standardize_and_compute_l2_dist(v1, v2, means, stds)
+    return standardize_and_compute_l2_dist(v1, v2, SURFACE_MEANS, SURFACE_STDS)
 
 
 def dimension_distance(v1, v2):
@@ -157,16 +271,12 @@ def dimension_distance(v1, v2):
     :param v2: vector 2
     :return: distance of the outer dimensions described in v1 and v2
     """
-    # means and standard deviation for dimensions
-    means = [41.90041286, 133.08905338, 0]
-    stds = [88.95143844, 232.11359118, 1.0]
-
     # get all permutations of v1
     permutations = list(itertools.permutations(v1))
     best_distance = 1.0
     # use euclidian distance to compute the best permutation for the dimensions
     for perm in permutations:
-        dist = standardize_and_compute_l2_dist(perm, v2, means, stds)
+        dist = standardize_and_compute_l2_dist(perm, v2, DIMENSION_MEANS, DIMENSION_STDS)
         if dist < best_distance:
             best_distance = dist
 
@@ -1,6 +1,7 @@
 import base64
 import logging
 import os
+import time
 from typing import Any
 
 import cv2
@@ -89,6 +90,32 @@ def send_request_to_preprocessor(resource, method="post", payload=None):
     return send_request(url, method=method, payload=payload)
 
 
+def preprocess_drawing(file_data, poll_interval=1.0, timeout=900.0):
+    """
+    Submits a drawing as a job to the preprocessor and polls the job until its result is available.
+    Unlike a single request to /image_to_vector, no HTTP request has to stay open while the drawing is processed.
+    :param file_data: json data with file_name and file_content (b64 encoded)
+    :param poll_interval: seconds between two status requests
+    :param timeout: maximum time in seconds to wait for the result
+    :return: json response of the preprocessor, same as for /image_to_vector
+    :raises:
+        requests.Timeout -> job did not finish within timeout
+        ValueError       -> job failed
+    """
+    job_id = send_request_to_preprocessor(resource="/jobs", method="post", payload=file_data)["job_id"]
+    deadline = time.monotonic() + timeout
+    while True:
+        job = send_request_to_preprocessor(resource=f"/jobs/{job_id}", method="get")
+        if job["status"] == "done":
+            return send_request_to_preprocessor(resource=f"/jobs/{job_id}/result", method="get")
+        if job["status"] == "failed":
+            raise ValueError(f"Preprocessing job {job_id} failed: {job['error']}")
+        if time.monotonic() > deadline:
+            raise requests.exceptions.Timeout(f"Preprocessing job {job_id} did not finish within {timeout} seconds")
+        LOGGER.debug("Preprocessing job %s is %s, progress: %s", job_id, job["status"], job["progress"])
+        time.sleep(poll_interval)
+
+
 def send_request_to_llm_backend(resource, method="post", payload=None):
     """
     Sends request to conversational search microservice and returns response json.
@@ -23,8 +23,7 @@ except Exception as e:
     print("Paddle check failed:", e)
 PY
 
+# Server settings (bind, timeout, workers, model preloading) are defined in gunicorn.conf.py
 exec uv run gunicorn \
-  --bind "0.0.0.0:6201" \
-  --timeout 600 \
-  --chdir ./src/flask \
+  --config ./gunicorn.conf.py \
   backend:app
@@ -0,0 +1,41 @@
+# Gunicorn configuration of the preprocessor, see https://docs.gunicorn.org/en/stable/settings.html
+import os
+
+bind = "0.0.0.0:" + os.getenv("PP_PORT", "6201")
+timeout = 600
+chdir = "./src/flask"
+workers = int(os.getenv("PP_WORKERS", "1"))
+# with threads > 1 gunicorn uses the gthread worker, the loaded models are shared by all threads of a worker
+threads = int(os.getenv("PP_THREADS", "1"))
+
+# Load the torch models (UNet, CLIP) in the master process before forking the workers, see model_registry.preload.
+# The workers then share their memory copy-on-write instead of each loading their own copy.
+# The OCR models and the models run with ONNX Runtime are still loaded by each worker.
+preload_models = os.getenv("PP_PRELOAD_MODELS", "false").lower() == "true"
+# Load the models once per worker right after it was started, instead of on the first request.
+warm_up_workers = os.getenv("PP_WARM_UP_MODELS", "true").lower() == "true"
+preload_app = preload_models
+
+
+def on_starting(server):
+    if preload_models:
+        from src.flask.model_registry import preload
+
+        server.log.info("Preloading models before forking workers")
+        loaded = preload()
+        server.log.info(f"Preloaded models: {loaded}")
+
+
+def post_worker_init(worker):
+    from src.flask.model_registry import set_torch_threads, warm_up
+
+    # the master only used one torch thread, see model_registry.preload
+    set_torch_threads()
+    if warm_up_workers:
+        worker.log.info(f"Loading models in worker {worker.pid}")
+        warm_up()
+
+    # start the job worker threads, so that every worker takes jobs from the shared queue
+    from src.flask.jobs import get_job_queue
+
+    get_job_queue()
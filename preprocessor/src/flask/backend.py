@@ -6,7 +6,19 @@ from flask_restful import Api, Resource, request
 
 import src.flask.ocr.resources.json as json_resources
 from flask import Flask
-from src.flask.preprocess import apply_preprocessing
+from src.flask.embedding_service import get_embedding_service
+from src.flask.jobs import DONE, FAILED, SYNC_WAIT_SECONDS, get_job_queue, submit_job
+from src.flask.preprocess import apply_preprocessing_batch, resolve_ocr_profile, resolve_orientation
+from src.flask.response_format import (
+    make_response,
+    read_upload,
+    requested_fields,
+    requested_ocr_profile,
+    requested_orientation,
+    wants_compact_response,
+)
+from src.flask.result_cache import get_result_cache
+from src.flask.revectorize import revectorize_searchdata
 
 app = Flask(__name__)
 api = Api(app)
@@ -14,13 +26,188 @@ api = Api(app)
 
 class ImageToVector(Resource):
     def post(self):
+        """
+        Synchronous preprocessing: submits a job and waits for its result.
+        The file can be uploaded as json, multipart or raw request body (see read_upload).
+        If the job is not finished after SYNC_WAIT_SECONDS, returns its status with code 504. The job keeps running, its
+        result can be fetched from /jobs/<job_id>/result.
+        """
         try:
             scale = 2048
-            data = request.get_json()
-            if data["file_content"]:
-                return apply_preprocessing(data["file_content"], data["file_name"], scale)
+            file_content, file_name = read_upload(request)
+            if file_content:
+                queue = get_job_queue()
+                job_id = submit_job(
+                    file_content,
+                    file_name,
+                    scale,
+                    requested_fields(request),
+                    requested_orientation(request),
+                    requested_ocr_profile(request),
+                )
+                job = queue.wait(job_id, timeout=SYNC_WAIT_SECONDS)
+                if job is None:
+                    return "job not found", 404
+                if job["status"] == DONE:
+                    return make_response(queue.get_result(job_id), wants_compact_response(request))
+                if job["status"] == FAILED:
+                    return job["error"]
+                return {"job_id": job_id, "status": job["status"], "error": "timeout waiting for the job"}, 504
             else:
                 return "NO file_name in json"
+        except ValueError as e:
+            # invalid request parameters, see the resolve functions of preprocess
+            return "invalid request: " + str(e), 400
+        except Exception as e:
+            traceback.print_exc()
+            return "internal error: " + str(e)
+
+
+class Jobs(Resource):
+    def get(self):
+        return get_job_queue().stats()
+
+    def post(self):
+        """
+        Submits a drawing for preprocessing and returns the id of the job without waiting for the result.
+        """
+        try:
+            scale = 2048
+            file_content, file_name = read_upload(request)
+            if file_content:
+                job_id = submit_job(
+                    file_content,
+                    file_name,
+                    scale,
+                    requested_fields(request),
+                    requested_orientation(request),
+                    requested_ocr_profile(request),
+                )
+                return {"job_id": job_id, "status": "queued"}, 202
+            else:
+                return "NO file_name in json"
+        except ValueError as e:
+            # invalid request parameters, see the resolve functions of preprocess
+            return "invalid request: " + str(e), 400
+        except Exception as e:
+            traceback.print_exc()
+            return "internal error: " + str(e)
+
+
+class JobStatus(Resource):
+    def get(self, job_id):
+        job = get_job_queue().get(job_id)
+        if job is None:
+            return "job not found", 404
+        return job
+
+
+class JobResult(Resource):
+    def get(self, job_id):
+        """
+        Returns the result of a finished job, or the error message of a failed job.
+        Returns the status with code 202 while the job is queued or running.
+        """
+        queue = get_job_queue()
+        job = queue.get(job_id)
+        if job is None:
+            return "job not found", 404
+        if job["status"] == DONE:
+            return make_response(queue.get_result(job_id), wants_compact_response(request))
+        if job["status"] == FAILED:
+            return job["error"]
+        return job, 202
+
+
+class ImageToVectorBatch(Resource):
+    def post(self):
+        try:
+            scale = 2048
+            if request.mimetype == "multipart/form-data":
+                # raw files in the field "files", the file names are taken from the uploaded files
+                files = [
+                    {"file_name": file.filename, "file_content": file.read()} for file in request.files.getlist("files")
+                ]
+            else:
+                files = request.get_json()["files"]
+            if files:
+                return make_response(
+                    apply_preprocessing_batch(
+                        files,
+                        scale,
+                        fields=requested_fields(request),
+                        orientation=requested_orientation(request),
+                        ocr_profile=requested_ocr_profile(request),
+                    ),
+                    wants_compact_response(request),
+                )
+            else:
+                return "NO files in json"
+        except ValueError as e:
+            # invalid request parameters, see the resolve functions of preprocess
+            return "invalid request: " + str(e), 400
+        except Exception as e:
+            traceback.print_exc()
+            return "internal error: " + str(e)
+
+
+class PreprocessingCache(Resource):
+    def get(self):
+        cache = get_result_cache()
+        if cache is None:
+            return "result cache is disabled"
+        return cache.stats()
+
+    def delete(self):
+        """
+        Invalidates the cached result of one file if file_content and file_name are given in the json body,
+        otherwise clears the whole cache.
+        """
+        try:
+            cache = get_result_cache()
+            if cache is None:
+                return "result cache is disabled"
+            data = request.get_json(silent=True) or {}
+            if data.get("file_content"):
+                key = cache.key(
+                    data["file_content"],
+                    data["file_name"],
+                    data.get("scale", 2048),
+                    resolve_orientation(data.get("orientation")),
+                    resolve_ocr_profile(data.get("ocr_profile")),
+                )
+                return {"removed": int(cache.invalidate(key))}
+            else:
+                return {"removed": cache.clear()}
+        except ValueError as e:
+            # invalid request parameters, see the resolve functions of preprocess
+            return "invalid request: " + str(e), 400
+        except Exception as e:
+            traceback.print_exc()
+            return "internal error: " + str(e)
+
+
+class EmbeddingStats(Resource):
+    def get(self):
+        service = get_embedding_service()
+        if service is None:
+            return "embedding batching is disabled"
+        return service.stats()
+
+
+class Revectorize(Resource):
+    def post(self):
+        """
+        Computes the search_vector of drawings again from their search data in the database, without applying the
+        OCR, e.g. after materials.json, norms.json or the vectorization changed. Expects the search data as returned by
+        the database service in the json field searchdata and returns it with the new search_vector.
+        """
+        try:
+            searchdata_list = (request.get_json(silent=True) or {}).get("searchdata")
+            if searchdata_list is None:
+                return "NO searchdata in json"
+            revectorized, timings = revectorize_searchdata(searchdata_list)
+            return {"searchdata": revectorized, "timings": timings}
         except Exception as e:
             traceback.print_exc()
             return "internal error: " + str(e)
@@ -35,6 +222,13 @@ class GetMaterials(Resource):
 
 api.add_resource(GetMaterials, "/get_materials")
 api.add_resource(ImageToVector, "/image_to_vector")
+api.add_resource(ImageToVectorBatch, "/image_to_vector_batch")
+api.add_resource(Jobs, "/jobs")
+api.add_resource(JobStatus, "/jobs/<string:job_id>")
+api.add_resource(JobResult, "/jobs/<string:job_id>/result")
+api.add_resource(PreprocessingCache, "/cache")
+api.add_resource(EmbeddingStats, "/embeddings")
+api.add_resource(Revectorize, "/revectorize")
 
 if __name__ == "__main__":
     app.run()
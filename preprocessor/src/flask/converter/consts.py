@@ -7,3 +7,8 @@ MIN_IF_AREA_RATIO = 0.33
 DIST_THRESH = 20
 LINE_WIDTH = 5
 MAX_CONTOUR_AREA = 3500
+DESKEW_DOWNSCALE = 4
+DESKEW_MAX_ANGLE = 5
+DESKEW_STEPS = [0.5, 0.1, 0.02]
+DESKEW_MIN_ANGLE = 0.1
+FIRE_GRID_CELL_SIZE = 64
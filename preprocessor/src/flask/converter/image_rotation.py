@@ -1,5 +1,10 @@
+import os
 import random
+import subprocess  # nosec B404
+import tempfile
+import threading
 from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from importlib.resources import files
 
 import cv2
@@ -11,6 +16,17 @@ import src.flask.converter.resources as resource_dir
 from src.flask.converter.consts import BIN_THRESH
 from src.flask.converter.utils import binarize, find_rectangles
 
+# maximum number of rectangles of the info block whose crops are stitched into the composite image
+OSD_MAX_CROPS = 50
+# seed for choosing the rectangles, so that the detected rotation of an image is reproducible
+OSD_SEED = int(os.getenv("PP_OSD_SEED", "0"))
+# number of OSD probes that have to agree on an angle to stop waiting for the others. with 4 probes, 3 are a majority
+OSD_QUORUM = 3
+# number of tesseract processes that run OSD probes at the same time, shared by all requests of the process
+OSD_THREADS = int(os.getenv("PP_OSD_THREADS", "4"))
+
+_osd_executor = ThreadPoolExecutor(max_workers=OSD_THREADS, thread_name_prefix="osd")
+
 
 def rotate_image_multiple_of_90(image, rotation):
     """
@@ -105,18 +121,70 @@ def osd(image):
     :param image: grayscale image
     :return: rotation in degrees (counter-clockwise) and a multiple of 90°
     """
-    tessdata_dir = str(files(resource_dir).joinpath("tesseract"))
-    try:
-        result = pytesseract.image_to_osd(
-            image,
-            output_type=pytesseract.Output.DICT,
-            config="-c min_characters_to_try=5 --tessdata-dir " + tessdata_dir,
-        )
-        rotation = result["rotate"]
-    except TesseractError as e:
-        print(e)
-        rotation = None
-    return rotation
+    return OsdProbe(image).run()
+
+
+class OsdProbe:
+    """
+    A single tesseract OSD run of an image that can be cancelled. Unlike pytesseract.image_to_osd, the tesseract
+    process is started here, so that cancel can kill it once its result is no longer needed.
+    """
+
+    def __init__(self, image):
+        """
+        :param image: grayscale image
+        """
+        self.image = image
+        self.process = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def run(self):
+        """
+        Runs the orientation detection
+        :return: rotation in degrees (counter-clockwise) and a multiple of 90°, None if it failed or was cancelled
+        """
+        tessdata_dir = str(files(resource_dir).joinpath("tesseract"))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.png")
+            output_base = os.path.join(tmp_dir, "output")
+            cv2.imwrite(input_path, self.image)
+            command = [
+                pytesseract.pytesseract.tesseract_cmd,
+                input_path,
+                output_base,
+                "--psm",
+                "0",
+                "-c",
+                "min_characters_to_try=5",
+                "--tessdata-dir",
+                tessdata_dir,
+            ]
+            with self.lock:
+                if self.cancelled:
+                    return None
+                self.process = subprocess.Popen(  # nosec B603
+                    command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+                )
+            _, errors = self.process.communicate()
+            if self.cancelled:
+                return None
+            if self.process.returncode != 0:
+                print(TesseractError(self.process.returncode, errors.decode("utf-8", "ignore").strip()))
+                return None
+            with open(output_base + ".osd", encoding="utf-8") as output_file:
+                result = pytesseract.pytesseract.osd_to_dict(output_file.read())
+        return result.get("rotate")
+
+    def cancel(self):
+        """
+        Stops the orientation detection. A probe that has not started yet does not start a tesseract process, a
+        running tesseract process is killed.
+        """
+        with self.lock:
+            self.cancelled = True
+            if self.process is not None and self.process.poll() is None:
+                self.process.kill()
 
 
 def crop_to_contents(image):
@@ -165,88 +233,109 @@ def compose_image(is_horizontal, crops):
     :param crops: list of crops of the original image
     :return: cv2 composed image
     """
-    # get dimensions for the background
-    sum_compose_h = 0
-    max_compose_w = 0
-    max_compose_h = 0
-    sum_compose_w = 0
-
-    non_empty_crops = []
-
-    for crop in crops:
-        if not crop_is_empty(crop):
-            non_empty_crops.append(crop)
-            (height, width) = crop.shape
-            sum_compose_h += height
-            sum_compose_w += width
-            if height > max_compose_h:
-                max_compose_h = height
-            if width > max_compose_w:
-                max_compose_w = width
-    # create empty composite image
+    # only non-empty crops in the stacking direction are used
+    # horizontal crops are stacked vertically, vertical crops horizontally
+    if is_horizontal:
+        used_crops = [crop for crop in crops if crop.shape[1] >= crop.shape[0] and not crop_is_empty(crop)]
+    else:
+        used_crops = [crop for crop in crops if crop.shape[0] >= crop.shape[1] and not crop_is_empty(crop)]
+    if len(used_crops) == 0:
+        return np.ones((0, 0), np.uint8)
+
+    # create empty composite image, just large enough for the used crops
+    heights = [crop.shape[0] for crop in used_crops]
+    widths = [crop.shape[1] for crop in used_crops]
     if is_horizontal:
-        composite_image = np.ones((sum_compose_h, max_compose_w), np.uint8) * 255
+        composite_image = np.ones((sum(heights), max(widths)), np.uint8) * 255
     else:
-        composite_image = np.ones((max_compose_h, sum_compose_w), np.uint8) * 255
+        composite_image = np.ones((max(heights), sum(widths)), np.uint8) * 255
 
     # add crops to the composite image
     curr = 0
-    for crop in non_empty_crops:
+    for crop in used_crops:
         h, w = crop.shape
-        if is_horizontal and w >= h:  # only add if crop is horizontal
+        if is_horizontal:
             composite_image[curr : curr + h, 0:w] = crop
             curr += h
-        elif not is_horizontal and h >= w:  # only add if crop is vertical
+        else:
             composite_image[0:h, curr : curr + w] = crop
             curr += w
     return composite_image
 
 
-def rotate_and_determine_angles(img):
+def create_composite_image(img, seed=OSD_SEED):
     """
-    Finds rectangles in a given img and creates a composite image using those crops. This composite image is rotated
-    by 90, 180 and 270 (and 0) degrees. For all rotations the orientation detection is called and the results are
-    returned. The goal of this is to minimize the variance and the error that is caused by using pre-trained tesseract
-    models. By analyzing the detected orientations a common angle should be able to be determined.
+    Finds rectangles in a given img and creates a composite image using crops of a sample of them.
     :param img: grayscale image
-    :return: rot_0, rot_90, rot_180, rot_270
+    :param seed: seed for sampling the rectangles
+    :return: composite image, cropped to its contents
     """
-    # sample 25 random rectangle in the image
+    # sample up to OSD_MAX_CROPS rectangles in the image. seeded, so that the result is reproducible
     rects = find_rectangles(img)
-    random_rects = random.sample(rects, min(50, len(rects)))  # nosec B311
-    crops = []  # to keep track of the crops that will be used in the puzzle image
+    random_rects = random.Random(seed).sample(rects, min(OSD_MAX_CROPS, len(rects)))  # nosec B311
+    # skip rectangles that are too big, probably the frame
+    random_rects = [(x, y, w, h) for x, y, w, h in random_rects if not (w > 1000 and h > 1000)]
 
     # counters for determining if image is horizontal
-    vertical_crops = 0
-    horizontal_crops = 0
-
-    for rect in random_rects:
-        x, y, w, h = rect
-        if w > 1000 and h > 1000:  # too big, probably the frame
-            continue
-        # count horizontal and vertical rects
-        if w > h:
-            horizontal_crops += 1
-        else:
-            vertical_crops += 1
-        # save crop
-        crop = img[y : y + h, x : x + w]
-        crops.append(crop)
+    horizontal_crops = sum(1 for _, _, w, h in random_rects if w > h)
+    vertical_crops = len(random_rects) - horizontal_crops
+
+    crops = [img[y : y + h, x : x + w] for x, y, w, h in random_rects]
 
     # determine whether image is vertical or horizontal
     is_horizontal = horizontal_crops >= vertical_crops
 
     # stitch together image from crops
-    composite_image_initial = compose_image(is_horizontal, crops)
+    composite_image = compose_image(is_horizontal, crops)
+    if composite_image.size == 0:
+        return composite_image
     # remove blank space
-    composite_image = crop_to_contents(composite_image_initial)
-
-    # orientation detection from tesseract
-    rot_0 = osd(composite_image)
-    rot_90 = osd(rotate_image_multiple_of_90(composite_image, 90))
-    rot_180 = osd(rotate_image_multiple_of_90(composite_image, 180))
-    rot_270 = osd(rotate_image_multiple_of_90(composite_image, 270))
-    return rot_0, rot_90, rot_180, rot_270
+    return crop_to_contents(composite_image)
+
+
+def rotate_and_determine_angles(img, quorum=OSD_QUORUM):
+    """
+    Creates a composite image from crops of the rectangles in a given img (see create_composite_image). This composite
+    image is rotated by 90, 180 and 270 (and 0) degrees. For all rotations the orientation detection is called and the
+    results are returned. The goal of this is to minimize the variance and the error that is caused by using
+    pre-trained tesseract models. By analyzing the detected orientations a common angle should be able to be
+    determined.
+    The four detections run in parallel on the shared OSD thread pool. As soon as quorum of them agree on the angle of
+    the original image, the remaining ones are cancelled and returned as None, they could not change the majority.
+    :param img: grayscale image
+    :param quorum: number of agreeing detections to stop waiting for the others
+    :return: rot_0, rot_90, rot_180, rot_270
+    """
+    composite_image = create_composite_image(img)
+    if composite_image.size == 0:
+        return None, None, None, None
+
+    # orientation detection from tesseract, each one is a separate tesseract process
+    rotations = [0, 90, 180, 270]
+    angles = dict.fromkeys(rotations)
+    probes = {}
+    for rotation in rotations:
+        image = rotate_image_multiple_of_90(composite_image, rotation) if rotation != 0 else composite_image
+        probe = OsdProbe(image)
+        probes[_osd_executor.submit(probe.run)] = (rotation, probe)
+    try:
+        pending = set(probes)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                angles[probes[future][0]] = future.result()
+            # angles of the original image, see dominant_angle
+            counts = Counter(
+                angle_diff(angle, rotation) for rotation, angle in angles.items() if angle is not None
+            ).most_common(1)
+            if counts and counts[0][1] >= quorum:
+                break
+    finally:
+        # kill the tesseract processes of the probes that are still running, the others are not started
+        for future, (_, probe) in probes.items():
+            future.cancel()
+            probe.cancel()
+    return angles[0], angles[90], angles[180], angles[270]
 
 
 def angle_diff(angle1, angle2):
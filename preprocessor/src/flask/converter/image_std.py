@@ -1,17 +1,28 @@
 import base64
 import math
+import os
 
 import cv2
 import numpy as np
 import pdf2image
 from PIL import Image
 
-from src.flask.converter.consts import LINE_WIDTH
+from src.flask.converter.consts import (
+    DESKEW_DOWNSCALE,
+    DESKEW_MAX_ANGLE,
+    DESKEW_MIN_ANGLE,
+    DESKEW_STEPS,
+    LINE_WIDTH,
+)
 from src.flask.converter.utils import binarize, rgb_to_grayscale, rotate_image
 
 # to prevent error due to images being too large
 Image.MAX_IMAGE_PIXELS = 10000000000
 
+# "morphology" uses get_angle, "projection" the faster estimator estimate_angle. morphology stays the default, as
+# the angles of projection differ on drawings with thin lines, which changes the results of stored drawings
+DESKEW_METHOD = os.getenv("PP_DESKEW_METHOD", "morphology")
+
 
 def resize_to(img, scale):
     """
@@ -122,15 +133,94 @@ def get_angle(gray_img, dimension):
     return best_angle
 
 
-def align_image(image):
+def get_ink_coordinates(gray_img):
+    """
+    Returns the coordinates of all dark pixels of a downsampled copy of the image, as used by estimate_angle.
+    :param gray_img: 2d numpy array of an grayscale image
+    :return: x coordinates, y coordinates as float arrays
+    """
+    h, w = gray_img.shape
+    small_img = cv2.resize(
+        gray_img, (max(1, w // DESKEW_DOWNSCALE), max(1, h // DESKEW_DOWNSCALE)), interpolation=cv2.INTER_AREA
+    )
+    ys, xs = np.nonzero(binarize(small_img) == 0)
+    return xs.astype(np.float32), ys.astype(np.float32)
+
+
+def projection_score(xs, ys, angle, dimension):
+    """
+    Projects the dark pixels onto the y-axis (dimension "h") or x-axis (dimension "v") of the image rotated by angle and
+    returns the sum of squares of the projection profile. Lines parallel to the axis pile up in few bins, so the score
+    is highest for the angle that makes most lines straight.
+    Pixels are split linearly between the two nearest bins, so that the score changes smoothly with the angle.
+    :param xs: x coordinates of the dark pixels
+    :param ys: y coordinates of the dark pixels
+    :param angle: angle in degrees, same direction as in rotate_image
+    :param dimension: either "v" or "h"
+    :return: score -> float
+    """
+    theta = np.radians(angle)
+    if dimension == "h":
+        projection = ys * np.cos(theta) + xs * np.sin(theta)
+    else:
+        projection = xs * np.cos(theta) - ys * np.sin(theta)
+    projection -= projection.min()
+    bins = np.floor(projection)
+    weights = projection - bins
+    bins = bins.astype(np.int64)
+    num_bins = int(bins.max()) + 2
+    profile = np.bincount(bins, 1 - weights, minlength=num_bins) + np.bincount(bins + 1, weights, minlength=num_bins)
+    return float(np.dot(profile, profile))
+
+
+def estimate_angle(gray_img, dimension):
+    """
+    Fast replacement for get_angle: determines the angle in [-5, 5] degrees that has most straight lines in the given
+    dimension using projection profiles of a downsampled binarized image.
+    First searches the angles in steps of 0.5 degrees like get_angle, then refines the best angle in finer steps
+    (see DESKEW_STEPS). Angles smaller than DESKEW_MIN_ANGLE are returned as 0.
+    :param gray_img: 2d numpy array of an grayscale image
+    :param dimension: either "v" or "h"
+    :return: best angle -> float
+    """
+    if dimension not in ("v", "h"):
+        raise Exception("Invalid direction")
+    xs, ys = get_ink_coordinates(gray_img)
+    if len(xs) == 0:
+        return 0
+
+    best_angle = 0.0
+    radius = DESKEW_MAX_ANGLE
+    for step in DESKEW_STEPS:
+        angles = np.arange(best_angle - radius, best_angle + radius + step / 2, step)
+        angles = angles[np.abs(angles) <= DESKEW_MAX_ANGLE + 1e-9]
+        scores = [projection_score(xs, ys, angle, dimension) for angle in angles]
+        best_angle = float(angles[int(np.argmax(scores))])
+        # the next search covers the neighbouring angles of this one
+        radius = step
+
+    best_angle = round(best_angle, 2)
+    if abs(best_angle) < DESKEW_MIN_ANGLE:
+        return 0
+    return best_angle
+
+
+def align_image(image, method=DESKEW_METHOD):
     """
     Aligns the image using rotation and shearing,
     so that horizontal and vertical lines are parallel to the image borders
     :param image: cv2 image to align
+    :param method: "morphology" to estimate the angles with get_angle, "projection" to use estimate_angle
     :return: aligned cv2 image
     """
-    v_angle = get_angle(image, "v")
-    h_angle = get_angle(image, "h")
+    if method == "projection":
+        v_angle = estimate_angle(image, "v")
+        h_angle = estimate_angle(image, "h")
+    elif method == "morphology":
+        v_angle = get_angle(image, "v")
+        h_angle = get_angle(image, "h")
+    else:
+        raise Exception("Invalid deskew method")
     print("angles:", h_angle, v_angle)
     print("img shape b4 rot:", image.shape)
     # first rotate so that horizontal lines are parallel to viewport
@@ -140,7 +230,8 @@ def align_image(image):
         print("img shape after rot:", image.shape)
 
     # de-shear the image
-    if v_angle != h_angle:  # shear only present if horizontal and vertical lines are not rotated by same angle
+    # shear only present if horizontal and vertical lines are not rotated by same angle
+    if abs(v_angle - h_angle) >= DESKEW_MIN_ANGLE:
         # shear factor is tan of angle,
         # factor is how much the image should be shifted to the right/ left per pixel from the center of the shearing
         # thus this is the opposite leg of a right triangle with angle shear_angle
@@ -162,22 +253,37 @@ def align_image(image):
 def convert_pdf_bytestring_to_img(bytestring):
     """
     Converts a pdf bytestring to a cv2 image. Will only return the first page of the pdf
-    :param bytestring: bytestring of a pdf file
+    :param bytestring: bytestring of a pdf file, either the raw bytes or base64 encoded (see decode_file_content)
     :return: np array
     """
-    images = pdf2image.convert_from_bytes(base64.b64decode(bytestring))
+    images = pdf2image.convert_from_bytes(bytes(decode_file_content(bytestring)))
     ret_img = images[0]
     return rgb_to_grayscale(np.array(ret_img))
 
 
+def decode_file_content(bytestring):
+    """
+    Returns the bytes of an uploaded file.
+    Files uploaded as multipart or raw request body are passed on as bytes-like objects and are returned unchanged,
+    without copying them. Files sent in json are base64 encoded strings, which might also be the string representation
+    of a bytes object.
+    :param bytestring: raw bytes (bytes, bytearray or memoryview) or base64 encoded string of a file
+    :return: bytes-like object with the content of the file
+    """
+    if isinstance(bytestring, (bytes, bytearray, memoryview)):
+        return bytestring
+    if bytestring.startswith("b'"):
+        bytestring = bytestring.replace("b'", "").replace("'", "")
+    return base64.b64decode(bytestring)
+
+
 def convert_bytestring_to_cv2(bytestring):
     """
     Converts an image bytestring to a cv2 image
-    :param bytestring: bytestring of an image file
+    :param bytestring: bytestring of an image file, either the raw bytes or base64 encoded (see decode_file_content)
     :return: np array
     """
-    bytestring = str(bytestring).replace("b'", "").replace("'", "")
-    arr = np.frombuffer(base64.b64decode(bytestring), dtype=np.uint8)
+    arr = np.frombuffer(decode_file_content(bytestring), dtype=np.uint8)
     return rgb_to_grayscale(cv2.imdecode(arr, flags=1))
 
 
@@ -0,0 +1,132 @@
+import os
+
+from src.flask.converter.image_rotation import (
+    get_image_rotation,
+    rotate_image_multiple_of_90,
+    rotate_separation_outputs,
+)
+from src.flask.converter.image_std import (
+    convert_bytestring_to_cv2,
+    convert_pdf_bytestring_to_img,
+    load_and_standardize,
+    resize_to,
+)
+from src.flask.converter.table_extract import separate
+from src.flask.converter.utils import get_cropped_views
+from src.flask.utils import report_stage, stopwatch
+
+# stages of convert_drawing in the order they are run, reported to the on_stage callback
+CONVERTER_STAGES = ["standardize", "separate", "rotation"]
+# outputs of separate that are rotated together with the standardized image, in the order of rotate_separation_outputs
+SEPARATION_OUTPUTS = [
+    "drawing",
+    "info_block_img",
+    "cleaned_drawing",
+    "burnt_rects",
+    "inner_frame",
+    "info_blocks_mask",
+    "drawing_mask",
+]
+
+
+def convert_drawing(file_content, file_name, scale, on_stage=None, detect_rotation=get_image_rotation):
+    """
+    Applies the converter steps to a file: standardization, separation into info block and drawing and rotation fix.
+    Only depends on OpenCV and Tesseract, so it can run in a separate process (see apply_preprocessing_batch).
+    Args:
+        file_content: b64 encoded file content
+        file_name: name of the file, used to check if pdf or image
+        scale: int, what the image gets resized to. we usually use 2048
+        on_stage: optional callback, called with the name of each stage of CONVERTER_STAGES when it starts
+        detect_rotation: function that returns the rotation of an info block image, see fix_rotation. If None, the
+                         rotation is not fixed and the caller has to call fix_rotation itself, e.g. because the
+                         detection needs a model that is not available in this process
+
+    Returns: dictionary with the standardized image, the separation outputs and the timings of the converter steps
+
+    """
+    # standardize image
+    report_stage(on_stage, "standardize")
+    std_time, (std_img, original_img) = stopwatch(load_and_standardize, file_content, file_name, scale)
+    # separate into info block and drawing
+    report_stage(on_stage, "separate")
+    sep_time, (drawing, info_block_img, cleaned_drawing, burnt_rects, inner_frame, info_blocks_mask, drawing_mask) = (
+        stopwatch(separate, std_img)
+    )
+    converted = {
+        "std_img": std_img,
+        "drawing": drawing,
+        "info_block_img": info_block_img,
+        "cleaned_drawing": cleaned_drawing,
+        "burnt_rects": burnt_rects,
+        "inner_frame": inner_frame,
+        "info_blocks_mask": info_blocks_mask,
+        "drawing_mask": drawing_mask,
+        "timings": {
+            "std_time": std_time,
+            "sep_time": sep_time,
+            "get_rot_time": 0,
+            "rot_img_time": 0,
+            "rot_sep_results_time": 0,
+        },
+    }
+    if detect_rotation is not None:
+        fix_rotation(converted, detect_rotation, on_stage)
+    return converted
+
+
+def fix_rotation(converted, detect_rotation, on_stage=None):
+    """
+    Detects the rotation of a drawing from its info block and rotates the standardized image and the separation outputs
+    back, if the drawing is rotated.
+    Args:
+        converted: output of convert_drawing, updated in place
+        detect_rotation: function that gets the grayscale info block image and returns the rotation of the drawing in
+                         degrees (counter-clockwise, a multiple of 90) or None if it can't be determined,
+                         e.g. get_image_rotation
+        on_stage: optional progress callback
+
+    Returns: converted
+
+    """
+    report_stage(on_stage, "rotation")
+    if len(converted["info_block_img"]) == 0:  # no info block was found
+        return converted
+    # fix image rotation if present
+    get_rot_time, rotation = stopwatch(detect_rotation, converted["info_block_img"])
+    converted["timings"]["get_rot_time"] = get_rot_time
+    if rotation is None or rotation == 0:
+        return converted
+    rot_img_time, converted["std_img"] = stopwatch(rotate_image_multiple_of_90, converted["std_img"], 360 - rotation)
+    rot_sep_results_time, rotated_outputs = stopwatch(
+        rotate_separation_outputs, *[converted[key] for key in SEPARATION_OUTPUTS], 360 - rotation
+    )
+    converted.update(zip(SEPARATION_OUTPUTS, rotated_outputs, strict=True))
+    converted["timings"].update({"rot_img_time": rot_img_time, "rot_sep_results_time": rot_sep_results_time})
+    return converted
+
+
+def load_drawing_views(data_dir, scale=2048):
+    """
+    Extracts the views of the cleaned drawings of the pdf and image files in a directory, like the shape branch of the
+    preprocessing does. Used by the export tools to compare exported models with the original ones.
+    Args:
+        data_dir: directory with pdf or image files
+        scale: int, what the drawings get resized to
+
+    Returns: list of grayscale views
+
+    """
+    views = []
+    for file_name in sorted(os.listdir(data_dir)):
+        if not file_name.lower().endswith((".pdf", ".png", ".jpg", ".jpeg")):
+            continue
+        with open(os.path.join(data_dir, file_name), "rb") as f:
+            content = f.read()
+        if file_name.lower().endswith(".pdf"):
+            image = convert_pdf_bytestring_to_img(content)
+        else:
+            image = convert_bytestring_to_cv2(content)
+        cleaned_drawing = separate(resize_to(image, scale))[2]
+        views.extend(view.image for view in get_cropped_views(cleaned_drawing))
+    return views
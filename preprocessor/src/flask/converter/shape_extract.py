@@ -8,8 +8,33 @@ from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
 from skimage.feature import blob_log
 
 from src.flask.converter.consts import LINE_WIDTH, MAX_CONTOUR_AREA, MAX_RECT_AREA, MIN_TRI_INTER_RATIO
-from src.flask.converter.table_extract import validate_rectangle
-from src.flask.converter.utils import binarize, create_mask, find_contours, get_cropped_views
+from src.flask.converter.unet_onnx import UNET_ONNX_PATH, OnnxUNet
+from src.flask.converter.utils import (
+    RectangleValidator,
+    binarize,
+    create_mask,
+    find_contours,
+    get_cropped_views,
+)
+
+# folder of the trained nnUNet model for the view segmentation
+UNET_MODEL_DIR = os.path.join(
+    os.path.dirname(__file__), "resources/nnUNet_results/Dataset001_ViewSegmentation/nnUNetTrainer__nnUNetPlans__2d"
+)
+# maximum number of views that are stacked into one forward pass of the UNet
+UNET_BATCH_SIZE = 8
+# inference settings of the UNet. "accurate" uses the sliding window settings the model was evaluated with for views
+# larger than a patch of the network. "fast" shrinks these views to the patch size, so that every view is predicted
+# in one batched forward pass, and does not weight the tiles with a gaussian
+UNET_PROFILES = {
+    "accurate": {"tile_step_size": 0.5, "use_gaussian": True, "fit_to_patch": False},
+    "fast": {"tile_step_size": 1.0, "use_gaussian": False, "fit_to_patch": True},
+}
+UNET_PROFILE = os.getenv("PP_UNET_PROFILE", "accurate")
+# "nnunet" runs the network with torch, "onnx" runs the batched forward passes of predict_views with the exported
+# network (see tools/export_unet.py) in ONNX Runtime
+UNET_BACKEND = os.getenv("PP_UNET_BACKEND", "nnunet")
+UNET_ONNX_MODEL = os.getenv("PP_UNET_ONNX_MODEL", UNET_ONNX_PATH)
 
 
 def validate_line(coords, other_coords, image):
@@ -50,6 +75,7 @@ def remove_text_and_tables(drawing):
     """
     # Binarize the image
     binary_image = binarize(drawing)
+    validator = RectangleValidator(binary_image)
 
     # Find contours in the binary image and return the contour hierarchy
     contours, hierarchy = find_contours(binary_image, return_hierarchy=True)
@@ -68,7 +94,7 @@ def remove_text_and_tables(drawing):
                 # Remove larger rectangles classified as tables
                 elif contour_area < MAX_RECT_AREA:
                     rect = cv2.boundingRect(contours[i])
-                    if validate_rectangle(rect, binary_image, threshold=MIN_TRI_INTER_RATIO):
+                    if validator.validate(rect, threshold=MIN_TRI_INTER_RATIO):
                         cv2.drawContours(drawing, contours, i, 255, cv2.FILLED)
 
     return drawing
@@ -88,9 +114,10 @@ def remove_dimension_arrows_and_lines(drawing, remove_gdt=True, unet=False, pred
         return view_wise_apply_unet(drawing, predictor)
 
     arrows_mask = np.zeros_like(drawing)
+    views = get_cropped_views(drawing)
 
     # Process each view individually for optimized execution
-    for view in get_cropped_views(drawing):
+    for view in views:
         # Detect blobs representing arrowheads
         blobs = blob_log(cv2.bitwise_not(view.image), min_sigma=2, max_sigma=16, num_sigma=14, threshold=0.5, overlap=0)
 
@@ -209,7 +236,7 @@ def remove_dimension_arrows_and_lines(drawing, remove_gdt=True, unet=False, pred
     biggest_components_image = np.ones_like(cleaned_drawing) * 255
 
     # Keep only the largest components in each view
-    for view in get_cropped_views(drawing):
+    for view in views:
         view_h, view_w = view.image.shape[:2]
         cleaned_view_image = cleaned_drawing[view.y : view.y + view_h + 1, view.x : view.x + view_w + 1]
 
@@ -231,14 +258,11 @@ def remove_dimension_arrows_and_lines(drawing, remove_gdt=True, unet=False, pred
 
 def init_unet():
     # Load and prepare UNet model for predictions
-    current_dir = os.path.dirname(__file__)
-    nnUNet_results = os.path.join(current_dir, "resources/nnUNet_results")
-
     device = "cuda" if torch.cuda.is_available() else "cpu"
 
     predictor = nnUNetPredictor(
-        tile_step_size=0.5,
-        use_gaussian=True,
+        tile_step_size=UNET_PROFILES[UNET_PROFILE]["tile_step_size"],
+        use_gaussian=UNET_PROFILES[UNET_PROFILE]["use_gaussian"],
         use_mirroring=False,
         perform_everything_on_device=True,
         device=torch.device(device),
@@ -248,76 +272,223 @@ def init_unet():
     )
 
     predictor.initialize_from_trained_model_folder(
-        os.path.join(nnUNet_results, "Dataset001_ViewSegmentation/nnUNetTrainer__nnUNetPlans__2d"),
+        UNET_MODEL_DIR,
         use_folds=["all"],
         checkpoint_name="checkpoint_final.pth",
     )
+    # only one fold is used, so the network can keep its parameters for all predictions (see predict_views)
+    predictor.network.load_state_dict(predictor.list_of_parameters[0])
+    # the torch network is kept for views that need the sliding window prediction of nnUNet
+    predictor.exported_network = OnnxUNet(UNET_ONNX_MODEL) if UNET_BACKEND == "onnx" else None
 
     return predictor
 
 
-def view_wise_apply_unet(drawing, predictor):
+def prepare_view_for_unet(view_image, max_shape=None):
     """
-    Applies a custom trained UNet model to each view in the image for segmentation-based
-    removal of dimension arrows and lines.
+    Resizes a view so that its dimensions are capped at 512 pixels and converts it to the input format of the UNet.
 
-    :param drawing: Drawing image containing dimensions and annotations
-    :return: Processed image with dimension arrows, lines, and optionally GD&T elements removed
+    :param view_image: Grayscale image of a single view
+    :param max_shape: Optional (rows, columns) the view is shrunk to fit into after capping, with aspect ratio preserved
+    :return: Float32 array of shape (3, 1, h, w) with values in [0, 1]
     """
-    shape_image = np.ones_like(drawing) * 255
+    w, h = view_image.shape
 
-    for view in get_cropped_views(drawing):
-        x, y = view.x, view.y
-        w, h = view.image.shape
+    # Calculate new dimensions capped at 512 pixels
+    new_w = min(w, 512)
+    new_h = min(h, 512)
 
-        # Leave 3D models unchanged
-        from src.flask.converter.thumb_gen import is_3d_model
+    # Resize the image with aspect ratio preserved
+    if h > w:
+        scale = new_h / h
+        new_w = int(w * scale)
+    else:
+        scale = new_w / w
+        new_h = int(h * scale)
 
-        if is_3d_model(view.image):
-            clean_view = view.image
+    # shrink further if the view does not fit into max_shape
+    if max_shape is not None and (new_w > max_shape[0] or new_h > max_shape[1]):
+        fit_scale = min(max_shape[0] / new_w, max_shape[1] / new_h)
+        new_w = max(1, int(new_w * fit_scale))
+        new_h = max(1, int(new_h * fit_scale))
 
-        else:
-            # Calculate new dimensions capped at 512 pixels
-            new_w = min(w, 512)
-            new_h = min(h, 512)
-
-            # Resize the image with aspect ratio preserved
-            if h > w:
-                scale = new_h / h
-                new_w = int(w * scale)
-            else:
-                scale = new_w / w
-                new_h = int(h * scale)
-
-            resized_image = cv2.resize(view.image, (new_h, new_w), interpolation=cv2.INTER_AREA)
-
-            # Prepare the image for UNet processing
-            img = cv2.cvtColor(resized_image, cv2.COLOR_GRAY2RGB)
-            img = np.moveaxis(img, -1, 0)
-            img = img[:, np.newaxis, ...]
-            img = img.astype(np.float32) / 255.0
-
-            props = {"spacing": (999, 1, 1)}
-
-            # Perform inference of the UNet model
-            ret = predictor.predict_single_npy_array(img, props, None, None, False)
-            prediction = np.squeeze(ret, axis=0)
-
-            # Convert to cv2 image format
-            clean_view = prediction.astype(np.uint8)
-            clean_view[clean_view < 1.5] = 0
-            clean_view[clean_view > 1.5] = 255
-            clean_view = cv2.bitwise_not(clean_view)
-
-            # Resize the image back to the original dimensions
-            clean_view = cv2.resize(clean_view, (h, w), interpolation=cv2.INTER_LINEAR)
-
-        # Merge cleand view into drawing
-        temp_image = np.ones_like(shape_image) * 255
-        temp_image[y : y + w, x : x + h] = clean_view
-        shape_image = cv2.bitwise_and(shape_image, temp_image)
-
-    # Remove remaining text and tables (GD&T)
-    shape_image = remove_text_and_tables(shape_image)
-
-    return shape_image
+    resized_image = cv2.resize(view_image, (new_h, new_w), interpolation=cv2.INTER_AREA)
+
+    # Prepare the image for UNet processing
+    img = cv2.cvtColor(resized_image, cv2.COLOR_GRAY2RGB)
+    img = np.moveaxis(img, -1, 0)
+    img = img[:, np.newaxis, ...]
+    img = img.astype(np.float32) / 255.0
+
+    return img
+
+
+def unet_prediction_to_view(prediction, w, h):
+    """
+    Converts a UNet segmentation of a view back to a cv2 image of the original view size, where only the pixels
+    classified as shape are black.
+
+    :param prediction: Segmentation of shape (1, h, w) as returned by the nnUNet predictor
+    :param w: Number of rows of the original view
+    :param h: Number of columns of the original view
+    :return: Grayscale image of the cleaned view
+    """
+    prediction = np.squeeze(prediction, axis=0)
+
+    # Convert to cv2 image format
+    clean_view = prediction.astype(np.uint8)
+    clean_view[clean_view < 1.5] = 0
+    clean_view[clean_view > 1.5] = 255
+    clean_view = cv2.bitwise_not(clean_view)
+
+    # Resize the image back to the original dimensions
+    return cv2.resize(clean_view, (h, w), interpolation=cv2.INTER_LINEAR)
+
+
+def predict_views(images, predictor):
+    """
+    Applies the UNet to several prepared views (see prepare_view_for_unet) at once.
+    Views that fit into a single patch of the network are preprocessed like nnUNet does (crop to nonzero, z-score
+    normalization, centered zero padding to the patch size) and stacked into batches, so that each batch needs only one
+    forward pass. Since such a view is covered by exactly one sliding window tile, this gives the same segmentation
+    as predictor.predict_single_npy_array, apart from near-ties that nnUNet resolves differently because it accumulates
+    the logits in half precision. Larger views fall back to the sliding window prediction of nnUNet.
+    With the onnx backend (UNET_BACKEND), the batched forward passes run in ONNX Runtime.
+
+    :param images: List of float32 arrays of shape (3, 1, h, w)
+    :param predictor: Initialized nnUNet predictor
+    :return: List of segmentations of shape (1, h, w), one for each image
+    """
+    patch_h, patch_w = predictor.configuration_manager.patch_size
+    predictions = [None] * len(images)
+
+    batch_inputs = []
+    batch_ids = []
+    batch_slices = []
+    for i, img in enumerate(images):
+        _, _, h, w = img.shape
+        # bounding box of the nonzero region, everything outside of it is background in nnUNet
+        nonzero = np.any(img != 0, axis=(0, 1))
+        rows = np.flatnonzero(nonzero.any(axis=1))
+        cols = np.flatnonzero(nonzero.any(axis=0))
+        if h > patch_h or w > patch_w or len(rows) == 0:
+            predictions[i] = predictor.predict_single_npy_array(img, {"spacing": (999, 1, 1)}, None, None, False)
+            continue
+
+        y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        cropped = img[:, 0, y0:y1, x0:x1]
+        # z-score normalization for each channel
+        normalized = np.empty_like(cropped)
+        for c in range(cropped.shape[0]):
+            normalized[c] = (cropped[c] - cropped[c].mean()) / max(cropped[c].std(), 1e-8)
+
+        # pad to the patch size with the same centering as nnUNet
+        pad_top = (patch_h - normalized.shape[1]) // 2
+        pad_left = (patch_w - normalized.shape[2]) // 2
+        padded = np.zeros((cropped.shape[0], patch_h, patch_w), dtype=np.float32)
+        padded[:, pad_top : pad_top + normalized.shape[1], pad_left : pad_left + normalized.shape[2]] = normalized
+
+        batch_inputs.append(padded)
+        batch_ids.append(i)
+        batch_slices.append((h, w, y0, y1, x0, x1, pad_top, pad_left))
+
+    # exported network of the onnx backend, see init_unet
+    network = getattr(predictor, "exported_network", None)
+    if network is None:
+        network = predictor.network.to(predictor.device)
+        network.eval()
+    for start in range(0, len(batch_inputs), UNET_BATCH_SIZE):
+        batch = torch.from_numpy(np.stack(batch_inputs[start : start + UNET_BATCH_SIZE])).to(predictor.device)
+        with torch.no_grad(), torch.autocast(predictor.device.type, enabled=predictor.device.type == "cuda"):
+            logits = network(batch)
+        segmentations = torch.argmax(logits, dim=1).cpu().numpy().astype(np.uint8)
+
+        for segmentation, i, (h, w, y0, y1, x0, x1, pad_top, pad_left) in zip(
+            segmentations,
+            batch_ids[start : start + UNET_BATCH_SIZE],
+            batch_slices[start : start + UNET_BATCH_SIZE],
+            strict=True,
+        ):
+            prediction = np.zeros((1, h, w), dtype=np.uint8)
+            prediction[0, y0:y1, x0:x1] = segmentation[pad_top : pad_top + y1 - y0, pad_left : pad_left + x1 - x0]
+            predictions[i] = prediction
+
+    return predictions
+
+
+def set_unet_profile(predictor, profile):
+    """
+    Applies the sliding window settings of a profile of UNET_PROFILES to a predictor.
+
+    :param predictor: Initialized nnUNet predictor
+    :param profile: Key of UNET_PROFILES
+    :return: Settings of the profile
+    """
+    if profile not in UNET_PROFILES:
+        raise Exception(f"unknown UNet profile {profile}, use one of {list(UNET_PROFILES)}")
+    settings = UNET_PROFILES[profile]
+    predictor.tile_step_size = settings["tile_step_size"]
+    predictor.use_gaussian = settings["use_gaussian"]
+    return settings
+
+
+def batch_view_wise_apply_unet(drawings, predictor, profile=UNET_PROFILE):
+    """
+    Applies the UNet to all views of several drawings, see view_wise_apply_unet.
+    The views of all drawings are predicted together using predict_views, and the cleaned views are written into the
+    shape image in place.
+
+    :param drawings: List of drawing images containing dimensions and annotations
+    :param predictor: Initialized nnUNet predictor
+    :param profile: Inference settings, key of UNET_PROFILES
+    :return: List of processed images with dimension arrows, lines, and GD&T elements removed
+    """
+    from src.flask.converter.thumb_gen import is_3d_model
+
+    settings = set_unet_profile(predictor, profile)
+    max_shape = predictor.configuration_manager.patch_size if settings["fit_to_patch"] else None
+
+    drawing_views = [get_cropped_views(drawing) for drawing in drawings]
+    # Leave 3D models unchanged
+    drawing_is_3d = [[is_3d_model(view.image) for view in views] for views in drawing_views]
+
+    # collect the views of all drawings that have to be segmented
+    unet_inputs = []
+    for views, is_3d in zip(drawing_views, drawing_is_3d, strict=True):
+        for view, view_is_3d in zip(views, is_3d, strict=True):
+            if not view_is_3d:
+                unet_inputs.append(prepare_view_for_unet(view.image, max_shape))
+    predictions = iter(predict_views(unet_inputs, predictor))
+
+    shape_images = []
+    for drawing, views, is_3d in zip(drawings, drawing_views, drawing_is_3d, strict=True):
+        shape_image = np.full_like(drawing, 255)
+
+        for view, view_is_3d in zip(views, is_3d, strict=True):
+            x, y = view.x, view.y
+            w, h = view.image.shape
+
+            clean_view = view.image if view_is_3d else unet_prediction_to_view(next(predictions), w, h)
+
+            # Merge cleaned view into drawing, views can overlap
+            view_region = shape_image[y : y + w, x : x + h]
+            np.bitwise_and(view_region, clean_view, out=view_region)
+
+        # Remove remaining text and tables (GD&T)
+        shape_images.append(remove_text_and_tables(shape_image))
+
+    return shape_images
+
+
+def view_wise_apply_unet(drawing, predictor, profile=UNET_PROFILE):
+    """
+    Applies a custom trained UNet model to each view in the image for segmentation-based
+    removal of dimension arrows and lines.
+    All views of the drawing are predicted in batched forward passes, see batch_view_wise_apply_unet.
+
+    :param drawing: Drawing image containing dimensions and annotations
+    :param predictor: Initialized nnUNet predictor
+    :param profile: Inference settings, key of UNET_PROFILES
+    :return: Processed image with dimension arrows, lines, and optionally GD&T elements removed
+    """
+    return batch_view_wise_apply_unet([drawing], predictor, profile)[0]
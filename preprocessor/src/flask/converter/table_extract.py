@@ -1,9 +1,13 @@
+import math
+from collections import defaultdict, deque
+
 import cv2
 import numpy as np
 
-from src.flask.converter.utils import binarize, find_rectangles, validate_rectangle
+from src.flask.converter.utils import RectangleValidator, binarize, find_rectangles
 from src.flask.converter.consts import (
     DIST_THRESH,
+    FIRE_GRID_CELL_SIZE,
     LINE_WIDTH,
     MAX_CONTOUR_AREA,
     MAX_RECT_AREA,
@@ -43,14 +47,14 @@ def find_inner_frame(image, rects):
     return inner_frame
 
 
-def is_corner_cell(rect, inner_frame, image):
+def is_corner_cell(rect, inner_frame, validator):
     """
     Determines if a given rectangle is a corner cell relative to the inner frame of an image.
     Corner cells are (often L-shaped) cells overlapping one or two corners of the inner frame.
 
     :param rect: A tuple (x, y, w, h) representing the coordinates and dimensions of potential corner cell.
     :param inner_frame: A tuple (x, y, w, h) representing the coordinates and dimensions of the inner frame.
-    :param image: The input image.
+    :param validator: RectangleValidator of the binarized input image.
     :return: A boolean value indicating whether the rectangle qualifies as a corner cell.
     """
 
@@ -74,14 +78,12 @@ def is_corner_cell(rect, inner_frame, image):
     # Check if the rectangle's center falls within the inner frame
     center_in_inner_frame = x1 <= x <= x1 + w1 and y1 <= y <= y1 + h1
 
-    binary_image = binarize(image)
-
-    # For corner cell candidates, validate_rectangle is called with a higher threshold
+    # For corner cell candidates, the rectangle is validated with a higher threshold
     # to avoid wrongly classifying them as rectangles
     return (
         (corners_inside == 1 or corners_inside == 2)
         and center_in_inner_frame
-        and not validate_rectangle(rect, binary_image, threshold=0.9)
+        and not validator.validate(rect, threshold=0.9)
     )
 
 
@@ -99,6 +101,7 @@ def handle_corner_cells(rects, inner_frame, image):
              - `inner_frame` is the potentially updated inner frame.
     """
     if len(inner_frame) > 0:
+        validator = RectangleValidator(binarize(image))
         # Iterate through rectangles
         for i, rect in enumerate(rects):
             w1, h1 = inner_frame[2:]
@@ -107,116 +110,101 @@ def handle_corner_cells(rects, inner_frame, image):
             area2 = w2 * h2
 
             # Update the inner frame if a larger rectangle qualifies as a corner cell
-            if area1 < area2 and is_corner_cell(inner_frame, rect, image):
+            if area1 < area2 and is_corner_cell(inner_frame, rect, validator):
                 inner_frame = rect
                 del rects[i]
 
         # Filter out all rectangles that qualify as corner cells for the updated inner frame
-        rects = [rect for rect in rects if not is_corner_cell(rect, inner_frame, image)]
+        rects = [rect for rect in rects if not is_corner_cell(rect, inner_frame, validator)]
 
     return rects, inner_frame
 
 
-class Rectangle:
-    """
-    Represents a rectangle with spatial properties and a status used in a fire propagation algorithm.
-
-    Attributes:
-        x (int): The x-coordinate of the rectangle's top-left corner.
-        y (int): The y-coordinate of the rectangle's top-left corner.
-        w (int): The width of the rectangle.
-        h (int): The height of the rectangle.
-        status (str): The current fire propagation status of the rectangle. Default is "green".
-    """
-
-    def __init__(self, x, y, w, h):
-        self.x = x
-        self.y = y
-        self.w = w
-        self.h = h
-        self.status = "green"
-
-    def intersects(self, other):
+class RectangleGrid:
+    def __init__(self, rects, cell_size=FIRE_GRID_CELL_SIZE):
         """
-        Checks if the current rectangle intersects with another rectangle.
+        Uniform grid over a list of rectangles, to find the rectangles intersecting a region without checking all of
+        them.
+        The rectangles are stored in one integer array, every grid cell holds the indices of the rectangles overlapping
+        it. Rectangles are closed boxes, i.e. (x, y, w, h) covers x to x + w and y to y + h.
 
-        :param other: Another Rectangle instance to check for intersection.
-        :return: True if rectangles intersect, False otherwise.
+        :param rects: A list of tuples (x, y, w, h).
+        :param cell_size: Side length of a grid cell in pixels.
         """
-        return not (
-            (self.x > other.x + other.w)
-            or (self.x + self.w < other.x)
-            or (self.y > other.y + other.h)
-            or (self.y + self.h < other.y)
-        )
-
-    def propagate_fire(self):
+        self.boxes = np.array(rects, dtype=np.int64).reshape(-1, 4)
+        self.cell_size = cell_size
+        cells = defaultdict(list)
+        for i, (x, y, w, h) in enumerate(self.boxes.tolist()):
+            for cell in self.cells_of(x, y, w, h):
+                cells[cell].append(i)
+        self.cells = {cell: np.array(indices, dtype=np.int64) for cell, indices in cells.items()}
+
+    def cells_of(self, x, y, w, h):
         """
-        Changes the rectangle's status to "on fire".
+        Returns the grid cells overlapped by the box (x, y, w, h). The coordinates may be floats.
         """
-        self.status = "on fire"
+        x_start, x_end = math.floor(x / self.cell_size), math.floor((x + w) / self.cell_size)
+        y_start, y_end = math.floor(y / self.cell_size), math.floor((y + h) / self.cell_size)
+        return [(cx, cy) for cx in range(x_start, x_end + 1) for cy in range(y_start, y_end + 1)]
 
-    def burn(self):
+    def query(self, x, y, w, h):
         """
-        Changes the rectangle's status to "burnt".
+        Finds all rectangles intersecting the box (x, y, w, h), including rectangles that only touch it.
+
+        :return: numpy array with the indices of the rectangles, in ascending order.
         """
-        self.status = "burnt"
+        candidates = [self.cells[cell] for cell in self.cells_of(x, y, w, h) if cell in self.cells]
+        if not candidates:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.unique(np.concatenate(candidates))
+        bx, by, bw, bh = self.boxes[candidates].T
+        intersects = ~((bx > x + w) | (bx + bw < x) | (by > y + h) | (by + bh < y))
+        return candidates[intersects]
+
+
+def fire_edges(rect):
+    """
+    Returns the regions a burning rectangle spreads the fire to: its four edges, expanded by DIST_THRESH / 2 in every
+    direction.
+
+    :param rect: A tuple (x, y, w, h) of the burning rectangle.
+    :return: A list of four tuples (x, y, w, h).
+    """
+    x, y, w, h = rect
+    edges = [(x, y, w, 0), (x + w, y, 0, h), (x, y + h, w, 0), (x, y, 0, h)]
+    return [(x - DIST_THRESH / 2, y - DIST_THRESH / 2, w + DIST_THRESH, h + DIST_THRESH) for x, y, w, h in edges]
 
 
 def propagate_fire(rects, inner_frame):
     """
     Simulates fire propagation through a collection of rectangles, beginning from a specified inner frame.
+    A burning rectangle sets all rectangles on fire that intersect one of its edges within DIST_THRESH, so the burnt
+    rectangles are the ones reachable from the inner frame. They are found with a breadth-first search, using a
+    RectangleGrid to look up the rectangles near an edge.
 
     :param rects: A list of tuples, where each tuple (x, y, w, h) represents a rectangle's coordinates and dimensions.
     :param inner_frame: A tuple (x, y, w, h) specifying the inner frame's position and size, which initiates the fire.
-    :return: A list of tuples representing burnt rectangles' positions and sizes after the fire propagation.
+    :return: A list of tuples representing burnt rectangles' positions and sizes after the fire propagation, in the
+             order of rects.
     """
     if len(inner_frame) == 0:
         return []
 
-    # Convert the given rectangles to Rectangle objects with default "green" status
-    rectangles = [Rectangle(*rect) for rect in rects]
+    grid = RectangleGrid(rects)
+    burnt = np.zeros(len(rects), dtype=bool)
 
     # Set the inner frame on fire, initializing fire propagation from this rectangle
-    on_fire_rectangles = [Rectangle(*inner_frame)]
+    on_fire_rectangles = deque([tuple(inner_frame)])
 
-    # Fire propagation loop: checks neighboring rectangles within a specified distance and propagates fire accordingly
     while on_fire_rectangles:
-        new_on_fire_rectangles = []
-
-        for rectangle in on_fire_rectangles:
-            for other in rectangles:
-                if other.status == "green":
-                    edges = [
-                        (rectangle.x, rectangle.y, rectangle.w, 0),
-                        (rectangle.x + rectangle.w, rectangle.y, 0, rectangle.h),
-                        (rectangle.x, rectangle.y + rectangle.h, rectangle.w, 0),
-                        (rectangle.x, rectangle.y, 0, rectangle.h),
-                    ]
-
-                    # Check if other rectangles intersect with any expanded edges within the DIST_THRESH
-                    for edge in edges:
-                        x, y, w, h = edge
-                        edge_rectangle = Rectangle(
-                            x - DIST_THRESH / 2, y - DIST_THRESH / 2, w + DIST_THRESH, h + DIST_THRESH
-                        )
-
-                        if other.intersects(edge_rectangle):
-                            other.propagate_fire()
-                            on_fire_rectangles.append(other)
-
-            rectangle.burn()
-
-        on_fire_rectangles = new_on_fire_rectangles
-
-    # Collect all rectangles that ended up "burnt" after propagation
-    burnt_rects = []
-
-    for rectangle in rectangles:
-        if rectangle.status == "burnt":
-            burnt_rects.append((rectangle.x, rectangle.y, rectangle.w, rectangle.h))
+        rectangle = on_fire_rectangles.popleft()
+        for edge in fire_edges(rectangle):
+            caught_fire = grid.query(*edge)
+            caught_fire = caught_fire[~burnt[caught_fire]]
+            burnt[caught_fire] = True
+            on_fire_rectangles.extend(rects[i] for i in caught_fire)
 
-    return burnt_rects
+    return [tuple(rect) for rect, is_burnt in zip(rects, burnt, strict=True) if is_burnt]
 
 
 def expand_inner_frame(inner_frame, burnt_rects):
@@ -371,6 +359,7 @@ def remove_text_and_tables(drawing):
     :return: The cleaned drawing image with text and tables removed.
     """
     binary_image = binarize(drawing)
+    validator = RectangleValidator(binary_image)
 
     # Find contours in the thresholded image
     contours, hierarchy = cv2.findContours(cv2.bitwise_not(binary_image), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
@@ -388,7 +377,7 @@ def remove_text_and_tables(drawing):
                 # Remove rectangular areas
                 elif cv2.contourArea(contours[i]) < MAX_RECT_AREA:
                     rect = cv2.boundingRect(contours[i])
-                    if validate_rectangle(rect, binary_image):
+                    if validator.validate(rect):
                         cv2.drawContours(cleaned_drawing, contours, i, 255, cv2.FILLED)
 
     return cleaned_drawing
@@ -3,17 +3,24 @@ import numpy as np
 
 from src.flask.converter.consts import LINE_WIDTH
 from src.flask.converter.shape_extract import remove_dimension_arrows_and_lines, remove_text_and_tables
-from src.flask.converter.table_extract import validate_rectangle
-from src.flask.converter.utils import View, binarize, create_mask, find_contours, get_cropped_views
+from src.flask.converter.utils import (
+    View,
+    binarize,
+    create_mask,
+    find_contours,
+    get_cropped_views,
+    validate_rectangle,
+)
 from src.flask.shapes.vectorizer import choose_representative_embedding, generate_embeddings
 
 
-def get_representative_view(shape_image, most_representative_idx):
+def get_representative_view(shape_image, most_representative_idx, views=None):
     """
     Retrieve the most representative view from the segmented shape views.
 
     param shape_image: Shape image with segmented views.
     param most_representative_idx: Index of the most representative view.
+    param views: Optional views of shape_image as returned by get_cropped_views, if the caller already extracted them.
 
     return: Cropped image of the most representative shape view.
     """
@@ -21,7 +28,9 @@ def get_representative_view(shape_image, most_representative_idx):
     if most_representative_idx is None:
         return shape_image
 
-    shape_view = get_cropped_views(shape_image)[most_representative_idx]
+    if views is None:
+        views = get_cropped_views(shape_image)
+    shape_view = views[most_representative_idx]
 
     return shape_view.image
 
@@ -213,8 +222,9 @@ def create_thumbnail(image, drawing, info_blocks, cleaned_drawing, shape_image,
                 return view_image
 
     # If no 3d model is found return representative view
-    embeddings = generate_embeddings(shape_image)
+    shape_views = get_cropped_views(shape_image)
+    embeddings = generate_embeddings(shape_image, views=shape_views)
     idx = choose_representative_embedding(embeddings, return_index=True)
-    representative_view = get_representative_view(shape_image, idx)
+    representative_view = get_representative_view(shape_image, idx, shape_views)
 
     return representative_view
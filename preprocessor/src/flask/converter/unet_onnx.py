@@ -0,0 +1,54 @@
+import os
+
+import torch
+
+from src.flask.onnx_model import OnnxModel, export_onnx, quantize_onnx
+
+# exported UNet of the view segmentation, see tools/export_unet.py. the int8 model has quantized weights
+UNET_ONNX_DIR = os.path.join(
+    os.path.dirname(__file__),
+    "resources/nnUNet_results/Dataset001_ViewSegmentation/nnUNetTrainer__nnUNetPlans__2d/fold_all",
+)
+UNET_ONNX_PATH = os.path.join(UNET_ONNX_DIR, "unet.onnx")
+UNET_ONNX_INT8_PATH = os.path.join(UNET_ONNX_DIR, "unet_int8.onnx")
+
+
+def export_unet(predictor, path=UNET_ONNX_PATH):
+    """
+    Exports the network of an initialized nnUNet predictor to ONNX. The input has the patch size of the network and a
+    dynamic batch size, like the batches of predict_views.
+    :param predictor: initialized nnUNet predictor, see init_unet
+    :param path: path of the ONNX file
+    :return: path
+    """
+    patch_h, patch_w = predictor.configuration_manager.patch_size
+    num_channels = len(predictor.dataset_json["channel_names"])
+    example_input = torch.zeros((1, num_channels, patch_h, patch_w), dtype=torch.float32)
+    return export_onnx(predictor.network, example_input, path, OnnxUNet.input_name, OnnxUNet.output_name)
+
+
+def quantize_unet(path=UNET_ONNX_PATH, int8_path=UNET_ONNX_INT8_PATH):
+    """
+    Quantizes the weights of an exported UNet, see quantize_onnx.
+    :param path: path of the exported ONNX file
+    :param int8_path: path of the quantized ONNX file
+    :return: int8_path
+    """
+    return quantize_onnx(path, int8_path)
+
+
+class OnnxUNet(OnnxModel):
+    """
+    Runs an exported UNet (see export_unet) with ONNX Runtime on the cpu, as replacement of the forward pass of the
+    nnUNet network in predict_views.
+    """
+
+    input_name = "input"
+    output_name = "logits"
+
+    def __call__(self, batch):
+        """
+        :param batch: float32 tensor of shape (n, channels, patch_h, patch_w)
+        :return: logits as float32 tensor of shape (n, classes, patch_h, patch_w)
+        """
+        return self.run(batch)
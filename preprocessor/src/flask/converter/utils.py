@@ -91,9 +91,75 @@ def rotate_image(image, angle):
     return rotated_image
 
 
+class RectangleValidator:
+    def __init__(self, binary_image):
+        """
+        Validates rectangles against a binary image, like validate_rectangle, but only erodes the image once.
+        The coverage of the edges of a rectangle is computed from prefix sums over the rows and columns of the eroded
+        image, so validating a rectangle takes constant time instead of several passes over the whole image.
+        Args:
+            binary_image (numpy.ndarray): A binary image used for validation.
+        """
+        # Erode the binary image to account for potential gaps
+        eroded_image = erode(binary_image, kernel_size=5)
+        # dark pixels have value 255, same as cv2.bitwise_not(eroded_image)
+        ink = 255 - eroded_image.astype(np.int32)
+        self.height, self.width = ink.shape
+        # row_sums[y, x] is the sum of ink[y, :x], col_sums[y, x] is the sum of ink[:y, x]
+        self.row_sums = np.zeros((self.height, self.width + 1), dtype=np.int32)
+        np.cumsum(ink, axis=1, out=self.row_sums[:, 1:])
+        self.col_sums = np.zeros((self.height + 1, self.width), dtype=np.int32)
+        np.cumsum(ink, axis=0, out=self.col_sums[1:, :])
+
+    def intersection_ratio(self, rect):
+        """
+        Computes the ratio of the edge pixels of a rectangle that are dark in the eroded image.
+        The edge pixels are the same as drawn by cv2.rectangle with thickness 1, clipped to the image.
+        Args:
+            rect (tuple): A tuple (x, y, w, h) representing the rectangle coordinates and dimensions.
+        Returns:
+            float: intersection ratio, 0 if no edge pixel lies within the image.
+        """
+        x, y, w, h = rect
+        ink_sum = 0
+        num_pixels = 0
+
+        # top and bottom edge, including the corners
+        x_start, x_end = max(x, 0), min(x + w, self.width - 1)
+        if x_start <= x_end:
+            for row in {y, y + h}:
+                if 0 <= row < self.height:
+                    ink_sum += int(self.row_sums[row, x_end + 1]) - int(self.row_sums[row, x_start])
+                    num_pixels += x_end - x_start + 1
+
+        # left and right edge, without the corners
+        y_start, y_end = max(y + 1, 0), min(y + h - 1, self.height - 1)
+        if y_start <= y_end:
+            for col in {x, x + w}:
+                if 0 <= col < self.width:
+                    ink_sum += int(self.col_sums[y_end + 1, col]) - int(self.col_sums[y_start, col])
+                    num_pixels += y_end - y_start + 1
+
+        if num_pixels == 0:
+            return 0.0
+        return ink_sum / (255 * num_pixels)
+
+    def validate(self, rect, threshold=MIN_RECT_INTER_RATIO):
+        """
+        Validate whether the edges of a rectangle correspond to actual edges in the image based on intersection ratio.
+        Args:
+            rect (tuple): A tuple (x, y, w, h) representing the rectangle coordinates and dimensions.
+            threshold (float): Threshold for intersection ratio.
+        Returns:
+            bool: True if the rectangle intersects with the binary image with a sufficient ratio above threshold.
+        """
+        return self.intersection_ratio(rect) >= threshold
+
+
 def validate_rectangle(rect, binary_image, threshold=MIN_RECT_INTER_RATIO):
     """
     Validate whether the edges of a rectangle correspond to actual edges in an image based on intersection ratio.
+    To validate several rectangles against the same image, create a RectangleValidator once instead.
 
     Args:
         rect (tuple): A tuple (x, y, w, h) representing the rectangle coordinates and dimensions.
@@ -102,19 +168,7 @@ def validate_rectangle(rect, binary_image, threshold=MIN_RECT_INTER_RATIO):
     Returns:
         bool: True if the rectangle intersects with the binary image with a sufficient ratio above threshold.
     """
-    # Create a mask of the rectangle
-    edge_mask = np.zeros_like(binary_image)
-    x, y, w, h = rect
-    cv2.rectangle(edge_mask, (x, y), (x + w, y + h), 255, 1)
-
-    # Erode the binary image to account for potential gaps
-    binary_image = erode(binary_image, kernel_size=5)
-
-    # Compute the intersection between the rectangle and edge image
-    inter = cv2.bitwise_and(cv2.bitwise_not(binary_image), edge_mask)
-    inter_ratio = np.sum(inter) / np.sum(edge_mask)
-
-    return inter_ratio >= threshold
+    return RectangleValidator(binary_image).validate(rect, threshold)
 
 
 def find_rectangles(image):
@@ -129,6 +183,7 @@ def find_rectangles(image):
     """
     binary_image = binarize(image)
     contours = find_contours(binary_image, external_only=False)
+    validator = RectangleValidator(binary_image)
 
     rects = []
 
@@ -137,7 +192,7 @@ def find_rectangles(image):
             continue
 
         rect = cv2.boundingRect(contour)
-        if validate_rectangle(rect, binary_image):
+        if validator.validate(rect):
             rects.append(rect)
 
         else:
@@ -147,7 +202,7 @@ def find_rectangles(image):
                 approx = cv2.approxPolyDP(contour, eps * peri, True)
 
                 rect = cv2.boundingRect(approx)
-                if validate_rectangle(rect, binary_image):
+                if validator.validate(rect):
                     rects.append(rect)
                     break
 
@@ -171,6 +226,7 @@ class View:
 def get_cropped_views(image):
     """
     For a shape image, get the countours (should be the part outlines for each view) and crops them.
+    Each contour is only masked within its bounding box, not on a copy of the whole image.
     Args:
         image: grayscale image
 
@@ -185,14 +241,13 @@ def get_cropped_views(image):
     areas = []
 
     for contour in contours:
-        # draw the contours on a mask image
-        mask = np.zeros_like(image)
-        cv2.drawContours(mask, [contour], 0, 255, thickness=cv2.FILLED)
-        component = cv2.bitwise_and(cv2.bitwise_not(image), mask)
-
-        # crop the contour using its bounding box
+        # draw the contour on a mask of its bounding box
         x, y, w, h = cv2.boundingRect(contour)
-        cropped_view = component[y : y + h, x : x + w]
+        mask = np.zeros((h, w), dtype=image.dtype)
+        cv2.drawContours(mask, [contour], 0, 255, thickness=cv2.FILLED, offset=(-x, -y))
+
+        # crop the contour
+        cropped_view = cv2.bitwise_and(cv2.bitwise_not(image[y : y + h, x : x + w]), mask)
 
         cropped_views.append(View(cv2.bitwise_not(cropped_view), x, y))
         areas.append(w * h)
@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+import traceback
+from collections import deque
+
+import torch
+
+from src.flask.model_registry import get_clip_model, set_torch_threads
+from src.flask.shapes.vectorizer import CLIP_BATCH_SIZE, encode_views
+
+# whether the CLIP forward passes of concurrent requests of a process are collected into shared batches
+EMBEDDING_BATCHING = os.getenv("PP_EMBEDDING_BATCHING", "true").lower() == "true"
+# a batch is run as soon as it has this many views
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("PP_EMBEDDING_MAX_BATCH_SIZE", str(CLIP_BATCH_SIZE)))
+# ... or once its first request waited this many milliseconds for other requests
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("PP_EMBEDDING_MAX_WAIT_MS", "10"))
+
+
+class EmbeddingRequest:
+    def __init__(self, view_images):
+        """
+        Preprocessed views of one request that wait for their embeddings.
+        :param view_images: tensor of preprocessed views, see vectorizer.prepare_views
+        """
+        self.view_images = view_images
+        self.submitted_at = time.monotonic()
+        self.done = threading.Event()
+        self.embeddings = None
+        self.error = None
+
+
+class EmbeddingService:
+    def __init__(self, max_batch_size=EMBEDDING_MAX_BATCH_SIZE, max_wait_ms=EMBEDDING_MAX_WAIT_MS, load_model=None):
+        """
+        Collects the views of concurrent requests and embeds them with CLIP in shared forward passes, in one thread per
+        process. Many small batches that run at the same time compete for the cpu threads, one larger batch uses them
+        better. A batch is run once it has max_batch_size views or its first request waited max_wait_ms.
+        :param max_batch_size: maximum number of views of a batch. Requests with more views are still embedded as a
+                               whole, in forward passes of at most max_batch_size views.
+        :param max_wait_ms: maximum time the first request of a batch waits for other requests
+        :param load_model: function returning the (model, preprocess) tuple of load_clip, default: get_clip_model
+        """
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.load_model = load_model or get_clip_model
+        self._pending = deque()
+        self._pending_views = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stats = {
+            "batches": 0,
+            "requests": 0,
+            "views": 0,
+            "max_batch_views": 0,
+            "total_wait_time": 0.0,
+            "max_wait_time": 0.0,
+            "total_encode_time": 0.0,
+        }
+
+    def embed(self, view_images):
+        """
+        Embeds the views of one request together with the views of concurrent requests. Blocks until the embeddings
+        are computed. Can be passed as encode function to generate_embeddings.
+        :param view_images: tensor of preprocessed views
+        :return: float32 tensor with the embedding of each view
+        """
+        request = EmbeddingRequest(view_images)
+        with self._condition:
+            # the thread does not survive forking, so it is started by the first request of each process
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+                self._thread.start()
+            self._pending.append(request)
+            self._pending_views += len(view_images)
+            self._condition.notify_all()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.embeddings
+
+    def _next_batch(self):
+        """
+        Waits until a batch is full or its first request waited max_wait, then removes the requests of the batch from
+        the queue.
+        """
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = self._pending[0].submitted_at + self.max_wait
+            while self._pending_views < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            # requests are not split, a request that does not fit into the batch any more waits for the next one
+            batch = [self._pending.popleft()]
+            num_views = len(batch[0].view_images)
+            while self._pending and num_views + len(self._pending[0].view_images) <= self.max_batch_size:
+                batch.append(self._pending.popleft())
+                num_views += len(batch[-1].view_images)
+            self._pending_views -= num_views
+            return batch
+
+    def _encode(self, batch):
+        """
+        Embeds the views of all requests of a batch in one forward pass and hands each request its embeddings.
+        """
+        started_at = time.monotonic()
+        try:
+            set_torch_threads()
+            model = self.load_model()[0]
+            embeddings = encode_views(model, torch.cat([request.view_images for request in batch]), self.max_batch_size)
+            start = 0
+            for request in batch:
+                request.embeddings = embeddings[start : start + len(request.view_images)]
+                start += len(request.view_images)
+        except Exception as e:
+            traceback.print_exc()
+            for request in batch:
+                request.error = e
+        finally:
+            encode_time = time.monotonic() - started_at
+            num_views = sum(len(request.view_images) for request in batch)
+            wait_times = [started_at - request.submitted_at for request in batch]
+            with self._condition:
+                self._stats["batches"] += 1
+                self._stats["requests"] += len(batch)
+                self._stats["views"] += num_views
+                self._stats["max_batch_views"] = max(self._stats["max_batch_views"], num_views)
+                self._stats["total_wait_time"] += sum(wait_times)
+                self._stats["max_wait_time"] = max(self._stats["max_wait_time"], *wait_times)
+                self._stats["total_encode_time"] += encode_time
+            for request in batch:
+                request.done.set()
+
+    def _run(self):
+        while True:
+            self._encode(self._next_batch())
+
+    def stats(self):
+        """
+        Returns the number of batches, requests and views embedded by this process so far, the mean and maximum
+        number of views per batch, the mean and maximum time requests waited in the queue and the number of requests
+        that wait at the moment.
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            pending_requests = len(self._pending)
+        batches = max(stats["batches"], 1)
+        requests = max(stats["requests"], 1)
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": stats["batches"],
+            "requests": stats["requests"],
+            "views": stats["views"],
+            "pending_requests": pending_requests,
+            "mean_batch_views": stats["views"] / batches,
+            "max_batch_views": stats["max_batch_views"],
+            "mean_batch_requests": stats["requests"] / batches,
+            "mean_queue_wait_ms": stats["total_wait_time"] / requests * 1000,
+            "max_queue_wait_ms": stats["max_wait_time"] * 1000,
+            "mean_encode_ms": stats["total_encode_time"] / batches * 1000,
+        }
+
+
+_embedding_service = None
+_embedding_service_lock = threading.Lock()
+
+
+def get_embedding_service():
+    """
+    Returns the embedding service of this process, or None if batching is disabled via PP_EMBEDDING_BATCHING.
+    """
+    global _embedding_service
+    if not EMBEDDING_BATCHING:
+        return None
+    with _embedding_service_lock:
+        if _embedding_service is None:
+            _embedding_service = EmbeddingService()
+    return _embedding_service
@@ -0,0 +1,506 @@
+import contextlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+
+from src.flask.preprocess import (
+    DEFAULT_ORIENTATION,
+    OCR_PROFILE,
+    PREPROCESSING_STAGES,
+    RESULT_FIELDS,
+    apply_preprocessing,
+)
+
+JOB_DB = os.getenv("PP_JOB_DB", os.path.join(tempfile.gettempdir(), "colibri_preprocessor_jobs.sqlite3"))
+# number of threads per gunicorn worker that process jobs
+JOB_WORKERS = int(os.getenv("PP_JOB_WORKERS", "1"))
+# finished jobs and their results are removed after this many seconds
+JOB_RETENTION_SECONDS = int(os.getenv("PP_JOB_RETENTION_SECONDS", str(24 * 60 * 60)))
+# a job is marked as failed once it was started this many times by workers that died while processing it
+JOB_MAX_ATTEMPTS = int(os.getenv("PP_JOB_MAX_ATTEMPTS", "3"))
+# seconds between two lookups for new jobs, or for the result of a job that is waited for
+POLL_INTERVAL = 0.2
+# seconds between two checks for jobs of dead workers and for expired jobs
+MAINTENANCE_INTERVAL = 30
+# seconds between two heartbeats of a worker process, and after which a worker without heartbeat counts as dead
+HEARTBEAT_INTERVAL = 10
+WORKER_TIMEOUT = int(os.getenv("PP_JOB_WORKER_TIMEOUT", "60"))
+# seconds the synchronous /image_to_vector waits for its job, just under the gunicorn timeout of 600 s, so that the
+# request returns before gunicorn kills the worker
+SYNC_WAIT_SECONDS = int(os.getenv("PP_SYNC_WAIT_SECONDS", "570"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+JOB_COLUMNS = [
+    "id",
+    "status",
+    "file_name",
+    "scale",
+    "stage",
+    "error",
+    "attempts",
+    "worker_pid",
+    "created_at",
+    "started_at",
+    "finished_at",
+]
+
+
+# random token of each process, see get_worker_token
+_worker_tokens = {}
+
+
+def get_worker_token():
+    """
+    Returns a random token that identifies this process among all processes that ever used the job database.
+    The pid alone does not, as a new process can get the pid of a dead worker, e.g. after a restart of the container.
+    The token is created on first use in each process, so forked workers do not share the token of the master.
+    """
+    return _worker_tokens.setdefault(os.getpid(), uuid.uuid4().hex)
+
+
+def is_process_alive(pid):
+    """
+    Returns True if a process with the pid exists on this machine.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # exists, but belongs to another user
+        return True
+    return True
+
+
+class JobQueue:
+    def __init__(self, path):
+        """
+        Persistent queue of preprocessing jobs, stored in a SQLite database.
+        All gunicorn workers share the same database file: any worker can pick up a job submitted to another worker,
+        and jobs survive a restart of the server. Jobs of workers that died while processing them are queued again.
+        Every worker process regularly stores a heartbeat with its token (see get_worker_token) in the workers table.
+        :param path: path of the SQLite database file
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as connection:
+            # write ahead logging allows reading the status of jobs while another worker writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    file_name TEXT NOT NULL,
+                    file_content TEXT,
+                    scale INTEGER NOT NULL,
+                    fields TEXT,
+                    orientation TEXT,
+                    ocr_profile TEXT,
+                    stage TEXT,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_pid INTEGER,
+                    worker_token TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS workers (token TEXT PRIMARY KEY, pid INTEGER NOT NULL, heartbeat_at REAL)"
+            )
+            # databases created before the outputs of a job could be selected
+            columns = [row["name"] for row in connection.execute("PRAGMA table_info(jobs)")]
+            if "fields" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN fields TEXT")
+            # databases created before the orientation mode could be selected
+            if "orientation" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN orientation TEXT")
+            # databases created before the OCR profile could be selected
+            if "ocr_profile" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN ocr_profile TEXT")
+            # databases created before workers were identified by a token
+            if "worker_token" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN worker_token TEXT")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # autocommit mode, transactions are started explicitly where several statements have to be atomic
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def submit(
+        self,
+        file_content,
+        file_name,
+        scale,
+        fields=RESULT_FIELDS,
+        orientation=DEFAULT_ORIENTATION,
+        ocr_profile=OCR_PROFILE,
+    ):
+        """
+        Adds a job to the queue.
+        :param file_content: b64 encoded file content or raw bytes of the file
+        :param file_name: name of the file
+        :param scale: scale the image gets resized to
+        :param fields: outputs to compute (see resolve_fields)
+        :param orientation: how the rotation of the drawing is detected (see resolve_orientation)
+        :param ocr_profile: models and detection settings of the OCR (see resolve_ocr_profile)
+        :return: id of the job
+        """
+        job_id = uuid.uuid4().hex
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs "
+                "(id, status, file_name, file_content, scale, fields, orientation, ocr_profile, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    QUEUED,
+                    file_name,
+                    file_content,
+                    scale,
+                    json.dumps(fields),
+                    orientation,
+                    ocr_profile,
+                    time.time(),
+                ),
+            )
+        return job_id
+
+    def claim(self, pid, token):
+        """
+        Marks the oldest queued job as running by the process with the pid and token.
+        :param pid: pid of the claiming process
+        :param token: token of the claiming process, see get_worker_token
+        :return: dictionary with the id, file_name, file_content, scale, fields, orientation and ocr_profile of the job,
+                 or None if none is queued
+        """
+        with self._connect() as connection:
+            # the immediate transaction locks the database for writing, so that no two workers claim the same job
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT id, file_name, file_content, scale, fields, orientation, ocr_profile FROM jobs "
+                    "WHERE status = ? "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED,),
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE jobs SET status = ?, worker_pid = ?, worker_token = ?, started_at = ?, stage = NULL, "
+                        "attempts = attempts + 1 WHERE id = ?",
+                        (RUNNING, pid, token, time.time(), row["id"]),
+                    )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = dict(row)
+        job["fields"] = json.loads(job["fields"]) if job["fields"] is not None else RESULT_FIELDS
+        job["orientation"] = job["orientation"] or DEFAULT_ORIENTATION
+        job["ocr_profile"] = job["ocr_profile"] or OCR_PROFILE
+        return job
+
+    def set_stage(self, job_id, stage):
+        """
+        Stores the stage a running job is currently in.
+        """
+        with self._connect() as connection:
+            connection.execute("UPDATE jobs SET stage = ? WHERE id = ?", (stage, job_id))
+
+    def finish(self, job_id, result):
+        """
+        Stores the result of a job and removes the uploaded file, which is not needed anymore.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, file_content = NULL, finished_at = ? WHERE id = ?",
+                (DONE, json.dumps(result), time.time(), job_id),
+            )
+
+    def fail(self, job_id, error):
+        """
+        Marks a job as failed with an error message.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, file_content = NULL, finished_at = ? WHERE id = ?",
+                (FAILED, error, time.time(), job_id),
+            )
+
+    def get(self, job_id):
+        """
+        Returns the status of a job.
+        :param job_id: id of the job
+        :return: dictionary with the columns of JOB_COLUMNS and the progress of the job, or None if it does not exist
+        """
+        with self._connect() as connection:
+            row = connection.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["progress"] = get_progress(job["status"], job["stage"])
+        return job
+
+    def get_result(self, job_id):
+        """
+        Returns the result of a finished job, or None if the job does not exist or is not done.
+        """
+        with self._connect() as connection:
+            row = connection.execute("SELECT result FROM jobs WHERE id = ? AND status = ?", (job_id, DONE)).fetchone()
+        return json.loads(row["result"]) if row is not None else None
+
+    def wait(self, job_id, timeout=None):
+        """
+        Blocks until a job is done or failed.
+        :param job_id: id of the job
+        :param timeout: maximum time to wait in seconds, None to wait forever
+        :return: status of the job as returned by get
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in (DONE, FAILED):
+                return job
+            if deadline is not None and time.monotonic() > deadline:
+                return job
+            time.sleep(POLL_INTERVAL)
+
+    def heartbeat(self, pid, token):
+        """
+        Stores that the worker process with the pid and token is alive.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO workers (token, pid, heartbeat_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (token) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+                (token, pid, time.time()),
+            )
+
+    def requeue_stale(self, worker_timeout=WORKER_TIMEOUT):
+        """
+        Queues the running jobs of processes that do not exist anymore again, e.g. because gunicorn killed the worker
+        after a timeout. Jobs that were already started JOB_MAX_ATTEMPTS times are marked as failed instead.
+        A worker is dead if its process does not exist, or if it did not store a heartbeat for worker_timeout seconds.
+        The heartbeat catches dead workers whose pid was taken by a new process, e.g. after a restart.
+        :param worker_timeout: seconds after which a worker without heartbeat counts as dead
+        :return: number of jobs that were queued again or marked as failed
+        """
+        min_heartbeat = time.time() - worker_timeout
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute(
+                    "SELECT jobs.id, jobs.worker_pid, jobs.attempts, workers.heartbeat_at FROM jobs "
+                    "LEFT JOIN workers ON workers.token = jobs.worker_token WHERE jobs.status = ?",
+                    (RUNNING,),
+                ).fetchall()
+                stale = [
+                    row
+                    for row in rows
+                    if row["heartbeat_at"] is None
+                    or row["heartbeat_at"] < min_heartbeat
+                    or not is_process_alive(row["worker_pid"])
+                ]
+                for row in stale:
+                    if row["attempts"] >= JOB_MAX_ATTEMPTS:
+                        connection.execute(
+                            "UPDATE jobs SET status = ?, error = ?, file_content = NULL, finished_at = ? WHERE id = ?",
+                            (FAILED, "internal error: worker died while processing the job", time.time(), row["id"]),
+                        )
+                    else:
+                        connection.execute(
+                            "UPDATE jobs SET status = ?, worker_pid = NULL, worker_token = NULL, stage = NULL "
+                            "WHERE id = ?",
+                            (QUEUED, row["id"]),
+                        )
+                connection.execute("DELETE FROM workers WHERE heartbeat_at < ?", (min_heartbeat,))
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return len(stale)
+
+    def remove_expired(self, retention_seconds=JOB_RETENTION_SECONDS):
+        """
+        Removes finished jobs older than retention_seconds.
+        :return: number of removed jobs
+        """
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, time.time() - retention_seconds),
+            )
+            return cursor.rowcount
+
+    def stats(self):
+        """
+        Returns the number of jobs per status.
+        """
+        with self._connect() as connection:
+            rows = connection.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        counts.update({row["status"]: row["count"] for row in rows})
+        return counts
+
+
+def get_progress(status, stage):
+    """
+    Converts the status and current stage of a job into its progress.
+    :param status: status of the job
+    :param stage: stage of PREPROCESSING_STAGES the job is currently in, or None
+    :return: dictionary with the current stage, the number of completed stages and the total number of stages
+    """
+    num_stages = len(PREPROCESSING_STAGES)
+    if status == DONE:
+        completed_stages = num_stages
+    elif stage in PREPROCESSING_STAGES:
+        completed_stages = PREPROCESSING_STAGES.index(stage)
+    else:
+        completed_stages = 0
+    return {"stage": stage, "completed_stages": completed_stages, "num_stages": num_stages}
+
+
+class JobWorkerPool:
+    def __init__(self, queue, num_workers):
+        """
+        Fixed number of threads that process the jobs of a JobQueue. The models are shared by all threads of the
+        process (see model_registry.py), so num_workers bounds how many drawings one gunicorn worker processes at once.
+        :param queue: JobQueue
+        :param num_workers: number of threads
+        """
+        self.queue = queue
+        self.num_workers = num_workers
+        self._threads = []
+        # set when a job was submitted in this process, so that an idle thread does not wait for the next poll
+        self._wakeup = threading.Event()
+        self._last_maintenance = 0
+        self._maintenance_lock = threading.Lock()
+
+    def start(self):
+        # the first heartbeat is stored before a job can be claimed, so that no running job lacks a heartbeat
+        self.queue.heartbeat(os.getpid(), get_worker_token())
+        thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _heartbeat(self):
+        # runs in its own thread, as the job threads are busy for the whole time of a job
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                self.queue.heartbeat(os.getpid(), get_worker_token())
+            except Exception:
+                traceback.print_exc()
+
+    def wake_up(self):
+        self._wakeup.set()
+
+    def _maintain(self):
+        # only one thread per process runs the maintenance, and only every MAINTENANCE_INTERVAL seconds
+        if not self._maintenance_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() - self._last_maintenance >= MAINTENANCE_INTERVAL:
+                self._last_maintenance = time.monotonic()
+                self.queue.requeue_stale()
+                self.queue.remove_expired()
+        finally:
+            self._maintenance_lock.release()
+
+    def _run(self):
+        while True:
+            try:
+                self._maintain()
+                job = self.queue.claim(os.getpid(), get_worker_token())
+            except Exception:
+                traceback.print_exc()
+                job = None
+            if job is None:
+                self._wakeup.wait(POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self.run_job(job)
+
+    def run_job(self, job):
+        """
+        Applies the preprocessing to the file of a claimed job and stores the result or the error.
+        """
+        last_stage_index = -1
+
+        def on_stage(stage):
+            # the OCR and the shape branch run at the same time, only stages that move the progress forward are stored
+            nonlocal last_stage_index
+            stage_index = PREPROCESSING_STAGES.index(stage)
+            if stage_index > last_stage_index:
+                last_stage_index = stage_index
+                self.queue.set_stage(job["id"], stage)
+
+        try:
+            result = apply_preprocessing(
+                job["file_content"],
+                job["file_name"],
+                job["scale"],
+                on_stage=on_stage,
+                fields=job["fields"],
+                orientation=job["orientation"],
+                ocr_profile=job["ocr_profile"],
+            )
+            self.queue.finish(job["id"], result)
+        except Exception as e:
+            traceback.print_exc()
+            self.queue.fail(job["id"], "internal error: " + str(e))
+
+
+_job_queue = None
+_job_worker_pool = None
+_job_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Returns the job queue of this process and starts its worker pool on first use.
+    Must not be called before gunicorn forked the workers, as the threads of the pool do not survive forking.
+    """
+    global _job_queue, _job_worker_pool
+    with _job_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(JOB_DB)
+            _job_worker_pool = JobWorkerPool(_job_queue, JOB_WORKERS)
+            _job_worker_pool.start()
+    return _job_queue
+
+
+def submit_job(
+    file_content, file_name, scale, fields=RESULT_FIELDS, orientation=DEFAULT_ORIENTATION, ocr_profile=OCR_PROFILE
+):
+    """
+    Adds a job to the queue and wakes up an idle worker thread of this process.
+    :return: id of the job
+    """
+    job_id = get_job_queue().submit(file_content, file_name, scale, fields, orientation, ocr_profile)
+    _job_worker_pool.wake_up()
+    return job_id
@@ -0,0 +1,192 @@
+import os
+import threading
+from functools import partial
+
+import torch
+
+from src.flask.converter.shape_extract import UNET_BACKEND, init_unet
+from src.flask.ocr.paddle_ocr_engine import OCR_MODELS, OCR_PROFILE, OCR_PROFILES, OCREngine
+from src.flask.shapes.vectorizer import CLIP_BACKEND, load_clip
+
+CPU_COUNT = os.cpu_count() or 1
+# cpu thread budgets of the models. the OCR branch (paddle) and the shape branch (torch) of apply_preprocessing run at
+# the same time, so by default each of them gets half of the cpus
+TORCH_THREADS = int(os.getenv("PP_TORCH_THREADS", str(max(1, CPU_COUNT // 2))))
+PADDLE_THREADS = int(os.getenv("PP_PADDLE_THREADS", str(max(1, CPU_COUNT - CPU_COUNT // 2))))
+
+
+# models of the OCR engine of the default OCR profile
+DEFAULT_OCR_MODELS = OCR_PROFILES[OCR_PROFILE]["models"]
+
+
+def load_ocr_engine(models=DEFAULT_OCR_MODELS):
+    return OCREngine(cpu_threads=PADDLE_THREADS, models=models)
+
+
+def set_torch_threads():
+    """
+    Limits the number of threads torch uses for inference on the cpu to TORCH_THREADS.
+    Depending on the torch build the setting only applies to the calling thread, so this is called before every torch
+    inference and not only once per process.
+    """
+    if torch.get_num_threads() != TORCH_THREADS:
+        torch.set_num_threads(TORCH_THREADS)
+
+
+# functions that build each model. they are only called once per process (see get_model)
+MODEL_LOADERS = {
+    "ocr": load_ocr_engine,
+    "unet": init_unet,
+    "clip": load_clip,
+}
+# models that warm_up loads by default
+DEFAULT_MODELS = list(MODEL_LOADERS)
+# OCR engines with other models than the default OCR profile, only loaded once a request asks for a profile using them
+MODEL_LOADERS.update(
+    {f"ocr_{models}": partial(load_ocr_engine, models) for models in OCR_MODELS if models != DEFAULT_OCR_MODELS}
+)
+
+# loaded model instances, shared by all requests handled by this process
+_models = {}
+# guards loading, so that concurrent requests in threaded workers do not load the same model twice
+_load_locks = {name: threading.Lock() for name in MODEL_LOADERS}
+# guards inference for models whose predictors are not safe to call from several threads at once
+_inference_locks = {name: threading.Lock() for name in MODEL_LOADERS}
+# all OCR engines share the paddle cpu threads (PADDLE_THREADS), so only one of them runs at a time
+_inference_locks.update({name: _inference_locks["ocr"] for name in MODEL_LOADERS if name.startswith("ocr_")})
+
+
+def get_model(name):
+    """
+    Returns the cached instance of a model, loading it on first use.
+    Args:
+        name: one of the keys of MODEL_LOADERS
+
+    Returns: the model instance
+
+    """
+    model = _models.get(name)
+    if model is None:
+        with _load_locks[name]:
+            # another thread might have loaded the model while this one was waiting for the lock
+            model = _models.get(name)
+            if model is None:
+                set_torch_threads()
+                model = MODEL_LOADERS[name]()
+                _models[name] = model
+    return model
+
+
+def get_ocr_model_name(profile=None):
+    """
+    Returns the key of MODEL_LOADERS of the OCR engine that an OCR profile uses.
+    Args:
+        profile: key of OCR_PROFILES, default: OCR_PROFILE
+
+    Returns: "ocr" for the engine of the default profile, "ocr_<models>" for engines with other models
+
+    """
+    models = OCR_PROFILES[profile or OCR_PROFILE]["models"]
+    return "ocr" if models == DEFAULT_OCR_MODELS else f"ocr_{models}"
+
+
+def get_ocr_engine(profile=None):
+    """
+    Returns the cached OCREngine instance with the models of an OCR profile (default: OCR_PROFILE).
+    """
+    return get_model(get_ocr_model_name(profile))
+
+
+def get_unet_predictor():
+    """
+    Returns the cached nnUNet predictor.
+    """
+    return get_model("unet")
+
+
+def get_clip_model():
+    """
+    Returns the cached CLIP model and its preprocess function as a tuple.
+    """
+    return get_model("clip")
+
+
+def model_lock(name):
+    """
+    Returns the lock that has to be held while running inference with the model.
+    PaddleOCR and the nnUNet predictor keep state between calls, so they must not be used by several threads at once.
+    Args:
+        name: one of the keys of MODEL_LOADERS
+
+    Returns: threading.Lock
+
+    """
+    return _inference_locks[name]
+
+
+def get_preload_models():
+    """
+    Returns the models that can be loaded before the gunicorn workers are forked: the torch models only. Paddle and
+    ONNX Runtime start their thread pools as soon as a model is loaded, and thread pools do not survive a fork.
+    """
+    models = []
+    if UNET_BACKEND != "onnx":
+        models.append("unet")
+    if CLIP_BACKEND == "torch":
+        models.append("clip")
+    return models
+
+
+def preload():
+    """
+    Loads the models of get_preload_models in the gunicorn master process before the workers are forked, so that the
+    workers share their memory copy-on-write. Only the weights are loaded and no inference is run. Torch is limited to
+    one thread while loading, so that it does not start its OpenMP thread pool, which would deadlock in the forked
+    workers. The workers set their own number of torch threads (see set_torch_threads) and load the other models.
+
+    Returns: list of the loaded models
+
+    """
+    torch.set_num_threads(1)
+    names = get_preload_models()
+    for name in names:
+        with _load_locks[name]:
+            if name not in _models:
+                _models[name] = MODEL_LOADERS[name]()
+    return names
+
+
+def warm_up(names=None):
+    """
+    Loads the given models (DEFAULT_MODELS if names is None), so that the first request does not have to wait for them.
+    Called by the gunicorn hooks in gunicorn.conf.py once per worker after forking. Models that were already loaded
+    by preload are kept.
+    Args:
+        names: list of keys of MODEL_LOADERS or None
+
+    Returns: None
+
+    """
+    for name in names or DEFAULT_MODELS:
+        get_model(name)
+
+
+def is_loaded(name):
+    """
+    Returns True if the model was already loaded in this process.
+    """
+    return name in _models
+
+
+def unload(names=None):
+    """
+    Removes the given models (all models if names is None) from the registry. They will be loaded again on next use.
+    Args:
+        names: list of keys of MODEL_LOADERS or None
+
+    Returns: None
+
+    """
+    for name in names or MODEL_LOADERS:
+        with _load_locks[name]:
+            _models.pop(name, None)
@@ -1,9 +1,14 @@
+import math
 import string
 import sys
 
 import numpy as np
 from PIL import Image, ImageDraw
-from sklearn.cluster import DBSCAN
+
+# maximum distance between the outlines of two text boxes in the same cluster
+CLUSTER_DISTANCE = 20
+# minimum number of outline pixels close to a pixel of a text box outline to start or extend a cluster
+CLUSTER_MIN_POINTS = 20
 
 
 def get_center_of_bb(bb):
@@ -257,40 +262,200 @@ def get_char_to_number_ratio(text):
     return n_chars / (n_numbers + n_chars)
 
 
-def get_dbscan_input_from_bbs(bbs_and_text):
+def get_cluster_input_from_bbs(bbs_and_text):
     """
     Using bounding boxes of text, get input for clustering.
     If a bounding box contains more than 50% numbers in the text it isn't considered
     :param bbs_and_text: list of tuples: [[x,y,w,h], text]
-    :return: input for dbscan model -> list of x,y coordinates of the edges of the text bb,
-    list of booleans indicating whether the bb is used in the DBSCAN input
+    :return: input for cluster_boxes -> array of the rounded text bbs as [x_min, y_min, x_max, y_max],
+    list of booleans indicating whether the bb is used in the clustering input
     """
-    dbscan_input = []
+    boxes = []
     in_input = []
     for bb, text in bbs_and_text:
         if get_char_to_number_ratio(text) > 0.5:
             [x, y, w, h] = bb
             x, y, w, h = round(x), round(y), round(w), round(h)
-
-            # basically, all the edges are 'drawn' pixel by pixel
-            # top edge
-            for i in range(w + 1):
-                dbscan_input.append([x + i, y])
-            # bottom edge
-            for i in range(w + 1):
-                dbscan_input.append([x + i, y + h])
-
-            # right edge
-            for i in range(h + 1):
-                dbscan_input.append([x + w, y + i])
-            # left edge
-            for i in range(h + 1):
-                dbscan_input.append([x, y + i])
-
+            boxes.append([x, y, x + w, y + h])
             in_input.append(True)
         else:
             in_input.append(False)
-    return dbscan_input, in_input
+    return np.array(boxes, dtype=np.int64).reshape(-1, 4), in_input
+
+
+def get_outline_distances(box, boxes):
+    """
+    Computes the squared distances between the outline of a box and the outlines of other boxes.
+    Boxes that overlap without one containing the other have crossing outlines, a box inside another one is as far
+    from its outline as its smallest margin.
+    :param box: [x_min, y_min, x_max, y_max]
+    :param boxes: array of boxes [x_min, y_min, x_max, y_max]
+    :return: array of squared distances
+    """
+    x0, y0, x1, y1 = box
+    bx0, by0, bx1, by1 = boxes.T
+    # gap between the boxes, 0 if they overlap
+    dx = np.maximum(0, np.maximum(bx0 - x1, x0 - bx1))
+    dy = np.maximum(0, np.maximum(by0 - y1, y0 - by1))
+    box_inside = (bx0 <= x0) & (x1 <= bx1) & (by0 <= y0) & (y1 <= by1)
+    boxes_inside = (x0 <= bx0) & (bx1 <= x1) & (y0 <= by0) & (by1 <= y1)
+    box_margin = np.minimum(np.minimum(x0 - bx0, bx1 - x1), np.minimum(y0 - by0, by1 - y1))
+    boxes_margin = np.minimum(np.minimum(bx0 - x0, x1 - bx1), np.minimum(by0 - y0, y1 - by1))
+    return np.where(
+        (dx > 0) | (dy > 0),
+        dx**2 + dy**2,
+        np.where(box_inside, box_margin**2, np.where(boxes_inside, boxes_margin**2, 0)),
+    )
+
+
+def find_close_boxes(boxes, max_distance):
+    """
+    Finds all pairs of boxes whose outlines are at most max_distance apart.
+    The boxes are sorted by x_min, so every box only has to be compared to the following boxes that start at most
+    max_distance after it ends.
+    :param boxes: array of boxes [x_min, y_min, x_max, y_max]
+    :param max_distance: maximum distance between the outlines
+    :return: list of pairs of box indices
+    """
+    order = np.argsort(boxes[:, 0], kind="stable")
+    sorted_x_min = boxes[order, 0]
+    ends = np.searchsorted(sorted_x_min, boxes[order, 2] + max_distance, side="right")
+    pairs = []
+    for k, i in enumerate(order):
+        candidates = order[k + 1 : ends[k]]
+        if len(candidates) > 0:
+            close = candidates[get_outline_distances(boxes[i], boxes[candidates]) <= max_distance**2]
+            pairs.extend((i, j) for j in close.tolist())
+    return pairs
+
+
+class DisjointSets:
+    def __init__(self, n):
+        """
+        Union-find over the numbers 0 to n - 1.
+        """
+        self.parents = list(range(n))
+
+    def find(self, i):
+        """
+        Returns the representative of the set containing i.
+        """
+        while self.parents[i] != i:
+            # path halving
+            self.parents[i] = self.parents[self.parents[i]]
+            i = self.parents[i]
+        return i
+
+    def union(self, i, j):
+        """
+        Merges the sets containing i and j.
+        """
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parents[max(root_i, root_j)] = min(root_i, root_j)
+
+
+def get_outline_points(box):
+    """
+    Returns the pixels of the outline of a box, every edge is 'drawn' pixel by pixel including both end points.
+    :param box: [x_min, y_min, x_max, y_max]
+    :return: list of (x, y) tuples, the corners are contained twice
+    """
+    x0, y0, x1, y1 = box
+    return (
+        [(x, y0) for x in range(x0, x1 + 1)]
+        + [(x, y1) for x in range(x0, x1 + 1)]
+        + [(x1, y) for y in range(y0, y1 + 1)]
+        + [(x0, y) for y in range(y0, y1 + 1)]
+    )
+
+
+def count_outline_points(box, point, radius):
+    """
+    Counts the pixels of the outline of a box (see get_outline_points) that are at most radius away from a point,
+    without creating them.
+    :param box: [x_min, y_min, x_max, y_max]
+    :param point: (x, y)
+    :param radius: maximum distance
+    :return: number of pixels
+    """
+    x0, y0, x1, y1 = (int(v) for v in box)
+    px, py = point
+    count = 0
+    # distance of the point to the line of the edge, start and end of the edge and the point coordinate along it
+    for offset, start, end, p in [
+        (y0 - py, x0, x1, px),
+        (y1 - py, x0, x1, px),
+        (x1 - px, y0, y1, py),
+        (x0 - px, y0, y1, py),
+    ]:
+        if offset**2 <= radius**2:
+            reach = math.isqrt(radius**2 - offset**2)
+            count += max(0, min(end, p + reach) - max(start, p - reach) + 1)
+    return count
+
+
+def cluster_boxes(boxes, max_distance=CLUSTER_DISTANCE, min_points=CLUSTER_MIN_POINTS):
+    """
+    Clusters text boxes by the distance of their outlines. This gives the clusters of DBSCAN(eps=max_distance,
+    min_samples=min_points) on the pixels of the box outlines (see get_outline_points), which the label of a box is
+    taken from by its top left pixel, without creating one point per pixel:
+    - a box whose outline has at least min_points pixels only consists of core points, so two such boxes are in the
+      same cluster if their outlines are at most max_distance apart
+    - the outline of a smaller box is shorter than max_distance, so the core status is only computed for its pixels,
+      by counting the outline pixels of the boxes nearby
+    - a box whose top left pixel is not a core point joins the first cluster with a core point at most max_distance
+      away, like a DBSCAN border point. Without such a cluster, DBSCAN marks it as noise, it gets a cluster of its own
+    :param boxes: array of boxes [x_min, y_min, x_max, y_max]
+    :param max_distance: maximum distance between the outlines of two boxes in the same cluster
+    :param min_points: minimum number of close outline pixels of a core point
+    :return: list with the cluster label of every box. labels are numbered in the order of the first core boxes
+    """
+    n = len(boxes)
+    neighbours = [[] for _ in range(n)]
+    for i, j in find_close_boxes(boxes, max_distance):
+        neighbours[i].append(j)
+        neighbours[j].append(i)
+
+    # core pixels of the small boxes, None for boxes whose pixels are all core points
+    core_points = [None] * n
+    for i, box in enumerate(boxes.tolist()):
+        outline = get_outline_points(box)
+        if len(outline) < min_points:
+            core_points[i] = [
+                point
+                for point in dict.fromkeys(outline)
+                if sum(count_outline_points(boxes[j], point, max_distance) for j in [i, *neighbours[i]]) >= min_points
+            ]
+    has_core = [points is None or len(points) > 0 for points in core_points]
+
+    def core_point_within(j, point):
+        # whether box j has a core point at most max_distance away from point
+        if core_points[j] is None:
+            return count_outline_points(boxes[j], point, max_distance) > 0
+        return any((x - point[0]) ** 2 + (y - point[1]) ** 2 <= max_distance**2 for x, y in core_points[j])
+
+    # connect boxes with core points that are at most max_distance apart
+    clusters = DisjointSets(n)
+    for i in range(n):
+        for j in neighbours[i]:
+            if j > i and has_core[i] and has_core[j]:
+                # close boxes without small core pixel lists are always connected
+                small, other = (i, j) if core_points[i] is not None else (j, i)
+                if core_points[small] is None or any(core_point_within(other, point) for point in core_points[small]):
+                    clusters.union(i, j)
+
+    # a cluster is identified by its first box, boxes are labeled by their top left pixel
+    first_box = []
+    for i, (x, y, _, _) in enumerate(boxes.tolist()):
+        if core_points[i] is None or (x, y) in core_points[i]:
+            first_box.append(clusters.find(i))
+        else:
+            candidates = [clusters.find(j) for j in [i, *neighbours[i]] if has_core[j] and core_point_within(j, (x, y))]
+            first_box.append(min(candidates, default=i))
+
+    labels = {box: label for label, box in enumerate(sorted(set(first_box)))}
+    return [labels[box] for box in first_box]
 
 
 def get_outer_bb(bbs):
@@ -325,29 +490,21 @@ def get_outer_bb(bbs):
 
 def get_text_clusters_in_drawing(bbs_in_drawing):
     """
-    Applies DBSCAN algorithm to the bbs and finds clusters. Merges the text in the clusters accordingly.
+    Clusters the bbs by the distance of their outlines (see cluster_boxes). Merges the text in the clusters accordingly.
     :param bbs_in_drawing: list of tuples: [[x,y,w,h], text]
     :return: clusters,drawing measures->both are list of tuples:[[x_outer, y_outer, w_outer, h_outer], text]
     """
-    # DBSCAN
-    db_input, in_input = get_dbscan_input_from_bbs(bbs_in_drawing)  # dbscan input only looks at TEXT, no measures
-    if len(db_input) > 0:
-        db = DBSCAN(eps=20, min_samples=20).fit(db_input)
-        labels = db.labels_
-        n_clusters_ = len(set(labels)) - (1 if -1 in labels else 0)
-    else:  # no dbscan input
-        labels = []
-        n_clusters_ = 0
+    boxes, in_input = get_cluster_input_from_bbs(bbs_in_drawing)  # cluster input only looks at TEXT, no measures
+    labels = cluster_boxes(boxes)
+    n_clusters_ = max(labels) + 1 if len(labels) > 0 else 0
 
     # get clusters
     drawing_clusters = {x: [] for x in range(n_clusters_)}  # normal text
     drawing_measures = []  # measures
+    box_labels = iter(labels)
     for (bb, content), in_inp in zip(bbs_in_drawing, in_input, strict=True):
         if in_inp:
-            [x, y, _, _] = bb
-            # get the cluster id == label by using the top left pixel of the bb
-            label = labels[db_input.index([round(x), round(y)])]
-            drawing_clusters[label].append([bb, content])
+            drawing_clusters[next(box_labels)].append([bb, content])
         else:
             drawing_measures.append([bb, content])
 
@@ -394,26 +551,18 @@ def remove_nested_rectangles(rectangles):
     return keep_rectangles
 
 
-def merge_text_in_image(bbs, texts, rect_data, masks):
+def split_text_by_cells(bbs, texts, burnt_rects, inner_frame, masks):
     """
-    Merge text in image into coherent sections. This is split into two stages:
-    1. Spit the image into two parts: info block and drawing
-    2a. In the info block text is grouped by cells
-    2b. In the drawing block text is grouped by proximity using a clustering algorithm
-    Text is merged by sorting the positions of the bounding boxes. Lines are split using "\n", phrases split using " "
+    Splits the text into the text in the cells of the info block and the text in the drawing.
+    Text that is neither in a cell nor in the drawing is dropped.
     :param bbs: list of bounding boxes: [x,y,w,h]
     :param texts: list of texts corresponding to the bounding boxes
-    :param rect_data: [burnt_rects, inner_frame]
+    :param burnt_rects: rectangles found by the table extraction
+    :param inner_frame: [x,y,w,h] of the inner frame
     :param masks: [info_mask, drawing_mask]
-    :return: list of triples: [bounding box == [x,y,w,h], text, is_in_info_block]
+    :return: dictionary of cells (rectangles) to the list of tuples (bb, text) in them,
+    list of tuples [bb, text] in the drawing
     """
-    # get rectangles in the image
-    [burnt_rects, inner_frame] = rect_data
-    if len(inner_frame) == 0:  # cant find inner frame
-        # just return the original bounding boxes.
-        # Cant consider everything to be in the infoblock, because there are no rectangles in the drawing.
-        # Also cant consider everything to be in the drawing, because DBSCAN would be wayyyy too slow.
-        return bbs, texts, [get_char_to_number_ratio(text) > 0.5 for text in texts]
     # get mask for drawing and info block
     [info_mask, drawing_mask] = masks
 
@@ -444,6 +593,32 @@ def merge_text_in_image(bbs, texts, rect_data, masks):
         elif is_in_drawing(bb, drawing_mask):
             bbs_in_drawing.append([bb, content])
 
+    return bb_in_rect_tracker, bbs_in_drawing
+
+
+def merge_text_in_image(bbs, texts, rect_data, masks):
+    """
+    Merge text in image into coherent sections. This is split into two stages:
+    1. Spit the image into two parts: info block and drawing
+    2a. In the info block text is grouped by cells
+    2b. In the drawing block text is grouped by proximity using a clustering algorithm
+    Text is merged by sorting the positions of the bounding boxes. Lines are split using "\n", phrases split using " "
+    :param bbs: list of bounding boxes: [x,y,w,h]
+    :param texts: list of texts corresponding to the bounding boxes
+    :param rect_data: [burnt_rects, inner_frame]
+    :param masks: [info_mask, drawing_mask]
+    :return: list of triples: [bounding box == [x,y,w,h], text, is_in_info_block]
+    """
+    # get rectangles in the image
+    [burnt_rects, inner_frame] = rect_data
+    if len(inner_frame) == 0:  # cant find inner frame
+        # Cant consider everything to be in the infoblock, because there are no rectangles in the drawing.
+        # So everything is considered to be in the drawing and grouped by proximity.
+        bb_in_rect_tracker = {}
+        bbs_in_drawing = [[bb, content] for bb, content in zip(bbs, texts, strict=True)]
+    else:
+        bb_in_rect_tracker, bbs_in_drawing = split_text_by_cells(bbs, texts, burnt_rects, inner_frame, masks)
+
     ocr_bbs = []
     ocr_texts = []
     is_texts = []
@@ -1,13 +1,29 @@
-import json
 import string
-from importlib.resources import files
 
 import regex
 from rapidfuzz import fuzz
 
-import src.flask.ocr.resources.json as json_resource_dir
+from src.flask.ocr.material_index import load_material_index
 from src.flask.ocr.utils import fuzzy_match, get_numbers
 
+# the patterns of the features are compiled once
+# surfaces start with Ra/Rz/Rt and have a float/ integer after
+SURFACE_REGEX = regex.compile(r"(Ra|Rz|Rt)\s*\d+\.*\d*")
+# GDTs start with a special char, followed by a number and potentially a capital letter
+GDT_REGEX = regex.compile(r"(⌾|◯|◠|⌓|ￌ|↗|⌰|=|//|▱|∠|⌖)\s*\d+\.*\d*\s*[A-Z]*")
+# ISO, G, NPT and UNF threads, in the order they are listed in the results
+THREAD_REGEXES = [
+    regex.compile(r"(M)\d+\.*\d*(x)*\d*\.*\d*"),
+    regex.compile(r'(G)\d+/*\d*(")'),
+    regex.compile(r'\d*/*\d*"*[0-9\-x"]*\s*(NPT)\d*/*\d*"*[0-9\-x"]*'),
+    regex.compile(r'\d*/*\d*"*[0-9\-x"]*\s*(UNF)\d*/*\d*"*[0-9\-x"]*'),
+]
+# ISOs start with either 'din' or 'iso' and contain a number after, searched in lower case text
+ISO_REGEX = regex.compile(r"(din |iso )+\d+")
+# matches the characters that any match of the surface, GDT and thread patterns contains, has to be kept in line with
+# them. Most texts contain none, for those a single search is enough
+FEATURE_REGEX = regex.compile(r"R[azt]|[⌾◯◠⌓ￌ↗⌰=▱∠⌖]|//|M\d|G\d|NPT|UNF")
+
 
 def find_position_of_din_code(text, code):
     """
@@ -45,25 +61,13 @@ def get_next_n_alpha_chars(text, n):
 
 def search_for_all_occurrences_of_regex(re, text):
     """
-    Search for all occurrences of a given regex string in text.
+    Search for all non-overlapping occurrences of a given regex in text.
+    :param re: regex string or compiled regex
     :return: list of string matching the regex
     """
-    results = []
-    if len(re) == 0:
-        return results
-    # first search
-    search_result = regex.search(re, text)
-    # continue if new match found
-    while search_result is not None:
-        # append the match to the results
-        start = search_result.start()
-        end = search_result.end()
-        results.append(text[start:end])
-        # remove everything before the match from text
-        text = text[end:]
-        # search again
-        search_result = regex.search(re, text)
-    return results
+    if isinstance(re, str) and len(re) == 0:
+        return []
+    return [match.group() for match in regex.finditer(re, text)]
 
 
 def get_tolerance(text):
@@ -120,27 +124,14 @@ def get_tolerance(text):
     return tol_class, gdt_tol_class
 
 
-def get_material(text, materials):
+def get_material(text, material_index):
     """
     Fuzzy matches the text with each material in all material classes and returns the class with the best match.
     :param text: string to find matches against
-    :param materials: list of list with material names
+    :param material_index: MaterialIndex of the material classes
     :return: list of material names (the matched material class), matched material name
     """
-    best_ratio = 0
-    material_class = None
-    material_single = None
-    for mat_class in materials:
-        for mat in mat_class:
-            ratio = fuzz.partial_ratio(mat, text)
-            if ratio > best_ratio:
-                best_ratio = ratio
-                material_class = mat_class
-                material_single = mat
-    if best_ratio > 85:
-        return material_class, material_single
-    else:
-        return None
+    return material_index.get_material(text)
 
 
 def contains_surface(text):
@@ -149,7 +140,7 @@ def contains_surface(text):
     Surfaces are defined by starting with Ra/Rz/Rt and having a float/ integer after
     :return: A list of strings that are surface names
     """
-    return search_for_all_occurrences_of_regex(r"(Ra|Rz|Rt)\s*\d+\.*\d*", text)
+    return search_for_all_occurrences_of_regex(SURFACE_REGEX, text)
 
 
 def contains_gdt(text):
@@ -158,7 +149,7 @@ def contains_gdt(text):
     GDTs are defined by starting with a special char, followed by a number and potentially a capital letter
     :return: A list of strings that are GDTs
     """
-    return search_for_all_occurrences_of_regex(r"(⌾|◯|◠|⌓|ￌ|↗|⌰|=|//|▱|∠|⌖)\s*\d+\.*\d*\s*[A-Z]*", text)
+    return search_for_all_occurrences_of_regex(GDT_REGEX, text)
 
 
 def contains_thread(text):
@@ -167,11 +158,10 @@ def contains_thread(text):
     Threads could be ISO, NPT, UNF or G threads.
     :return: A list of strings that are thread names
     """
-    m_search_result = search_for_all_occurrences_of_regex(r"(M)\d+\.*\d*(x)*\d*\.*\d*", text)
-    g_search_result = search_for_all_occurrences_of_regex(r'(G)\d+/*\d*(")', text)
-    npt_search_result = search_for_all_occurrences_of_regex(r'\d*/*\d*"*[0-9\-x"]*\s*(NPT)\d*/*\d*"*[0-9\-x"]*', text)
-    unf_search_result = search_for_all_occurrences_of_regex(r'\d*/*\d*"*[0-9\-x"]*\s*(UNF)\d*/*\d*"*[0-9\-x"]*', text)
-    return m_search_result + g_search_result + npt_search_result + unf_search_result
+    threads = []
+    for thread_regex in THREAD_REGEXES:
+        threads.extend(search_for_all_occurrences_of_regex(thread_regex, text))
+    return threads
 
 
 def contains_isos(text: str):
@@ -180,7 +170,7 @@ def contains_isos(text: str):
     ISOs are defined as starting with either 'din' or 'iso' and containing a number after
     :return: A list of strings that are GDTs
     """
-    found_isos = search_for_all_occurrences_of_regex(r"(din |iso )+\d+", text.lower())
+    found_isos = search_for_all_occurrences_of_regex(ISO_REGEX, text.lower())
     isos = []
     for found_iso in found_isos:
         iso_nr = get_numbers(found_iso)
@@ -189,16 +179,23 @@ def contains_isos(text: str):
     return isos
 
 
-def extract_data(text, materials):
-    # flatten materials list
-    materials_flat = []
-    for material_class in materials:
-        materials_flat.extend(material_class)
+def scan_features(text):
+    """
+    Searches for surfaces, GDTs, threads and ISOs in the given text, with the same results as contains_surface,
+    contains_gdt, contains_thread and contains_isos.
+    :return: dictionary with the list of surfaces, GDTs, threads and ISO numbers
+    """
+    if FEATURE_REGEX.search(text) is None:
+        surfaces, gdts, threads = [], [], []
+    else:
+        surfaces, gdts, threads = contains_surface(text), contains_gdt(text), contains_thread(text)
+    return {"surfaces": surfaces, "gdts": gdts, "threads": threads, "other_isos": contains_isos(text)}
+
 
-    # keywords to classify a cell as either containing a tolerance or a material
+def extract_data(text, material_index):
+    # keywords to classify a cell as containing a tolerance, those of materials are in the material index
     keywords = {
         "general_tolerances": ["2768", "7168", "toleranz", "tolerance"],
-        "material": ["material", "werkstoff", "halbzeug"] + materials_flat,
     }
 
     # preparing data structure to store extracted data in
@@ -220,16 +217,14 @@ def extract_data(text, materials):
         tols = get_tolerance(text)
         if not (tols[0] is None and tols[1] is None):
             return_data["general_tolerances"].append(tols[0] + tols[1])
-    if fuzzy_match(text, keywords["material"]) is not None:
-        extracted_materials = get_material(text, materials)
+    if material_index.contains_material_keyword(text):
+        extracted_materials = get_material(text, material_index)
         if extracted_materials is not None:
             material_class, material = extracted_materials
             return_data["material_class"].append(material_class)
             return_data["material"].append(material)
-    return_data["surfaces"].extend(contains_surface(text))
-    return_data["gdts"].extend(contains_gdt(text))
-    return_data["threads"].extend(contains_thread(text))
-    return_data["other_isos"].extend(contains_isos(text))
+    for feature, found in scan_features(text).items():
+        return_data[feature].extend(found)
     return return_data
 
 
@@ -350,11 +345,8 @@ def extract_outer_measures(ocr_bbs, ocr_texts, is_normal_measures):
 
 
 def extract(ocr_bbs, ocr_texts, is_texts):
-    # load material classes
-    # Construct the path to the JSON file
-    json_file_path = files(json_resource_dir).joinpath("materials.json")
-    with open(json_file_path, "rb") as mat_file:
-        materials = json.load(mat_file)
+    # material classes, indexed once per process
+    material_index = load_material_index()
 
     # prepare data structure that stores extracted data
     data_dict_complete_drawing = {
@@ -372,7 +364,7 @@ def extract(ocr_bbs, ocr_texts, is_texts):
 
     # extract information from each text block
     for text, is_text in zip(ocr_texts, is_texts, strict=True):
-        blob_data = extract_data(text, materials)
+        blob_data = extract_data(text, material_index)
         # add this data to the data structure that tracks for the whole image
         data_dict_complete_drawing = extend_data_dict(data_dict_complete_drawing, blob_data)
 
@@ -0,0 +1,107 @@
+import json
+from functools import lru_cache
+from importlib.resources import files
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+import src.flask.ocr.resources.json as json_resource_dir
+
+# words that mark a text as containing a material, besides the material names themselves
+MATERIAL_KEYWORDS = ["material", "werkstoff", "halbzeug"]
+# minimum partial_ratio of a material keyword to the text, see utils.fuzzy_match
+KEYWORD_THRESHOLD = 85
+# partial_ratio a material name has to exceed to count as found in the text
+MATERIAL_THRESHOLD = 85
+
+
+class CharacterIndex:
+    def __init__(self, words):
+        """
+        Character counts of a list of words, used to skip the words that cannot reach a minimum partial_ratio to a
+        text before scoring the others with rapidfuzz.
+        partial_ratio aligns the shorter string s with a substring w of the longer one, len(w) <= len(s), and scores
+        200 * L / (len(s) + len(w)) with L the length of their longest common subsequence. As L <= len(w), a score of
+        at least t needs L >= t / (200 - t) * len(s). L is bounded by the number of characters both strings share,
+        so words that share fewer characters with the text cannot reach t and their score does not need to be computed.
+        :param words: list of words
+        """
+        self.words = list(words)
+        self.alphabet = {char: i for i, char in enumerate(sorted({char for word in self.words for char in word}))}
+        self.counts = np.zeros((len(self.words), len(self.alphabet)), dtype=np.int32)
+        for i, word in enumerate(self.words):
+            for char in word:
+                self.counts[i, self.alphabet[char]] += 1
+        self.lengths = np.array([len(word) for word in self.words])
+
+    def scores(self, text, threshold):
+        """
+        Computes fuzz.partial_ratio(word, text) of each word that can reach the threshold.
+        :param text: string to find matches against
+        :param threshold: minimum partial_ratio
+        :return: tuple (ids of the scored words in ascending order, their partial_ratio to the text)
+        """
+        text_counts = np.zeros(len(self.alphabet), dtype=np.int32)
+        for char in text:
+            i = self.alphabet.get(char)
+            if i is not None:
+                text_counts[i] += 1
+        shared = np.minimum(self.counts, text_counts).sum(axis=1)
+        # the small margin keeps words whose bound is only missed by a rounding error
+        min_shared = threshold / (200 - threshold) * np.minimum(self.lengths, len(text)) - 1e-6
+        ids = np.flatnonzero(shared >= min_shared)
+        if len(ids) == 0:
+            return ids, np.zeros(0)
+        scores = process.cdist([self.words[i] for i in ids], [text], scorer=fuzz.partial_ratio, dtype=np.float64)[:, 0]
+        return ids, scores
+
+
+class MaterialIndex:
+    def __init__(self, materials):
+        """
+        Index of the material names of all material classes for the fuzzy matching of texts against them.
+        Gives the same results as matching the text against every material name with fuzz.partial_ratio, but only
+        scores the names that share enough characters with the text.
+        :param materials: list of list with material names, one list per material class
+        """
+        self.materials = materials
+        self.classes = [material_class for material_class in materials for _ in material_class]
+        self.names = CharacterIndex([material for material_class in materials for material in material_class])
+        # fuzzy_match compares lower case strings
+        self.keywords = CharacterIndex([word.lower() for word in MATERIAL_KEYWORDS + self.names.words])
+
+    def contains_material_keyword(self, text):
+        """
+        Checks whether a material keyword or a material name is in the text, like
+        utils.fuzzy_match(text, MATERIAL_KEYWORDS + material names) is not None.
+        :param text: string to find matches against
+        :return: True if a keyword has a partial_ratio of at least KEYWORD_THRESHOLD to the text
+        """
+        if len(text) < 5:  # fuzzy_match does not bother with really short texts
+            return False
+        _, scores = self.keywords.scores(text.lower(), KEYWORD_THRESHOLD)
+        return bool(np.any(scores >= KEYWORD_THRESHOLD))
+
+    def get_material(self, text):
+        """
+        Returns the material with the highest partial_ratio to the text, the first one of equally good materials.
+        :param text: string to find matches against
+        :return: list of material names (the matched material class), matched material name or None if no material
+                 exceeds MATERIAL_THRESHOLD
+        """
+        ids, scores = self.names.scores(text, MATERIAL_THRESHOLD)
+        if len(ids) == 0:
+            return None
+        best = int(np.argmax(scores))  # the first maximum, as the ids are in the order of the materials
+        if scores[best] > MATERIAL_THRESHOLD:
+            return self.classes[ids[best]], self.names.words[ids[best]]
+        return None
+
+
+@lru_cache(maxsize=1)
+def load_material_index():
+    """
+    Loads the material classes from materials.json and builds their index once per process.
+    """
+    with open(files(json_resource_dir).joinpath("materials.json"), "rb") as mat_file:
+        return MaterialIndex(json.load(mat_file))
@@ -0,0 +1,68 @@
+import cv2
+
+from src.flask.converter.image_rotation import crop_to_contents, rotate_image_multiple_of_90
+from src.flask.converter.utils import grayscale_to_rgb
+
+# the info block is downscaled to this length of its longer side before the text detection
+ORIENTATION_MAX_SIDE = 1024
+
+
+def is_horizontal_text(bbs):
+    """
+    Decides whether most of the text in an image runs horizontally, using the shape of the detected text lines.
+    Each line votes with its length, so that long lines count more than single characters.
+    :param bbs: list of bounding boxes [x, y, w, h] of the detected text lines
+    :return: True if the horizontal lines are at least as long as the vertical ones together
+    """
+    horizontal_length = sum(w for _, _, w, h in bbs if w >= h)
+    vertical_length = sum(h for _, _, w, h in bbs if h > w)
+    return horizontal_length >= vertical_length
+
+
+def recognition_confidence(texts, scores):
+    """
+    Mean confidence of the text recognition, weighted by the number of characters of each text.
+    Upside down text gets recognized with a much lower confidence than upright text.
+    :param texts: recognized texts
+    :param scores: recognition scores of the texts
+    :return: confidence between 0 and 1, 0 if no text was recognized
+    """
+    num_chars = sum(len(text) for text in texts)
+    if num_chars == 0:
+        return 0
+    return sum(score * len(text) for text, score in zip(texts, scores, strict=True)) / num_chars
+
+
+def get_image_rotation_paddle(img, ocr_engine):
+    """
+    Determines the likely rotation angle of an image with the PaddleOCR models instead of Tesseract OSD.
+    The shape of the detected text lines tells whether the image is rotated by 0/180 or by 90/270 degrees. Of these two
+    candidates, the one whose upright image gets the more confident text recognition is chosen.
+    Needs two OCR passes for images with horizontal text and three for images with vertical text, on a downscaled copy
+    of the image (see ORIENTATION_MAX_SIDE).
+    :param img: grayscale image, usually the info block
+    :param ocr_engine: instance of OCREngine
+    :return: likely angle of rotation (counter-clockwise, like get_image_rotation). If no text is found, None.
+    """
+    img = crop_to_contents(img)
+    factor = ORIENTATION_MAX_SIDE / max(img.shape)
+    if factor < 1:
+        img = cv2.resize(img, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+    [(bbs, texts, scores)] = ocr_engine.ocr_batch_with_scores([grayscale_to_rgb(img)])
+    if len(bbs) == 0:
+        return None
+    if is_horizontal_text(bbs):
+        # the first pass already is the upright candidate 0
+        candidates = [180]
+        confidences = {0: recognition_confidence(texts, scores)}
+    else:
+        candidates = [90, 270]
+        confidences = {}
+    # rotating by 360 - rotation makes the image upright if it is rotated by rotation, see convert_drawing
+    results = ocr_engine.ocr_batch_with_scores(
+        [grayscale_to_rgb(rotate_image_multiple_of_90(img, 360 - rotation)) for rotation in candidates]
+    )
+    for rotation, (_, texts, scores) in zip(candidates, results, strict=True):
+        confidences[rotation] = recognition_confidence(texts, scores)
+    return max(confidences, key=confidences.get)
@@ -1,34 +1,174 @@
+import os
 from importlib.resources import files
 
+import cv2
 import numpy as np
 import paddle
 from paddleocr import PaddleOCR
 
 import src.flask.ocr.resources.paddleocr_files as paddleocr_dir
 
+# folders of the PaddleOCR text detection and recognition models
+OCR_DETECTION_MODEL_DIR = str(files(paddleocr_dir).joinpath("./PP-OCRv5_server_det/"))
+OCR_RECOGNITION_MODEL_DIR = str(files(paddleocr_dir).joinpath("./PP-OCRv5_server_rec/"))
+
+# models of the OCR engines. models that are not in paddleocr_files are downloaded by PaddleOCR on first use.
+# the recognition model is fine-tuned on drawings with its own character dictionary and only exists as server model,
+# so the mobile engine only swaps the detection model. recognition_batch_size None keeps the default of PaddleOCR
+OCR_MODELS = {
+    "server": {
+        "detection_model": "PP-OCRv5_server_det",
+        "recognition_model": "PP-OCRv5_server_rec",
+        "recognition_batch_size": None,
+    },
+    "mobile": {
+        "detection_model": "PP-OCRv5_mobile_det",
+        "recognition_model": "PP-OCRv5_server_rec",
+        "recognition_batch_size": 16,
+    },
+}
+# settings of an OCR call. det_limit_side_len and det_limit_type limit the size of the image the text detection runs
+# on (None keeps the full resolution). with regions, the detection only runs on the part of the page that contains
+# the info block and the drawing (see crop_to_text_region), as text outside of them is dropped by merge_text_in_image
+OCR_PROFILES = {
+    "accurate": {"models": "server", "det_limit_side_len": None, "det_limit_type": None, "regions": False},
+    "regions": {"models": "server", "det_limit_side_len": None, "det_limit_type": None, "regions": True},
+    "fast": {"models": "mobile", "det_limit_side_len": 1280, "det_limit_type": "max", "regions": True},
+}
+OCR_PROFILE = os.getenv("PP_OCR_PROFILE", "accurate")
+# border around the text region, so that text at its edge is not cut off
+OCR_REGION_PADDING = 16
+# the text detection resizes images to multiples of 32 pixels. crops of such a size are not resampled, so the text in
+# them is detected like on the whole page
+OCR_REGION_ALIGNMENT = 32
+
+
+def get_model_arguments(task, model_name):
+    """
+    Returns the arguments of PaddleOCR that select a model: its folder in paddleocr_files if it is shipped with the
+    preprocessor, otherwise its name, so that PaddleOCR downloads it.
+    :param task: "detection" or "recognition"
+    :param model_name: name of the PaddleOCR model
+    return: dictionary of arguments
+    """
+    model_dir = str(files(paddleocr_dir).joinpath(model_name))
+    if os.path.isdir(model_dir):
+        return {f"text_{task}_model_dir": model_dir}
+    return {f"text_{task}_model_name": model_name}
+
+
+def align_range(start, end, size, alignment=OCR_REGION_ALIGNMENT):
+    """
+    Extends the range [start, end) to a length that is a multiple of alignment, within [0, size) if possible.
+    return: the new start and end
+    """
+    length = min(-(-(end - start) // alignment) * alignment, size)
+    start = min(start, size - length)
+    return start, start + length
+
+
+def crop_to_text_region(image, masks, padding=OCR_REGION_PADDING):
+    """
+    Crops an image to the bounding box of the dark pixels in the info block and the drawing, extended to multiples of
+    OCR_REGION_ALIGNMENT. The crop is not masked: blanking the margins changes what the detection finds next to them,
+    and text outside of both regions is dropped by merge_text_in_image anyway.
+    :param image: image to apply ocr to
+    :param masks: [info_blocks_mask, drawing_mask] of separate, True outside of the info block and the drawing
+    :param padding: border around the dark pixels that is kept
+    return: the cropped image and the offset (x, y) of the crop in the image, or (None, (0, 0)) if the region is empty
+    """
+    info_blocks_mask, drawing_mask = masks
+    # without an inner frame, separate returns masks that are False everywhere, so the whole page is kept
+    outside = np.logical_and(info_blocks_mask, drawing_mask)
+    gray = image if image.ndim == 2 else image.min(axis=2)
+    dark = np.logical_and(gray < 128, np.logical_not(outside))
+    points = cv2.findNonZero(dark.astype(np.uint8))
+    if points is None:
+        return None, (0, 0)
+    x, y, w, h = cv2.boundingRect(points)
+    x0, x1 = align_range(max(x - padding, 0), min(x + w + padding, image.shape[1]), image.shape[1])
+    y0, y1 = align_range(max(y - padding, 0), min(y + h + padding, image.shape[0]), image.shape[0])
+    return image[y0:y1, x0:x1], (x0, y0)
+
 
 class OCREngine:
-    def __init__(self):
+    def __init__(self, cpu_threads=8, models="server"):
         """
         Class encapsulating a PaddleOCR engine instance
-        :param device: "gpu" or "cpu"
+        :param cpu_threads: number of threads paddle uses for inference on the cpu
+        :param models: key of OCR_MODELS
         """
+        self.models = models
         self.ocr_engine = PaddleOCR(
-            text_detection_model_dir=str(files(paddleocr_dir).joinpath("./PP-OCRv5_server_det/")),
-            text_recognition_model_dir=str(files(paddleocr_dir).joinpath("./PP-OCRv5_server_rec/")),
+            **get_model_arguments("detection", OCR_MODELS[models]["detection_model"]),
+            **get_model_arguments("recognition", OCR_MODELS[models]["recognition_model"]),
+            text_recognition_batch_size=OCR_MODELS[models]["recognition_batch_size"],
             device="gpu" if paddle.is_compiled_with_cuda() else "cpu",
             use_doc_unwarping=False,
             use_doc_orientation_classify=False,
+            cpu_threads=cpu_threads,
         )
 
-    def ocr(self, image):
+    def ocr(self, image, profile=None, masks=None):
         """
         uses the instance of the model to ocr an image.
         :param image: image to apply ocr to
+        :param profile: key of OCR_PROFILES whose detection settings are used, default: the settings of PaddleOCR
+        :param masks: [info_blocks_mask, drawing_mask] of separate, needed by profiles that use regions
         return: list of bbs [x,y,w,h] and a list of corresponding recognized texts
         """
-        result = self.ocr_engine.predict(image)[0]  # always first page
+        return self.ocr_batch([image], profile, [masks])[0]
+
+    def ocr_batch(self, images, profile=None, masks=None):
+        """
+        uses the instance of the model to ocr several images in one call, so that paddle can batch them.
+        :param images: list of images to apply ocr to
+        :param profile: key of OCR_PROFILES whose detection settings are used, default: the settings of PaddleOCR
+        :param masks: list with the [info_blocks_mask, drawing_mask] of each image, needed by profiles that use regions
+        return: list of tuples (bbs [x,y,w,h], recognized texts), one for each image. the bbs are in the coordinates
+                of the whole image, also if only a region was given to paddle
+        """
+        if len(images) == 0:
+            return []
+        settings = OCR_PROFILES[profile] if profile is not None else {"regions": False}
+        arguments = {
+            f"text_{key}": settings[key]
+            for key in ["det_limit_side_len", "det_limit_type"]
+            if settings.get(key) is not None
+        }
+        if settings["regions"] and masks is not None:
+            crops = [crop_to_text_region(image, image_masks) for image, image_masks in zip(images, masks, strict=True)]
+        else:
+            crops = [(image, (0, 0)) for image in images]
+
+        # images without a text region are not given to paddle
+        crop_ids = [i for i, (crop, _) in enumerate(crops) if crop is not None]
+        results = [([], []) for _ in images]
+        if len(crop_ids) > 0:
+            predictions = self.ocr_engine.predict([crops[i][0] for i in crop_ids], **arguments)  # one result per image
+            for i, prediction in zip(crop_ids, predictions, strict=True):
+                results[i] = self.convert_result(prediction, crops[i][1])
+        return results
 
+    def ocr_batch_with_scores(self, images):
+        """
+        like ocr_batch, but also returns the confidence of the recognition of each text.
+        :param images: list of images to apply ocr to
+        return: list of tuples (bbs [x,y,w,h], recognized texts, recognition scores), one for each image
+        """
+        if len(images) == 0:
+            return []
+        results = self.ocr_engine.predict(images)
+        return [(*self.convert_result(result), [float(score) for score in result["rec_scores"]]) for result in results]
+
+    @staticmethod
+    def convert_result(result, offset=(0, 0)):
+        """
+        converts the result of PaddleOCR for one image.
+        :param result: PaddleOCR result for one image
+        :param offset: (x, y) position of the image that was given to PaddleOCR in the whole image
+        return: list of bbs [x,y,w,h] and a list of corresponding recognized texts
+        """
         # get polygons, which are represented as four points
         res_bbs = result["dt_polys"]
         # convert them to [x, y, w, h]
@@ -49,7 +189,7 @@ class OCREngine:
             ymax = int(y_vals.max())
 
             # calculate the result
-            converted_bbs.append([xmin, ymin, xmax - xmin, ymax - ymin])
+            converted_bbs.append([xmin + offset[0], ymin + offset[1], xmax - xmin, ymax - ymin])
 
         texts = result["rec_texts"]
         return converted_bbs, texts
@@ -1,11 +1,22 @@
 import json
 import string
+from functools import lru_cache
 from importlib.resources import files
 
 import numpy as np
+from rapidfuzz import fuzz, process
 
 import src.flask.ocr.resources.json as json_resource_dir
-from src.flask.ocr.utils import fuzzy_match, get_numbers
+from src.flask.ocr.utils import get_numbers
+
+# tolerance classes of the general tolerances
+TOL_CLASSES = ["f", "m", "c", "v"]
+GDT_TOL_CLASSES = ["h", "k", "l"]
+TOL_CLASS_IDS = {tol_class: i for i, tol_class in enumerate(TOL_CLASSES)}
+GDT_TOL_CLASS_IDS = {gdt_class: i for i, gdt_class in enumerate(GDT_TOL_CLASSES)}
+GDT_CLASSES = ["⌾", "◯", "◠", "⌓", "ￌ", "↗", "⌰", "=", "//", "▱", "∠", "⌖"]
+# translation table removing the alphabetical chars from norms
+REMOVE_LETTERS = str.maketrans("", "", string.ascii_letters)
 
 
 def get_material_vector(drawing_materials):
@@ -14,18 +25,9 @@ def get_material_vector(drawing_materials):
     :param drawing_materials: list of material classes contained in the drawing
     :return: binary material vector -> 1 indicates presence of material class, 0 otherwise
     """
-    # load material classes
-    json_file_path = files(json_resource_dir).joinpath("materials.json")
-    with open(json_file_path, "rb") as mat_file:
-        material_classes = json.load(mat_file)
-
-    # create vector with same amount of zeros as material classes
-    material_vector = np.zeros(len(material_classes))
-
-    for i, material_class in enumerate(material_classes):
-        if material_class in drawing_materials:
-            material_vector[i] = 1
-
+    vectorizer = get_extraction_vectorizer()
+    material_vector = np.zeros(len(vectorizer.material_classes))
+    vectorizer.write_material_vector(material_vector, drawing_materials)
     return material_vector
 
 
@@ -35,27 +37,25 @@ def get_tolerance_vector(tolerances):
     :param tolerances: list of tolerances == list of tuples with 2 chars
     :return: binary material vector -> 1 indicates presence of material class, 0 otherwise
     """
-    # tolerance classes
-    tol_classes = ["f", "m", "c", "v"]
-    gdt_tol_classes = ["h", "k", "l"]
+    tolerance_vector = np.zeros(len(TOL_CLASSES) + len(GDT_TOL_CLASSES))
+    write_tolerance_vector(tolerance_vector, tolerances)
+    return tolerance_vector
 
-    # init empty vectors for each tolerance type
-    tolerance_vector = np.zeros(len(tol_classes))
-    gdt_tolerance_vector = np.zeros(len(gdt_tol_classes))
 
+def write_tolerance_vector(out, tolerances):
+    """
+    Writes the tolerance vector (see get_tolerance_vector) into out, which has to be zero.
+    """
     # for each tolerance entry that was found
     for tolerance in tolerances:
         # check first value in tuple equals which tol_class
-        for i, tol_class in enumerate(tol_classes):
-            if tolerance[0].lower() == tol_class:
-                tolerance_vector[i] = 1
+        i = TOL_CLASS_IDS.get(tolerance[0].lower())
+        if i is not None:
+            out[i] = 1
         # check second value in tuple equals which gdt_tol_class
-        for i, gdt_class in enumerate(gdt_tol_classes):
-            if tolerance[1].lower() == gdt_class:
-                gdt_tolerance_vector[i] = 1
-
-    # combine and return
-    return np.append(tolerance_vector, gdt_tolerance_vector)
+        i = GDT_TOL_CLASS_IDS.get(tolerance[1].lower())
+        if i is not None:
+            out[len(TOL_CLASSES) + i] = 1
 
 
 def convert_surface_string_to_ngrade(surface_string: str):
@@ -120,19 +120,24 @@ def get_gdt_vector(gdts):
     """
     Converts a list of GDT strings to a vector that includes the smallest tolerance found for each GDT class.
     """
-    gdt_classes = ["⌾", "◯", "◠", "⌓", "ￌ", "↗", "⌰", "=", "//", "▱", "∠", "⌖"]
-    gdt_vector = np.ones(len(gdt_classes))
+    gdt_vector = np.ones(len(GDT_CLASSES))
+    write_gdt_vector(gdt_vector, gdts)
+    return gdt_vector
+
+
+def write_gdt_vector(out, gdts):
+    """
+    Writes the GDT vector (see get_gdt_vector) into out, which has to be one.
+    """
     for gdt in gdts:
-        for i, gdt_class in enumerate(gdt_classes):
+        for i, gdt_class in enumerate(GDT_CLASSES):
             # see which gdt class each found gdt is
             if gdt_class in gdt:  # class found
                 tolerance = float(get_numbers(gdt))
                 # only save to vector if there is not value already in position or the new value is smaller
                 # the goal is to only have to smallest tolerances for each gdt class, since they are the limiting factor
-                if tolerance < gdt_vector[i] or not gdt_vector[i] > 0:
-                    gdt_vector[i] = tolerance
-
-    return gdt_vector
+                if tolerance < out[i] or not out[i] > 0:
+                    out[i] = tolerance
 
 
 def get_outer_measure_vector(outer_measures):
@@ -142,46 +147,133 @@ def get_outer_measure_vector(outer_measures):
     :return: np array of length 3 with [xmax, ymax, zmax]
     """
     return_vector = np.zeros(3)
+    write_outer_measure_vector(return_vector, outer_measures)
+    return return_vector
 
-    for i, outer_measure in enumerate(outer_measures):
-        measure = outer_measure[0]
-        return_vector[i] = measure
 
-    return return_vector
+def write_outer_measure_vector(out, outer_measures):
+    """
+    Writes the outer measure vector (see get_outer_measure_vector) into out.
+    """
+    for i, outer_measure in enumerate(outer_measures):
+        out[i] = outer_measure[0]
 
 
 def convert_norm_string_to_number(norm_string: str):
     """
     Removes all alphabetical characters from norm_string.
     """
-    for char in string.ascii_letters:
-        norm_string = norm_string.replace(char, "")
-
-    return norm_string.strip()
+    return norm_string.translate(REMOVE_LETTERS).strip()
 
 
 def get_norm_vector(norms_in_image):
     """
     Converts norms_in_image to a binary vector signifying presence of common norms.
     """
-    # load common norm names
-    json_file_path = files(json_resource_dir).joinpath("norms.json")
-    with open(json_file_path, "rb") as norm_file:
-        common_norms = json.load(norm_file)
-
-    # remove alphabetical chars from norms extracted from image
-    norms_in_image = [convert_norm_string_to_number(norm_in_image) for norm_in_image in norms_in_image]
-
-    # init empty vector
-    return_vector = np.zeros(len(common_norms))
+    vectorizer = get_extraction_vectorizer()
+    return_vector = np.zeros(len(vectorizer.common_norms))
+    vectorizer.write_norm_vector(return_vector, norms_in_image)
+    return return_vector
 
-    # check each common norm for matches
-    for i, common_norm in enumerate(common_norms):
-        match_id = fuzzy_match(common_norm, norms_in_image)
-        if match_id is not None:  # match found
-            return_vector[i] = 1  # set flag in binary vector
 
-    return return_vector
+class ExtractionVectorizer:
+    def __init__(self, material_classes, common_norms):
+        """
+        Converts the data extracted from drawings to vectors, see vectorize_extraction. The material classes and common
+        norms are loaded once, and each vector is written into one preallocated array.
+        :param material_classes: list of list with material names, one list per material class
+        :param common_norms: list of norm names
+        """
+        self.material_classes = material_classes
+        # ids of the material classes, equal classes share the key
+        self.material_class_ids = {}
+        for i, material_class in enumerate(material_classes):
+            self.material_class_ids.setdefault(tuple(material_class), []).append(i)
+        self.common_norms = common_norms
+        # fuzzy_match compares lower case strings and skips the common norms shorter than 5 chars
+        self.matchable_norm_ids = [i for i, common_norm in enumerate(common_norms) if len(common_norm) >= 5]
+        self.matchable_norms = [common_norms[i].lower() for i in self.matchable_norm_ids]
+
+        # position of each part of the vector
+        lengths = {
+            "materials": len(material_classes),
+            "tolerances": len(TOL_CLASSES) + len(GDT_TOL_CLASSES),
+            "surfaces": 1,
+            "gdts": len(GDT_CLASSES),
+            "norms": len(common_norms),
+            "outer_measures": 3,
+        }
+        self.sections = {}
+        start = 0
+        for name, length in lengths.items():
+            self.sections[name] = slice(start, start + length)
+            start += length
+        self.size = start
+
+    def write_material_vector(self, out, drawing_materials):
+        """
+        Writes the material vector (see get_material_vector) into out, which has to be zero.
+        """
+        for material_class in drawing_materials:
+            # the material classes are lists, like those in drawing_materials that can be equal to one of them
+            if isinstance(material_class, list):
+                for i in self.material_class_ids.get(tuple(material_class), []):
+                    out[i] = 1
+
+    def write_norm_vector(self, out, norms_in_image):
+        """
+        Writes the norm vector (see get_norm_vector) into out, which has to be zero.
+        """
+        # remove alphabetical chars from norms extracted from image
+        norms_in_image = {convert_norm_string_to_number(norm_in_image).lower() for norm_in_image in norms_in_image}
+        if len(norms_in_image) == 0 or len(self.matchable_norms) == 0:
+            return
+        # partial_ratio of each norm extracted from the image to each common norm, like fuzzy_match
+        ratios = process.cdist(list(norms_in_image), self.matchable_norms, scorer=fuzz.partial_ratio, dtype=np.float64)
+        for i, matched in zip(self.matchable_norm_ids, np.any(ratios >= 85, axis=0), strict=True):
+            if matched:  # match found
+                out[i] = 1  # set flag in binary vector
+
+    def vectorize(self, data_dict, out=None):
+        """
+        Converts data in data_dict to a vector representation, see vectorize_extraction.
+        :param data_dict: dictionary as output from the extract function in extract.py
+        :param out: zero array of length size to write the vector into, default: a new array
+        :return: out
+        """
+        if out is None:
+            out = np.zeros(self.size)
+        self.write_material_vector(out[self.sections["materials"]], data_dict["material_class"])
+        write_tolerance_vector(out[self.sections["tolerances"]], data_dict["general_tolerances"])
+        out[self.sections["surfaces"]] = get_surface_vector(data_dict["surfaces"])
+        out[self.sections["gdts"]] = 1
+        write_gdt_vector(out[self.sections["gdts"]], data_dict["gdts"])
+        self.write_norm_vector(out[self.sections["norms"]], data_dict["other_isos"])
+        write_outer_measure_vector(out[self.sections["outer_measures"]], data_dict["outer_dimensions"])
+        return out
+
+    def vectorize_many(self, data_dicts):
+        """
+        Converts the data of many drawings to vectors, e.g. to vectorize the extracted data in the database again.
+        :param data_dicts: list of dictionaries as output from the extract function in extract.py
+        :return: numpy array of shape (len(data_dicts), size) with the vector of each drawing
+        """
+        vectors = np.zeros((len(data_dicts), self.size))
+        for data_dict, out in zip(data_dicts, vectors, strict=True):
+            self.vectorize(data_dict, out)
+        return vectors
+
+
+@lru_cache(maxsize=1)
+def get_extraction_vectorizer():
+    """
+    Loads the material classes and common norms and creates the ExtractionVectorizer once per process.
+    """
+    with open(files(json_resource_dir).joinpath("materials.json"), "rb") as mat_file:
+        material_classes = json.load(mat_file)
+    with open(files(json_resource_dir).joinpath("norms.json"), "rb") as norm_file:
+        common_norms = json.load(norm_file)
+    return ExtractionVectorizer(material_classes, common_norms)
 
 
 def vectorize_extraction(data_dict):
@@ -190,24 +282,4 @@ def vectorize_extraction(data_dict):
     :param data_dict: dictionary as output from the extract function in extract.py
     :return: numpy array
     """
-    return_vector = np.array([])
-
-    # materials
-    return_vector = np.append(return_vector, get_material_vector(data_dict["material_class"]))
-
-    # tolerances
-    return_vector = np.append(return_vector, get_tolerance_vector(data_dict["general_tolerances"]))
-
-    # surfaces
-    return_vector = np.append(return_vector, get_surface_vector(data_dict["surfaces"]))
-
-    # gdts
-    return_vector = np.append(return_vector, get_gdt_vector(data_dict["gdts"]))
-
-    # other norms
-    return_vector = np.append(return_vector, get_norm_vector(data_dict["other_isos"]))
-
-    # outer_measures
-    return_vector = np.append(return_vector, get_outer_measure_vector(data_dict["outer_dimensions"]))
-
-    return return_vector
+    return get_extraction_vectorizer().vectorize(data_dict)
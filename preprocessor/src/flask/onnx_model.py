@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import torch
+
+# weight type of the dynamically quantized models, for all exported networks. ONNX Runtime (1.31, x86) runs
+# convolutions with int8 weights several times slower than with uint8 weights: 5.7x for a small convolutional network,
+# and the patch convolution alone makes a ViT-B like encoder 1.4x slower. Its matrix multiplications are about as fast
+# with both types, so uint8 is used for the UNet and for the CLIP encoder
+QUANT_WEIGHT_TYPE = "QUInt8"
+
+
+def export_onnx(module, example_input, path, input_name, output_name):
+    """
+    Exports a torch module with one input and one output to ONNX. The batch size of both is dynamic.
+    :param module: torch module
+    :param example_input: float32 tensor with the input shape of the module and a batch size of 1
+    :param path: path of the ONNX file
+    :param input_name: name of the input in the ONNX graph
+    :param output_name: name of the output in the ONNX graph
+    :return: path
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    module = module.to("cpu").float().eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            module,
+            example_input,
+            path,
+            input_names=[input_name],
+            output_names=[output_name],
+            dynamic_axes={input_name: {0: "batch"}, output_name: {0: "batch"}},
+            dynamo=False,
+        )
+    return path
+
+
+def quantize_onnx(path, int8_path):
+    """
+    Quantizes the weights of an exported model to 8 bit, see QUANT_WEIGHT_TYPE. The activations are quantized
+    dynamically at runtime, so no calibration data is needed.
+    :param path: path of the exported ONNX file
+    :param int8_path: path of the quantized ONNX file
+    :return: int8_path
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(path, int8_path, weight_type=QuantType[QUANT_WEIGHT_TYPE])
+    return int8_path
+
+
+class OnnxModel:
+    # names of the input and the output in the ONNX graph, set by the subclasses
+    input_name = None
+    output_name = None
+
+    def __init__(self, path, num_threads=None):
+        """
+        Runs an exported model (see export_onnx) with ONNX Runtime on the cpu.
+        :param path: path of the ONNX file
+        :param num_threads: number of threads ONNX Runtime uses for one inference, default: torch.get_num_threads()
+        """
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads or torch.get_num_threads()
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def run(self, batch):
+        """
+        :param batch: float32 tensor, batch of inputs
+        :return: output as float32 tensor
+        """
+        inputs = np.ascontiguousarray(batch.cpu().numpy(), dtype=np.float32)
+        return torch.from_numpy(self.session.run([self.output_name], {self.input_name: inputs})[0])
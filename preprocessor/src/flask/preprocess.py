@@ -1,156 +1,734 @@
-from datetime import datetime
+import multiprocessing
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 
-from src.flask.converter.image_rotation import (
-    get_image_rotation,
-    rotate_image_multiple_of_90,
-    rotate_separation_outputs,
-)
-from src.flask.converter.image_std import convert_cv2_to_bytestring, load_and_standardize
-from src.flask.converter.shape_extract import init_unet, remove_dimension_arrows_and_lines
-from src.flask.converter.table_extract import separate
+from src.flask.converter.image_rotation import get_image_rotation
+from src.flask.converter.image_std import convert_cv2_to_bytestring
+from src.flask.converter.pipeline import CONVERTER_STAGES, convert_drawing, fix_rotation
+from src.flask.converter.shape_extract import batch_view_wise_apply_unet, remove_dimension_arrows_and_lines
 from src.flask.converter.utils import grayscale_to_rgb
+from src.flask.embedding_service import get_embedding_service
+from src.flask.model_registry import (
+    get_clip_model,
+    get_ocr_engine,
+    get_unet_predictor,
+    model_lock,
+    set_torch_threads,
+)
 from src.flask.ocr.context_merger import merge_text_in_image
 from src.flask.ocr.extraction import extract
-from src.flask.ocr.paddle_ocr_engine import OCREngine
+from src.flask.ocr.orientation import get_image_rotation_paddle
+from src.flask.ocr.paddle_ocr_engine import OCR_PROFILE, OCR_PROFILES
 from src.flask.ocr.vectorizer import vectorize_extraction
-from src.flask.shapes.vectorizer import choose_representative_embedding, generate_embeddings
+from src.flask.result_cache import get_result_cache
+from src.flask.shapes.vectorizer import (
+    choose_representative_embedding,
+    generate_embeddings,
+    generate_embeddings_batch,
+)
+from src.flask.stage_graph import StageGraph
+from src.flask.utils import report_stage, stopwatch
+
+# number of processes used to run the converter steps of a batch, see apply_preprocessing_batch
+BATCH_PROCESSES = int(os.getenv("PP_BATCH_PROCESSES", str(os.cpu_count() or 1)))
+# how the rotation of a drawing is detected: "osd" uses Tesseract OSD, "paddle" the PaddleOCR models (see
+# get_image_rotation_paddle). can be chosen per request, see resolve_orientation
+ORIENTATION_MODES = ["osd", "paddle"]
+DEFAULT_ORIENTATION = os.getenv("PP_ORIENTATION", "osd")
+
+# stages of apply_preprocessing in the order they are run, reported to the on_stage callback
+PREPROCESSING_STAGES = ["cache", *CONVERTER_STAGES, "ocr", "text_extraction", "remove_dim_arrows", "embeddings"]
+
+# outputs of apply_preprocessing besides the timings, in the order they appear in the result
+RESULT_FIELDS = ["drawing_data", "ocr_vector", "shape_vector", "original_drawing", "ocr_text", "ocr_bbs", "ocr_classes"]
+# named sets of outputs that can be requested instead of listing the fields
+FIELD_PROFILES = {
+    "full": RESULT_FIELDS,
+    "features": ["drawing_data", "ocr_vector", "shape_vector", "ocr_text"],
+    "vectors": ["ocr_vector", "shape_vector"],
+}
+# outputs that need the OCR branch, the feature extraction after the OCR and the shape branch
+OCR_FIELDS = {"drawing_data", "ocr_vector", "ocr_text", "ocr_bbs", "ocr_classes"}
+EXTRACTION_FIELDS = {"drawing_data", "ocr_vector", "ocr_classes"}
+SHAPE_FIELDS = {"shape_vector"}
+# timings of the branches that were skipped because none of their outputs was requested
+SKIPPED_OCR_TIMINGS = {"ocr_init_time": 0, "ocr_time": 0, "merge_time": 0, "extraction_time": 0, "vectorize_time": 0}
+SKIPPED_SHAPE_TIMINGS = {"unet_init_time": 0, "remove_dim_arrows_time": 0, "emb_time": 0, "choose_rep_emb_time": 0}
+
+_converter_pool = None
+_converter_pool_lock = threading.Lock()
+
+
+def resolve_fields(fields=None, profile=None):
+    """
+    Returns the outputs that were requested, either as list of fields or as name of a profile of FIELD_PROFILES.
+    Args:
+        fields: list of fields of RESULT_FIELDS, or None
+        profile: key of FIELD_PROFILES, or None
+
+    Returns: list of fields, all of RESULT_FIELDS if neither fields nor profile is given
+
+    """
+    if fields is None:
+        if profile is None:
+            return RESULT_FIELDS
+        if profile not in FIELD_PROFILES:
+            raise ValueError(f"unknown profile {profile}, use one of {list(FIELD_PROFILES)}")
+        return FIELD_PROFILES[profile]
+    unknown_fields = [field for field in fields if field not in RESULT_FIELDS]
+    if len(unknown_fields) > 0:
+        raise ValueError(f"unknown fields {unknown_fields}, use some of {RESULT_FIELDS}")
+    return [field for field in RESULT_FIELDS if field in fields]
 
 
-def stopwatch(func, *args, **kwargs):
+def resolve_ocr_profile(ocr_profile=None):
     """
-    Times to execution of a function.
+    Returns the OCR profile that was requested.
     Args:
-        func: the function to execute
-        *args: arguments for the function
-        **kwargs: keyword arguments for the function
+        ocr_profile: key of OCR_PROFILES, or None
+
+    Returns: OCR profile, OCR_PROFILE if none is given
+
+    """
+    if ocr_profile is None:
+        return OCR_PROFILE
+    if ocr_profile not in OCR_PROFILES:
+        raise ValueError(f"unknown OCR profile {ocr_profile}, use one of {list(OCR_PROFILES)}")
+    return ocr_profile
+
+
+def resolve_orientation(orientation=None):
+    """
+    Returns the orientation mode that was requested.
+    Args:
+        orientation: one of ORIENTATION_MODES, or None
+
+    Returns: orientation mode, DEFAULT_ORIENTATION if none is given
+
+    """
+    if orientation is None:
+        return DEFAULT_ORIENTATION
+    if orientation not in ORIENTATION_MODES:
+        raise ValueError(f"unknown orientation {orientation}, use one of {ORIENTATION_MODES}")
+    return orientation
+
+
+def select_fields(result, fields):
+    """
+    Returns a copy of a result that only contains the given fields and the timings.
+    """
+    selected = {field: result[field] for field in RESULT_FIELDS if field in fields}
+    selected["timings"] = dict(result["timings"])
+    return selected
 
-    Returns: time in seconds, result of the function
 
+def get_converter_pool():
     """
-    start = datetime.now()
-    result = func(*args, **kwargs)
-    end = datetime.now()
-    return (end - start).total_seconds(), result
+    Returns the process pool used to run the converter steps of a batch, creates it on first use.
+    Uses spawned processes, as forking a process that already loaded paddle and torch is not safe.
+    """
+    global _converter_pool
+    with _converter_pool_lock:
+        if _converter_pool is None:
+            _converter_pool = ProcessPoolExecutor(
+                max_workers=BATCH_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+            )
+    return _converter_pool
 
 
-def paddle_ocr(image, paddleocr_engine):
+def paddle_ocr(image, paddleocr_engine, ocr_profile=OCR_PROFILE, masks=None):
     """
     Helper function to be able to call stopwatch() on the text extraction.
     Args:
         image: image to extract text from
-        paddleocr_engine: instance of OCREngine
+        paddleocr_engine: instance of OCREngine with the models of the OCR profile
+        ocr_profile: key of OCR_PROFILES
+        masks: [info_blocks_mask, drawing_mask] of the image, used by profiles that only detect text in these regions
 
     Returns: bounding boxes, texts
 
     """
-    return paddleocr_engine.ocr(image)
+    with model_lock("ocr"):
+        return paddleocr_engine.ocr(image, ocr_profile, masks)
 
 
-def apply_preprocessing(file_content, file_name, scale):
+def paddle_ocr_batch(images, paddleocr_engine, ocr_profile=OCR_PROFILE, masks=None):
     """
-    Applies the preprocessing steps to a file.
+    Helper function to be able to call stopwatch() on the text extraction of several images.
+    Args:
+        images: list of images to extract text from
+        paddleocr_engine: instance of OCREngine with the models of the OCR profile
+        ocr_profile: key of OCR_PROFILES
+        masks: list with the [info_blocks_mask, drawing_mask] of each image, see paddle_ocr
+
+    Returns: list of tuples (bounding boxes, texts)
+
+    """
+    with model_lock("ocr"):
+        return paddleocr_engine.ocr_batch(images, ocr_profile, masks)
+
+
+def paddle_image_rotation(img):
+    """
+    Determines the rotation of an info block image with the OCR models of this process, see get_image_rotation_paddle.
+    Can be given to convert_drawing and fix_rotation as detect_rotation.
+    Args:
+        img: grayscale info block image
+
+    Returns: rotation in degrees or None
+
+    """
+    ocr_engine = get_ocr_engine()
+    with model_lock("ocr"):
+        return get_image_rotation_paddle(img, ocr_engine)
+
+
+# rotation detection of each orientation mode
+ROTATION_DETECTORS = {"osd": get_image_rotation, "paddle": paddle_image_rotation}
+
+
+def embedding_encoder():
+    """
+    Returns the function that embeds preprocessed views: the embedding service of the process, which batches the views
+    of concurrent requests, or None to embed them directly if batching is disabled (PP_EMBEDDING_BATCHING).
+    """
+    service = get_embedding_service()
+    return service.embed if service is not None else None
+
+
+def unet_remove_dimension_arrows_and_lines(drawing, predictor):
+    """
+    Helper function to be able to call stopwatch() on the UNet based removal of dimension arrows and lines.
     Args:
+        drawing: cleaned drawing image
+        predictor: nnUNet predictor
+
+    Returns: shape image
+
+    """
+    with model_lock("unet"):
+        return remove_dimension_arrows_and_lines(drawing, unet=True, predictor=predictor)
+
+
+def unet_remove_dimension_arrows_and_lines_batch(drawings, predictor):
+    """
+    Helper function to be able to call stopwatch() on the UNet based removal of dimension arrows and lines for several
+    drawings at once.
+    Args:
+        drawings: list of cleaned drawing images
+        predictor: nnUNet predictor
+
+    Returns: list of shape images
+
+    """
+    with model_lock("unet"):
+        return batch_view_wise_apply_unet(drawings, predictor)
+
+
+def lookup_cache(
+    cache,
+    file_content,
+    file_name,
+    scale,
+    fields=RESULT_FIELDS,
+    orientation=DEFAULT_ORIENTATION,
+    ocr_profile=OCR_PROFILE,
+):
+    """
+    Helper function to be able to call stopwatch() on the result cache lookup.
+    Args:
+        cache: ResultCache
         file_content: b64 encoded file content
-        file_name: name of the file, used to check if pdf or image
-        scale: int, what the image gets resized to. we usually use 2048
+        file_name: name of the file
+        scale: scale the image gets resized to
+        fields: outputs that are needed. a stored result that lacks any of them counts as miss
+        orientation: orientation mode, see ORIENTATION_MODES
+        ocr_profile: OCR profile, see OCR_PROFILES
 
-    Returns: dictionary with extracted features and timings
+    Returns: cache key, cached result with only the given fields or None
 
     """
-    # =========
-    # CONVERTER
-    # =========
-    # standardize image
-    std_time, (std_img, original_img) = stopwatch(load_and_standardize, file_content, file_name, scale)
-    # separate into info block and drawing
-    sep_time, (drawing, info_block_img, cleaned_drawing, burnt_rects, inner_frame, info_blocks_mask, drawing_mask) = (
-        stopwatch(separate, std_img)
+    key = cache.key(file_content, file_name, scale, orientation, ocr_profile)
+    result = cache.get(key, fields)
+    return key, select_fields(result, fields) if result is not None else None
+
+
+def add_cache_timings(result, cache, hit, lookup_time):
+    """
+    Adds whether the result came from the cache and the hit/miss counters of the cache to the timings of a result.
+    Args:
+        result: dictionary returned by apply_preprocessing
+        cache: ResultCache
+        hit: whether the result was found in the cache
+        lookup_time: time in seconds it took to look up the result
+
+    Returns: the result
+
+    """
+    result["timings"].update(
+        {
+            "cache_lookup_time": lookup_time,
+            "cache_hit": hit,
+            "cache_hits": cache.hits,
+            "cache_misses": cache.misses,
+        }
     )
-    if len(info_block_img) > 0:  # if info block was found
-        # fix image rotation if present
-        get_rot_time, rotation = stopwatch(get_image_rotation, info_block_img)
-        if rotation is not None and rotation != 0:
-            rot_img_time, std_img = stopwatch(rotate_image_multiple_of_90, std_img, 360 - rotation)
-            rot_sep_results_time, rotated_outputs = stopwatch(
-                rotate_separation_outputs,
-                drawing,
-                info_block_img,
-                cleaned_drawing,
-                burnt_rects,
-                inner_frame,
-                info_blocks_mask,
-                drawing_mask,
-                360 - rotation,
-            )
-            (
-                drawing,
-                info_block_img,
-                cleaned_drawing,
-                burnt_rects,
-                inner_frame,
-                info_blocks_mask,
-                drawing_mask,
-            ) = rotated_outputs
-        else:
-            rot_img_time = 0
-            rot_sep_results_time = 0
-    else:
-        get_rot_time = 0
-        rot_img_time = 0
-        rot_sep_results_time = 0
+    return result
 
-    # =========
-    #   OCR
-    # =========
-    # init ocr model
-    ocr_init_time, ocr_engine = stopwatch(OCREngine)
-    # make sure the ocr image is rgb, as paddle cant handle grayscale images
-    ocr_time, (text_bbs, texts) = stopwatch(paddle_ocr, grayscale_to_rgb(std_img), ocr_engine)
+
+def process_text(converted, text_bbs, texts, fields=RESULT_FIELDS):
+    """
+    Applies the steps after the OCR: merging the text into chunks, extracting features and vectorizing them.
+    Args:
+        converted: output of convert_drawing
+        text_bbs: bounding boxes found by the OCR
+        texts: texts found by the OCR
+        fields: requested outputs. the feature extraction and vectorization are skipped if they are not needed
+
+    Returns: dictionary with the OCR outputs and the timings of the steps. skipped outputs are None
+
+    """
     # merge text into chunks, such as cells in a table or text blocks
     merge_time, [ocr_bbs, ocr_texts, is_texts] = stopwatch(
-        merge_text_in_image, text_bbs, texts, [burnt_rects, inner_frame], [info_blocks_mask, drawing_mask]
+        merge_text_in_image,
+        text_bbs,
+        texts,
+        [converted["burnt_rects"], converted["inner_frame"]],
+        [converted["info_blocks_mask"], converted["drawing_mask"]],
     )
     # extract features from the text
-    extraction_time, (drawing_data, text_classification) = stopwatch(extract, ocr_bbs, ocr_texts, is_texts)
+    if EXTRACTION_FIELDS.intersection(fields):
+        extraction_time, (drawing_data, text_classification) = stopwatch(extract, ocr_bbs, ocr_texts, is_texts)
+    else:
+        extraction_time, drawing_data, text_classification = 0, None, None
     # convert features into a vector
-    vectorize_time, ocr_vector = stopwatch(vectorize_extraction, drawing_data)
-
-    # =========
-    #   SHAPES
-    # =========
-    # init unet
-    unet_init_time, predictor = stopwatch(init_unet)
-    # remove lines and arrows to get a cleaned image that can be given to CLIP
-    remove_dim_arrows_time, shape_image = stopwatch(
-        remove_dimension_arrows_and_lines, cleaned_drawing, unet=True, predictor=predictor
-    )
-    # generate CLIP embeddings from cleaned image
-    emb_time, embeddings = stopwatch(generate_embeddings, shape_image)
-    # choose the most average embedding
-    choose_rep_emb_time, shape_vector = stopwatch(choose_representative_embedding, embeddings)
+    if "ocr_vector" in fields:
+        vectorize_time, ocr_vector = stopwatch(vectorize_extraction, drawing_data)
+    else:
+        vectorize_time, ocr_vector = 0, None
 
     return {
         "drawing_data": drawing_data,
-        "ocr_vector": list(ocr_vector),
-        "shape_vector": shape_vector.tolist(),
-        "original_drawing": convert_cv2_to_bytestring(std_img),
+        "ocr_vector": ocr_vector,
         "ocr_text": ocr_texts,
         "ocr_bbs": ocr_bbs,
         "ocr_classes": text_classification,
         "timings": {
-            "std_time": std_time,
-            "sep_time": sep_time,
-            "get_rot_time": get_rot_time,
-            "rot_img_time": rot_img_time,
-            "rot_sep_results_time": rot_sep_results_time,
-            "ocr_init_time": ocr_init_time,
-            "ocr_time": ocr_time,
             "merge_time": merge_time,
             "extraction_time": extraction_time,
             "vectorize_time": vectorize_time,
-            "unet_init_time": unet_init_time,
-            "remove_dim_arrows_time": remove_dim_arrows_time,
-            "emb_time": emb_time,
-            "choose_rep_emb_time": choose_rep_emb_time,
         },
     }
+
+
+def build_result(converted, text_result, shape_vector, timings, fields=RESULT_FIELDS):
+    """
+    Assembles the response of the preprocessor for one drawing.
+    Args:
+        converted: output of convert_drawing
+        text_result: output of process_text, or None if no OCR output was requested
+        shape_vector: representative CLIP embedding of the drawing, or None if it was not requested
+        timings: dictionary with the timings of all steps
+        fields: outputs to put into the result. the standardized image is only encoded if it was requested
+
+    Returns: dictionary with extracted features and timings
+
+    """
+    if "original_drawing" in fields:
+        encode_image_time, original_drawing = stopwatch(convert_cv2_to_bytestring, converted["std_img"])
+    else:
+        encode_image_time, original_drawing = 0, None
+
+    outputs = {
+        "drawing_data": lambda: text_result["drawing_data"],
+        "ocr_vector": lambda: list(text_result["ocr_vector"]),
+        "shape_vector": lambda: shape_vector.tolist(),
+        "original_drawing": lambda: original_drawing,
+        "ocr_text": lambda: text_result["ocr_text"],
+        "ocr_bbs": lambda: text_result["ocr_bbs"],
+        "ocr_classes": lambda: text_result["ocr_classes"],
+    }
+    result = {field: outputs[field]() for field in RESULT_FIELDS if field in fields}
+    result["timings"] = {**timings, "encode_image_time": encode_image_time}
+    return result
+
+
+def ocr_stage(converted, on_stage=None, ocr_profile=OCR_PROFILE):
+    """
+    Stage of apply_preprocessing: applies the OCR to the standardized image.
+    Args:
+        converted: output of convert_drawing
+        on_stage: optional progress callback
+        ocr_profile: models and detection settings of the OCR, see OCR_PROFILES
+
+    Returns: dictionary with the bounding boxes and texts found by the OCR and the timings of the steps
+
+    """
+    report_stage(on_stage, "ocr")
+    # get ocr model, only loaded on first use in this process
+    ocr_init_time, ocr_engine = stopwatch(get_ocr_engine, ocr_profile)
+    # make sure the ocr image is rgb, as paddle cant handle grayscale images
+    ocr_time, (text_bbs, texts) = stopwatch(
+        paddle_ocr,
+        grayscale_to_rgb(converted["std_img"]),
+        ocr_engine,
+        ocr_profile,
+        [converted["info_blocks_mask"], converted["drawing_mask"]],
+    )
+    return {
+        "text_bbs": text_bbs,
+        "texts": texts,
+        "timings": {"ocr_init_time": ocr_init_time, "ocr_time": ocr_time},
+    }
+
+
+def text_extraction_stage(converted, ocr_result, fields, on_stage=None):
+    """
+    Stage of apply_preprocessing: merges the text, extracts features and converts them into a vector.
+    Args:
+        converted: output of convert_drawing
+        ocr_result: output of ocr_stage
+        fields: requested outputs
+        on_stage: optional progress callback
+
+    Returns: output of process_text
+
+    """
+    report_stage(on_stage, "text_extraction")
+    return process_text(converted, ocr_result["text_bbs"], ocr_result["texts"], fields)
+
+
+def remove_dim_arrows_stage(converted, on_stage=None):
+    """
+    Stage of apply_preprocessing: removes lines and arrows to get a cleaned image that can be given to CLIP.
+    Args:
+        converted: output of convert_drawing
+        on_stage: optional progress callback
+
+    Returns: dictionary with the shape image and the timings of the steps
+
+    """
+    report_stage(on_stage, "remove_dim_arrows")
+    set_torch_threads()
+    # get unet, only loaded on first use in this process
+    unet_init_time, predictor = stopwatch(get_unet_predictor)
+    remove_dim_arrows_time, shape_image = stopwatch(
+        unet_remove_dimension_arrows_and_lines, converted["cleaned_drawing"], predictor
+    )
+    return {
+        "shape_image": shape_image,
+        "timings": {"unet_init_time": unet_init_time, "remove_dim_arrows_time": remove_dim_arrows_time},
+    }
+
+
+def embeddings_stage(shape_result, on_stage=None):
+    """
+    Stage of apply_preprocessing: generates CLIP embeddings of the views and chooses the representative one.
+    Args:
+        shape_result: output of remove_dim_arrows_stage
+        on_stage: optional progress callback
+
+    Returns: dictionary with the shape vector and the timings of the steps
+
+    """
+    report_stage(on_stage, "embeddings")
+    set_torch_threads()
+    # generate CLIP embeddings from cleaned image, in forward passes shared with concurrent requests
+    emb_time, embeddings = stopwatch(
+        generate_embeddings, shape_result["shape_image"], get_clip_model(), embedding_encoder()
+    )
+    # choose the most average embedding
+    choose_rep_emb_time, shape_vector = stopwatch(choose_representative_embedding, embeddings)
+    return {
+        "shape_vector": shape_vector,
+        "timings": {"emb_time": emb_time, "choose_rep_emb_time": choose_rep_emb_time},
+    }
+
+
+def apply_preprocessing(
+    file_content,
+    file_name,
+    scale,
+    use_cache=True,
+    on_stage=None,
+    fields=RESULT_FIELDS,
+    orientation=DEFAULT_ORIENTATION,
+    ocr_profile=OCR_PROFILE,
+):
+    """
+    Applies the preprocessing steps to a file.
+    The steps are run as a StageGraph: once the converter is done, the OCR branch (OCR, text extraction) and the
+    shape branch (UNet, CLIP) run at the same time.
+    Args:
+        file_content: b64 encoded file content
+        file_name: name of the file, used to check if pdf or image
+        scale: int, what the image gets resized to. we usually use 2048
+        use_cache: whether to return a stored result for the same file and store the new result (see result_cache.py)
+        on_stage: optional callback, called with the name of each stage of PREPROCESSING_STAGES when it starts.
+                  Used by the job queue to report the progress of a job (see jobs.py)
+        fields: outputs to compute, see RESULT_FIELDS and resolve_fields. Steps that only produce outputs that were not
+                requested are skipped and report a time of 0
+        orientation: how the rotation of the drawing is detected, see ORIENTATION_MODES
+        ocr_profile: models and detection settings of the OCR, see OCR_PROFILES
+
+    Returns: dictionary with the requested outputs and timings. Besides the time of each step, the timings contain
+             the wall-clock time of all steps (wall_time) and the time of the longest chain of dependent steps
+             (critical_path_time)
+
+    """
+    # =========
+    #   CACHE
+    # =========
+    cache = get_result_cache() if use_cache else None
+    if cache is not None:
+        report_stage(on_stage, "cache")
+        cache_time, (cache_key, cached_result) = stopwatch(
+            lookup_cache, cache, file_content, file_name, scale, fields, orientation, ocr_profile
+        )
+        if cached_result is not None:
+            return add_cache_timings(cached_result, cache, True, cache_time)
+
+    graph = StageGraph()
+    # standardize image, separate into info block and drawing and fix image rotation if present
+    graph.add(
+        "converter",
+        lambda: convert_drawing(file_content, file_name, scale, on_stage, ROTATION_DETECTORS[orientation]),
+    )
+    # OCR branch
+    if OCR_FIELDS.intersection(fields):
+        graph.add("ocr", lambda converted: ocr_stage(converted, on_stage, ocr_profile), ["converter"])
+        graph.add(
+            "text_extraction",
+            lambda converted, ocr_result: text_extraction_stage(converted, ocr_result, fields, on_stage),
+            ["converter", "ocr"],
+        )
+    # shape branch
+    if SHAPE_FIELDS.intersection(fields):
+        graph.add("remove_dim_arrows", lambda converted: remove_dim_arrows_stage(converted, on_stage), ["converter"])
+        graph.add("embeddings", lambda shape_result: embeddings_stage(shape_result, on_stage), ["remove_dim_arrows"])
+    results, _, wall_time, critical_path_time = graph.run()
+
+    converted = results["converter"]
+    timings = dict(converted["timings"])
+    text_result = results.get("text_extraction")
+    if text_result is not None:
+        timings.update({**results["ocr"]["timings"], **text_result["timings"]})
+    else:
+        timings.update(SKIPPED_OCR_TIMINGS)
+    if "embeddings" in results:
+        shape_vector = results["embeddings"]["shape_vector"]
+        timings.update({**results["remove_dim_arrows"]["timings"], **results["embeddings"]["timings"]})
+    else:
+        shape_vector = None
+        timings.update(SKIPPED_SHAPE_TIMINGS)
+    timings.update({"wall_time": wall_time, "critical_path_time": critical_path_time})
+    result = build_result(converted, text_result, shape_vector, timings, fields)
+
+    if cache is not None:
+        cache.put(cache_key, result)
+        add_cache_timings(result, cache, False, cache_time)
+    return result
+
+
+def run_batch_branches(converted, fields, ocr_profile):
+    """
+    Runs the OCR branch and the shape branch of apply_preprocessing_batch for converted drawings, with the model
+    inference batched across all of them.
+    Args:
+        converted: list of results of convert_drawing
+        fields: outputs to compute, see apply_preprocessing
+        ocr_profile: models and detection settings of the OCR, see OCR_PROFILES
+
+    Returns: tuple (list with a tuple (text result, shape vector, timings) for each drawing, batch timings).
+             The steps that are shared by the batch report their total time in the batch timings and their time
+             divided by the batch size (amortized) in the timings of each drawing.
+
+    """
+    batch_size = len(converted)
+
+    def ocr_branch():
+        ocr_init_time, ocr_engine = stopwatch(get_ocr_engine, ocr_profile)
+        ocr_time, ocr_results = stopwatch(
+            paddle_ocr_batch,
+            [grayscale_to_rgb(conv["std_img"]) for conv in converted],
+            ocr_engine,
+            ocr_profile,
+            [[conv["info_blocks_mask"], conv["drawing_mask"]] for conv in converted],
+        )
+        text_results = [
+            process_text(conv, text_bbs, texts, fields)
+            for conv, (text_bbs, texts) in zip(converted, ocr_results, strict=True)
+        ]
+        return ocr_init_time, ocr_time, text_results
+
+    def shape_branch():
+        set_torch_threads()
+        unet_init_time, predictor = stopwatch(get_unet_predictor)
+        remove_dim_arrows_time, shape_images = stopwatch(
+            unet_remove_dimension_arrows_and_lines_batch, [conv["cleaned_drawing"] for conv in converted], predictor
+        )
+        emb_time, embeddings = stopwatch(generate_embeddings_batch, shape_images, get_clip_model(), embedding_encoder())
+        return unet_init_time, remove_dim_arrows_time, emb_time, embeddings
+
+    # the OCR and the shape branch run at the same time, branches without requested outputs are skipped
+    graph = StageGraph()
+    if OCR_FIELDS.intersection(fields):
+        graph.add("ocr", ocr_branch)
+    if SHAPE_FIELDS.intersection(fields):
+        graph.add("shapes", shape_branch)
+    branch_results, _, wall_time, critical_path_time = graph.run()
+
+    batch_timings = {"batch_size": batch_size, "wall_time": wall_time, "critical_path_time": critical_path_time}
+    if "ocr" in branch_results:
+        batch_timings["ocr_time"] = branch_results["ocr"][1]
+    if "shapes" in branch_results:
+        batch_timings.update(
+            {"remove_dim_arrows_time": branch_results["shapes"][1], "emb_time": branch_results["shapes"][2]}
+        )
+
+    drawing_results = []
+    for j in range(batch_size):
+        timings = {}
+        if "ocr" in branch_results:
+            ocr_init_time, ocr_time, text_results = branch_results["ocr"]
+            text_result = text_results[j]
+            timings.update(
+                {"ocr_init_time": ocr_init_time, "ocr_time": ocr_time / batch_size, **text_result["timings"]}
+            )
+        else:
+            text_result = None
+            timings.update(SKIPPED_OCR_TIMINGS)
+        if "shapes" in branch_results:
+            unet_init_time, remove_dim_arrows_time, emb_time, embeddings = branch_results["shapes"]
+            choose_rep_emb_time, shape_vector = stopwatch(choose_representative_embedding, embeddings[j])
+            timings.update(
+                {
+                    "unet_init_time": unet_init_time,
+                    "remove_dim_arrows_time": remove_dim_arrows_time / batch_size,
+                    "emb_time": emb_time / batch_size,
+                    "choose_rep_emb_time": choose_rep_emb_time,
+                }
+            )
+        else:
+            shape_vector = None
+            timings.update(SKIPPED_SHAPE_TIMINGS)
+        timings.update({"wall_time": wall_time / batch_size, "critical_path_time": critical_path_time / batch_size})
+        drawing_results.append((text_result, shape_vector, timings))
+    return drawing_results, batch_timings
+
+
+def apply_preprocessing_batch(
+    files,
+    scale,
+    use_cache=True,
+    fields=RESULT_FIELDS,
+    orientation=DEFAULT_ORIENTATION,
+    ocr_profile=OCR_PROFILE,
+):
+    """
+    Applies the preprocessing steps to several files.
+    The converter steps run in parallel in a process pool. The model inference is batched across all drawings: the
+    OCR gets all images in one call, and the views of all drawings are stacked into shared UNet and CLIP forward passes.
+    Args:
+        files: list of dictionaries with the keys "file_content" (b64 encoded file content) and "file_name"
+        scale: int, what the images get resized to. we usually use 2048
+        use_cache: whether to return stored results for files that were already processed and store the new results
+        fields: outputs to compute, see apply_preprocessing
+        orientation: how the rotation of the drawings is detected, see ORIENTATION_MODES. With "paddle" the rotation
+                     is fixed in this process after the converter steps, as the OCR models are loaded here
+        ocr_profile: models and detection settings of the OCR, see OCR_PROFILES
+
+    Returns: list with one entry for each file, either a dictionary like the one returned by apply_preprocessing or
+             an error message. The timings of steps that are shared by the batch (ocr_time, remove_dim_arrows_time,
+             emb_time, wall_time and critical_path_time) are amortized: their time divided by the batch size. The
+             totals are reported in batch_timings, together with the batch_size. wall_time and critical_path_time only
+             cover the OCR and shape branches, which run at the same time. If the batched inference fails, every
+             drawing is run as a batch of its own, so that a single bad drawing only fails its own entry.
+
+    """
+    results = [None] * len(files)
+
+    # =========
+    #   CACHE
+    # =========
+    cache = get_result_cache() if use_cache else None
+    cache_keys = [None] * len(files)
+    cache_times = [0] * len(files)
+    pending_ids = []
+    for i, file in enumerate(files):
+        if cache is not None:
+            try:
+                cache_times[i], (cache_keys[i], cached_result) = stopwatch(
+                    lookup_cache,
+                    cache,
+                    file["file_content"],
+                    file["file_name"],
+                    scale,
+                    fields,
+                    orientation,
+                    ocr_profile,
+                )
+            except Exception as e:
+                traceback.print_exc()
+                results[i] = "internal error: " + str(e)
+                continue
+            if cached_result is not None:
+                results[i] = add_cache_timings(cached_result, cache, True, cache_times[i])
+                continue
+        pending_ids.append(i)
+
+    # =========
+    # CONVERTER
+    # =========
+    pool = get_converter_pool()
+    # the OSD runs in the converter processes, the paddle models are only available in this process
+    detect_rotation = get_image_rotation if orientation == "osd" else None
+    futures = [
+        pool.submit(convert_drawing, files[i]["file_content"], files[i]["file_name"], scale, None, detect_rotation)
+        for i in pending_ids
+    ]
+
+    converted_ids = []
+    converted = []
+    for i, future in zip(pending_ids, futures, strict=True):
+        try:
+            conv = future.result()
+            if detect_rotation is None:
+                fix_rotation(conv, ROTATION_DETECTORS[orientation])
+            converted.append(conv)
+            converted_ids.append(i)
+        except Exception as e:
+            traceback.print_exc()
+            results[i] = "internal error: " + str(e)
+
+    if len(converted) == 0:
+        return results
+
+    try:
+        batches = [(converted_ids, converted, run_batch_branches(converted, fields, ocr_profile))]
+    except Exception:
+        # a drawing that breaks the batched inference must not fail the others: run the branches for each drawing
+        # on its own, so that only the drawings that fail on their own get an error
+        traceback.print_exc()
+        batches = []
+        for i, conv in zip(converted_ids, converted, strict=True):
+            try:
+                batches.append(([i], [conv], run_batch_branches([conv], fields, ocr_profile)))
+            except Exception as e:
+                traceback.print_exc()
+                results[i] = "internal error: " + str(e)
+
+    for batch_ids, batch_converted, (drawing_results, batch_timings) in batches:
+        for i, conv, (text_result, shape_vector, timings) in zip(
+            batch_ids, batch_converted, drawing_results, strict=True
+        ):
+            results[i] = build_result(conv, text_result, shape_vector, {**conv["timings"], **timings}, fields)
+
+            if cache is not None:
+                cache.put(cache_keys[i], results[i])
+                add_cache_timings(results[i], cache, False, cache_times[i])
+            results[i]["batch_timings"] = batch_timings
+
+    return results
@@ -0,0 +1,114 @@
+import base64
+
+import msgpack
+import numpy as np
+
+from flask import Response
+from src.flask.preprocess import resolve_fields, resolve_ocr_profile, resolve_orientation
+
+MSGPACK_MIMETYPE = "application/msgpack"
+
+
+def read_upload(request):
+    """
+    Reads the uploaded file of a request. The file can be sent in three ways:
+    - multipart/form-data with the file in the field "file". The file name is taken from the field "file_name" or from
+      the uploaded file itself
+    - the raw file as request body (e.g. application/octet-stream), with the file name in the query parameter
+      "file_name"
+    - json with "file_name" and "file_content" (base64 encoded)
+    Multipart and raw uploads are returned as bytes and are not base64 decoded again (see decode_file_content).
+    :param request: flask request
+    :return: file content, file name. the file content is None if no file was sent
+    """
+    if request.mimetype == "multipart/form-data":
+        file = request.files.get("file")
+        if file is None:
+            return None, None
+        return file.read(), request.form.get("file_name", file.filename)
+    if request.mimetype != "application/json":
+        return request.get_data() or None, request.args.get("file_name")
+    data = request.get_json()
+    return data.get("file_content"), data.get("file_name")
+
+
+def wants_compact_response(request):
+    """
+    Returns True if the client asked for the compact msgpack response, either with the query parameter format=msgpack
+    or the Accept header application/msgpack.
+    """
+    if request.args.get("format") == "msgpack":
+        return True
+    return request.accept_mimetypes.best == MSGPACK_MIMETYPE
+
+
+def requested_fields(request):
+    """
+    Returns the outputs the client asked for with the query parameters fields (comma separated list of RESULT_FIELDS)
+    or profile (key of FIELD_PROFILES), all outputs if neither is given. With the query parameter image=false the
+    standardized image is left out.
+    :param request: flask request
+    :return: list of fields
+    """
+    fields = request.args.get("fields")
+    fields = resolve_fields(
+        [field.strip() for field in fields.split(",")] if fields else None, request.args.get("profile")
+    )
+    if request.args.get("image", "true").lower() == "false":
+        fields = [field for field in fields if field != "original_drawing"]
+    return fields
+
+
+def requested_orientation(request):
+    """
+    Returns the orientation mode the client asked for with the query parameter orientation (one of ORIENTATION_MODES),
+    DEFAULT_ORIENTATION if it is not given.
+    :param request: flask request
+    :return: orientation mode
+    """
+    return resolve_orientation(request.args.get("orientation"))
+
+
+def requested_ocr_profile(request):
+    """
+    Returns the OCR profile the client asked for with the query parameter ocr_profile (one of OCR_PROFILES),
+    OCR_PROFILE if it is not given.
+    :param request: flask request
+    :return: OCR profile
+    """
+    return resolve_ocr_profile(request.args.get("ocr_profile"))
+
+
+def to_compact(result):
+    """
+    Converts a result of apply_preprocessing into the compact format: ocr_vector and shape_vector are little-endian
+    float32 buffers and original_drawing is the raw png instead of base64 encoded.
+    :param result: dictionary returned by apply_preprocessing
+    :return: dictionary that can be packed with msgpack
+    """
+    compact = dict(result)
+    for field in ["ocr_vector", "shape_vector"]:
+        if field in result:
+            compact[field] = np.asarray(result[field], dtype="<f4").tobytes()
+    if "original_drawing" in result:
+        compact["original_drawing"] = base64.b64decode(result["original_drawing"])
+    return compact
+
+
+def make_response(result, compact=False):
+    """
+    Builds the response for a result of apply_preprocessing.
+    Error messages and json responses are returned as they are, flask_restful converts them to json.
+    :param result: dictionary returned by apply_preprocessing, a list of them, or an error message
+    :param compact: whether to return the compact msgpack format (see to_compact)
+    :return: result, or flask Response with the msgpack encoded result
+    """
+    if not compact:
+        return result
+    if isinstance(result, list):
+        packed = [to_compact(r) if isinstance(r, dict) else r for r in result]
+    elif isinstance(result, dict):
+        packed = to_compact(result)
+    else:
+        return result
+    return Response(msgpack.packb(packed, use_bin_type=True), mimetype=MSGPACK_MIMETYPE)
@@ -0,0 +1,259 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from importlib.resources import files
+
+import src.flask.ocr.resources.json as json_resource_dir
+from src.flask.converter.image_std import DESKEW_METHOD, decode_file_content
+from src.flask.converter.shape_extract import UNET_BACKEND, UNET_MODEL_DIR, UNET_ONNX_MODEL, UNET_PROFILE
+from src.flask.ocr.paddle_ocr_engine import OCR_DETECTION_MODEL_DIR, OCR_PROFILE, OCR_RECOGNITION_MODEL_DIR
+from src.flask.shapes.vectorizer import CLIP_BACKEND, CLIP_MODEL_NAME, CLIP_ONNX_MODEL
+
+# increase when the preprocessing logic changes in a way that makes cached results outdated
+CACHE_FORMAT_VERSION = 1
+
+CACHE_ENABLED = os.getenv("PP_CACHE_ENABLED", "true").lower() == "true"
+CACHE_DIR = os.getenv("PP_CACHE_DIR", os.path.join(tempfile.gettempdir(), "colibri_preprocessor_cache"))
+CACHE_MAX_BYTES = int(os.getenv("PP_CACHE_MAX_BYTES", str(2 * 1024**3)))  # 2 GB
+
+
+def hash_path(hasher, path):
+    """
+    Updates the hasher with the name and content of a file, or of all files in a directory.
+    Args:
+        hasher: hashlib hash object
+        path: path of a file or directory. Missing paths are skipped.
+
+    Returns: None
+
+    """
+    if os.path.isdir(path):
+        for root, dirs, file_names in os.walk(path):
+            dirs.sort()
+            for file_name in sorted(file_names):
+                hash_path(hasher, os.path.join(root, file_name))
+    elif os.path.isfile(path):
+        hasher.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(chunk)
+
+
+@lru_cache(maxsize=1)
+def get_resource_version():
+    """
+    Computes a fingerprint of all models, resources and settings that influence the preprocessing result:
+    the deskew method, the OCR models, the nnUNet checkpoint (or its exported network) and inference profile, the CLIP
+    model (or its exported encoder) and the material and norm lists.
+    Only computed once per process.
+
+    Returns: hex digest
+
+    """
+    hasher = hashlib.sha256()
+    hasher.update(f"format:{CACHE_FORMAT_VERSION};clip:{CLIP_MODEL_NAME};deskew:{DESKEW_METHOD};".encode())
+    # the sliding window settings of the profile change the UNet segmentation
+    hasher.update(f"unet_profile:{UNET_PROFILE};".encode())
+    if UNET_BACKEND == "onnx":
+        # the segmentation of the exported network differs slightly from that of the nnUNet checkpoint
+        hasher.update(f"unet_backend:{UNET_BACKEND};".encode())
+        hash_path(hasher, UNET_ONNX_MODEL)
+    if CLIP_BACKEND == "onnx":
+        # the embeddings of the exported encoder differ slightly from those of the torch model
+        hasher.update(f"clip_backend:{CLIP_BACKEND};".encode())
+        hash_path(hasher, CLIP_ONNX_MODEL)
+    for path in [
+        OCR_DETECTION_MODEL_DIR,
+        OCR_RECOGNITION_MODEL_DIR,
+        UNET_MODEL_DIR,
+        str(files(json_resource_dir).joinpath("materials.json")),
+        str(files(json_resource_dir).joinpath("norms.json")),
+    ]:
+        hash_path(hasher, path)
+    return hasher.hexdigest()
+
+
+def get_file_type(file_name):
+    """
+    Returns the type of the file as it is used by load_and_standardize: "pdf", "image" or the lowercase file name.
+    """
+    file_name = file_name.lower()
+    if ".png" in file_name or ".jpg" in file_name or ".jpeg" in file_name:
+        return "image"
+    elif ".pdf" in file_name:
+        return "pdf"
+    return file_name
+
+
+class ResultCache:
+    def __init__(self, directory, max_bytes):
+        """
+        On-disk cache for preprocessing results, addressed by the content of the uploaded file.
+        Every result is stored as a json file. Reading an entry updates its modification time, so that the least
+        recently used entries are evicted first once the cache grows larger than max_bytes.
+        Several gunicorn workers can share the same directory.
+        :param directory: directory to store the results in
+        :param max_bytes: maximum size of all stored results in bytes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, file_content, file_name, scale, orientation, ocr_profile=OCR_PROFILE):
+        """
+        Computes the cache key of a request.
+        :param file_content: b64 encoded file content
+        :param file_name: name of the file
+        :param scale: scale the image gets resized to
+        :param orientation: how the rotation of the drawing is detected, see ORIENTATION_MODES
+        :param ocr_profile: models and detection settings of the OCR, see OCR_PROFILES. default: the configured profile
+        :return: hex digest of the decoded file, the file type, the scale, the orientation mode, the OCR profile and the
+                 resource version
+        """
+        hasher = hashlib.sha256()
+        hasher.update(
+            f"{get_resource_version()};{get_file_type(file_name)};{scale};{orientation};{ocr_profile};".encode()
+        )
+        hasher.update(decode_file_content(file_content))
+        return hasher.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def read(self, key):
+        """
+        Returns the stored result for the key or None, without counting a hit or miss.
+        """
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def get(self, key, fields=None):
+        """
+        Returns the cached result for the key or None, and counts the hit or miss.
+        :param key: cache key
+        :param fields: outputs the result must contain. a stored result that was computed for fewer outputs is a miss
+        """
+        result = self.read(key)
+        if result is not None and fields is not None and not all(field in result for field in fields):
+            result = None
+        if result is not None:
+            # mark as recently used
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(self.path(key))
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def put(self, key, result):
+        """
+        Stores a result and evicts the least recently used entries if the cache is too large.
+        If the result only contains some of the outputs (see resolve_fields), the outputs of an already stored result
+        for the same key are kept, so that the entry gets more complete over time.
+        """
+        stored = self.read(key)
+        if stored is not None:
+            result = {**stored, **result}
+        # write to a temporary file first, so that other workers never read a partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(result, f)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is not larger than max_bytes.
+        """
+        entries = []
+        total_bytes = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:  # removed by another worker
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_bytes += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total_bytes -= size
+
+    def invalidate(self, key):
+        """
+        Removes the entry for the key. Returns True if there was one.
+        """
+        try:
+            os.remove(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def clear(self):
+        """
+        Removes all entries. Returns the number of removed entries.
+        """
+        removed = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    try:
+                        os.remove(entry.path)
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+        return removed
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of this process and the number and size of the stored entries.
+        """
+        entries = 0
+        total_bytes = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    entries += 1
+                    total_bytes += entry.stat().st_size
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Returns the result cache of this process, or None if caching is disabled via PP_CACHE_ENABLED.
+    """
+    global _result_cache
+    if not CACHE_ENABLED:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(CACHE_DIR, CACHE_MAX_BYTES)
+    return _result_cache
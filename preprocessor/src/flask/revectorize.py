@@ -0,0 +1,64 @@
+import time
+from functools import lru_cache
+
+from src.flask.ocr.extraction import contains_isos
+from src.flask.ocr.vectorizer import get_extraction_vectorizer
+
+
+@lru_cache(maxsize=1)
+def get_material_classes_by_name():
+    """
+    Maps each material name to its material class. A name in several classes maps to the first one, like get_material
+    returns the first of equally good matches.
+    """
+    classes_by_name = {}
+    for material_class in get_extraction_vectorizer().material_classes:
+        for material in material_class:
+            classes_by_name.setdefault(material, material_class)
+    return classes_by_name
+
+
+def searchdata_to_drawing_data(searchdata):
+    """
+    Rebuilds the data extracted from a drawing, as returned by extract, from its search data in the database.
+    The ISOs are not stored, they are searched again in the stored OCR text.
+    Materials that are no longer in materials.json are left out.
+    :param searchdata: search data of a drawing as returned by the database service
+    :return: dictionary that can be passed to vectorize_extraction
+    """
+    classes_by_name = get_material_classes_by_name()
+    materials = [material for material in searchdata.get("material") or [] if material in classes_by_name]
+    other_isos = []
+    for text in searchdata.get("ocr_text") or []:
+        other_isos.extend(contains_isos(text))
+    return {
+        "material": materials,
+        "material_class": [classes_by_name[material] for material in materials],
+        "general_tolerances": searchdata.get("general_tolerances") or [],
+        "surfaces": searchdata.get("surfaces") or [],
+        "gdts": searchdata.get("gdts") or [],
+        "other_isos": other_isos,
+        # the database only stores the measures, not their bounding boxes
+        "outer_dimensions": [(measure, None) for measure in searchdata.get("outer_dimensions") or []],
+    }
+
+
+def revectorize_searchdata(searchdata_list):
+    """
+    Computes the ocr_vector of each drawing again from its stored search data, without applying the OCR, and combines
+    it with the stored shape vector into a new search_vector.
+    :param searchdata_list: list of search data as returned by the database service
+    :return: tuple (search data with the new search_vector, dictionary with timings)
+    """
+    start = time.perf_counter()
+    drawing_data = [searchdata_to_drawing_data(searchdata) for searchdata in searchdata_list]
+    rebuild_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ocr_vectors = get_extraction_vectorizer().vectorize_many(drawing_data)
+    vectorize_time = time.perf_counter() - start
+
+    revectorized = []
+    for searchdata, ocr_vector in zip(searchdata_list, ocr_vectors, strict=True):
+        revectorized.append({**searchdata, "search_vector": ocr_vector.tolist() + list(searchdata.get("shape") or [])})
+    return revectorized, {"rebuild_time": rebuild_time, "vectorize_time": vectorize_time}
@@ -0,0 +1,53 @@
+import os
+
+import torch
+
+from src.flask.onnx_model import OnnxModel, export_onnx, quantize_onnx
+
+# exported visual encoder of CLIP, see tools/export_clip.py. the int8 model has quantized weights
+CLIP_ONNX_DIR = os.path.join(os.path.dirname(__file__), "resources")
+CLIP_ONNX_PATH = os.path.join(CLIP_ONNX_DIR, "clip_visual.onnx")
+CLIP_ONNX_INT8_PATH = os.path.join(CLIP_ONNX_DIR, "clip_visual_int8.onnx")
+# minimum cosine similarity between the embeddings of an exported encoder and those of the torch model, so that shape
+# vectors generated with both backends can be compared with each other
+CLIP_MIN_COSINE = 0.99
+
+
+def export_clip(model, path=CLIP_ONNX_PATH):
+    """
+    Exports the visual encoder of a CLIP model to ONNX. The input has the resolution of the model and a dynamic batch
+    size, the output are the image embeddings.
+    :param model: CLIP model as returned by clip.load
+    :param path: path of the ONNX file
+    :return: path
+    """
+    resolution = model.visual.input_resolution
+    example_input = torch.zeros((1, 3, resolution, resolution), dtype=torch.float32)
+    return export_onnx(model.visual, example_input, path, OnnxClipEncoder.input_name, OnnxClipEncoder.output_name)
+
+
+def quantize_clip(path=CLIP_ONNX_PATH, int8_path=CLIP_ONNX_INT8_PATH):
+    """
+    Quantizes the weights of an exported visual encoder, see quantize_onnx.
+    :param path: path of the exported ONNX file
+    :param int8_path: path of the quantized ONNX file
+    :return: int8_path
+    """
+    return quantize_onnx(path, int8_path)
+
+
+class OnnxClipEncoder(OnnxModel):
+    """
+    Runs an exported visual encoder of CLIP (see export_clip) with ONNX Runtime on the cpu. Has the encode_image method
+    of the CLIP model, so it can be used in its place in vectorizer.
+    """
+
+    input_name = "image"
+    output_name = "embedding"
+
+    def encode_image(self, batch):
+        """
+        :param batch: float32 tensor of shape (n, 3, resolution, resolution), see vectorizer.preprocess_views
+        :return: embeddings as float32 tensor of shape (n, 512)
+        """
+        return self.run(batch)
@@ -1,41 +1,170 @@
+import os
+
 import clip
 import numpy as np
 import torch
+import torch.nn.functional as F
 from PIL import Image
 
 from src.flask.converter.utils import get_cropped_views
+from src.flask.shapes.clip_onnx import CLIP_ONNX_PATH, OnnxClipEncoder
+
+CLIP_MODEL_NAME = "ViT-B/32"
+# maximum number of views that are embedded in one forward pass of CLIP
+CLIP_BATCH_SIZE = 64
+# "torch" runs the CLIP model of clip.load, "onnx" the exported visual encoder of tools/export_clip.py
+CLIP_BACKEND = os.getenv("PP_CLIP_BACKEND", "torch")
+CLIP_ONNX_MODEL = os.getenv("PP_CLIP_ONNX_MODEL", CLIP_ONNX_PATH)
+# input resolution and normalization of the preprocess function of clip.load
+CLIP_RESOLUTION = 224
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def load_clip():
+    """
+    Load the CLIP model of CLIP_BACKEND and its preprocess function.
 
+    return: A tuple (model, preprocess). With the onnx backend, model is an OnnxClipEncoder and preprocess is None:
+            the views are then preprocessed as one tensor batch (see preprocess_views).
+    """
+    if CLIP_BACKEND == "onnx":
+        return OnnxClipEncoder(CLIP_ONNX_MODEL), None
+    return clip.load(CLIP_MODEL_NAME, device="cpu")
+
+
+def preprocess_views(view_images, resolution=CLIP_RESOLUTION):
+    """
+    Preprocess grayscale views for CLIP as one tensor batch, without converting each view to a PIL image.
+    Follows the preprocess function of clip.load: the shorter side is resized to the resolution (bicubic with
+    antialiasing, like PIL), rounded to 8 bit, center cropped and normalized with the CLIP mean and std.
+
+    param view_images: List of grayscale views (uint8 arrays of shape (h, w)).
+    param resolution: Input resolution of the CLIP model.
+    return: A float32 tensor of shape (n, 3, resolution, resolution).
+    """
+    batch = torch.empty((len(view_images), 1, resolution, resolution), dtype=torch.float32)
+    for i, view_image in enumerate(view_images):
+        h, w = view_image.shape[:2]
+        # the longer side is truncated like in torchvision's Resize
+        size = (resolution, int(resolution * w / h)) if h <= w else (int(resolution * h / w), resolution)
+        # PIL resizes the width first and rounds to 8 bit after each pass. the vertical pass does not mix columns, so
+        # the columns outside of the center crop are dropped before it
+        resized = torch.from_numpy(view_image.astype(np.float32))[None, None]
+        if size[1] != w:
+            resized = F.interpolate(resized, size=(h, size[1]), mode="bicubic", antialias=True).round_().clamp_(0, 255)
+        left = int(round((size[1] - resolution) / 2.0))
+        resized = resized[:, :, :, left : left + resolution]
+        if size[0] != h:
+            resized = F.interpolate(resized, size=(size[0], resolution), mode="bicubic", antialias=True)
+            resized = resized.round_().clamp_(0, 255)
+        top = int(round((size[0] - resolution) / 2.0))
+        batch[i] = resized[0, :, top : top + resolution]
+
+    # the single gray channel is broadcast to the three normalized RGB channels
+    batch = batch.div_(255)
+    mean = torch.tensor(CLIP_MEAN, dtype=torch.float32).view(1, 3, 1, 1)
+    std = torch.tensor(CLIP_STD, dtype=torch.float32).view(1, 3, 1, 1)
+    return (batch - mean) / std
+
+
+def prepare_views(view_images, preprocess=None):
+    """
+    Turn grayscale views into a batch of CLIP inputs.
+
+    param view_images: List of grayscale views.
+    param preprocess: Preprocess function of clip.load, which is applied to each view as PIL image. If None, the views
+                      are preprocessed as one tensor batch by preprocess_views.
+    return: A float32 tensor of shape (n, 3, resolution, resolution).
+    """
+    if preprocess is None:
+        return preprocess_views(view_images)
+    return torch.stack([preprocess(Image.fromarray(view_image)) for view_image in view_images])
+
+
+def encode_views(model, view_images, batch_size=CLIP_BATCH_SIZE):
+    """
+    Embed a batch of preprocessed views with the CLIP model, in forward passes of at most batch_size views.
 
-def generate_embeddings(shape_image):
+    param model: CLIP model or OnnxClipEncoder, see load_clip.
+    param view_images: A tensor of preprocessed views, see prepare_views.
+    param batch_size: Maximum number of views in one forward pass.
+    return: A float32 tensor with the embedding of each view.
+    """
+    with torch.no_grad():
+        return torch.cat(
+            [
+                model.encode_image(view_images[start : start + batch_size]).float()
+                for start in range(0, len(view_images), batch_size)
+            ]
+        )
+
+
+def generate_embeddings(shape_image, clip_model=None, encode=None, views=None):
     """
     Generate embeddings for all views of a shape image using a pre-trained CLIP model.
 
     param shape_image: The input shape image for which embeddings are to be generated.
+    param clip_model: Optional tuple (model, preprocess) as returned by load_clip. Loaded if not given.
+    param encode: Optional function that embeds a tensor of preprocessed views, e.g. EmbeddingService.embed to share
+                  the forward passes with concurrent requests. By default the views are embedded by encode_views.
+    param views: Optional views of shape_image as returned by get_cropped_views, if the caller already extracted them.
     return: A tensor containing the image embeddings for each view.
     """
     # Load CLIP model and preprocess function
-    model, preprocess = clip.load("ViT-B/32", device="cpu")
-
-    # List to store preprocessed image views
-    view_images = []
+    model, preprocess = clip_model if clip_model is not None else load_clip()
 
     # Get cropped views from the shape image
-    for view in get_cropped_views(shape_image):
-        view_image = Image.fromarray(view.image)
-        view_images.append(preprocess(view_image))
+    if views is None:
+        views = get_cropped_views(shape_image)
 
     # Handle empty shape_image
-    if len(view_images) == 0:
+    if len(views) == 0:
         return []
 
-    # Stack the preprocessed images into a batch
-    view_images = torch.stack(view_images)
+    # Preprocess the views into a batch
+    view_images = prepare_views([view.image for view in views], preprocess)
 
     # Generate embeddings with the CLIP model
-    with torch.no_grad():
-        embeddings = model.encode_image(view_images).float()
+    if encode is None:
+        return encode_views(model, view_images)
+    return encode(view_images)
 
-    return embeddings
+
+def generate_embeddings_batch(shape_images, clip_model=None, encode=None):
+    """
+    Generate embeddings for all views of several shape images, stacking the views of all images into shared batches.
+
+    param shape_images: List of shape images for which embeddings are to be generated.
+    param clip_model: Optional tuple (model, preprocess) as returned by load_clip. Loaded if not given.
+    param encode: Optional function that embeds a tensor of preprocessed views, see generate_embeddings.
+    return: A list with one entry for each shape image, containing a tensor with the image embeddings for each view
+            (or an empty list if the image contains no views).
+    """
+    model, preprocess = clip_model if clip_model is not None else load_clip()
+
+    # Collect the views of all images and remember how many views belong to each image
+    view_images = []
+    view_counts = []
+    for shape_image in shape_images:
+        views = get_cropped_views(shape_image)
+        view_images.extend(view.image for view in views)
+        view_counts.append(len(views))
+
+    if len(view_images) == 0:
+        return [[] for _ in shape_images]
+
+    # Generate the embeddings of all views in batches of at most CLIP_BATCH_SIZE views
+    view_images = prepare_views(view_images, preprocess)
+    embeddings = encode_views(model, view_images) if encode is None else encode(view_images)
+
+    # Split the embeddings into the views of each image
+    result = []
+    start = 0
+    for count in view_counts:
+        result.append(embeddings[start : start + count] if count > 0 else [])
+        start += count
+    return result
 
 
 def choose_representative_embedding(embeddings, return_index=False):
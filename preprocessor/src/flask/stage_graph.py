@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.flask.utils import stopwatch
+
+# number of threads used to run independent stages of one drawing at the same time
+STAGE_THREADS = int(os.getenv("PP_STAGE_THREADS", "2"))
+
+
+class StageGraph:
+    def __init__(self):
+        """
+        Small executor for a directed acyclic graph of preprocessing stages.
+        Every stage is a function that gets the results of the stages it depends on as arguments. Stages whose
+        dependencies are done run at the same time on a thread pool. Paddle, torch and OpenCV release the GIL while
+        they compute, so threads are enough to run e.g. the OCR and the UNet in parallel.
+        """
+        self.stages = {}
+
+    def add(self, name, func, dependencies=()):
+        """
+        Adds a stage to the graph.
+        :param name: unique name of the stage
+        :param func: function to run, called with the results of the dependencies in the given order
+        :param dependencies: names of stages that have to be done before this one. must already be added
+        :return: None
+        """
+        for dependency in dependencies:
+            if dependency not in self.stages:
+                raise Exception(f"stage {name} depends on unknown stage {dependency}")
+        self.stages[name] = (func, list(dependencies))
+
+    def critical_path_time(self, durations):
+        """
+        Returns the duration of the longest chain of dependent stages, i.e. the shortest possible wall-clock time with
+        unlimited parallelism.
+        :param durations: dictionary with the time in seconds each stage took
+        :return: time in seconds
+        """
+        finish_times = {}
+        # stages can only depend on stages that were added before them, so the insertion order is a topological order
+        for name, (_, dependencies) in self.stages.items():
+            start = max((finish_times[dependency] for dependency in dependencies), default=0)
+            finish_times[name] = start + durations[name]
+        return max(finish_times.values(), default=0)
+
+    def run(self, max_workers=STAGE_THREADS):
+        """
+        Runs all stages, each one as soon as its dependencies are done.
+        If a stage raises an exception, no further stages are started and the exception is raised after the running
+        stages have finished.
+        :param max_workers: maximum number of stages running at the same time
+        :return: dictionary with the results of the stages, dictionary with the time in seconds each stage took,
+                 wall-clock time and critical path time in seconds
+        """
+        results = {}
+        durations = {}
+        pending = dict(self.stages)
+
+        def execute():
+            running = {}
+            error = None
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                while pending or running:
+                    # start all stages whose dependencies are done
+                    if error is None:
+                        for name, (func, dependencies) in list(pending.items()):
+                            if all(dependency in results for dependency in dependencies):
+                                args = [results[dependency] for dependency in dependencies]
+                                running[executor.submit(stopwatch, func, *args)] = name
+                                del pending[name]
+                    if not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        try:
+                            durations[name], results[name] = future.result()
+                        except Exception as e:
+                            error = error or e
+            if error is not None:
+                raise error
+
+        wall_time, _ = stopwatch(execute)
+        return results, durations, wall_time, self.critical_path_time(durations)
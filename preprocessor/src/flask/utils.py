@@ -0,0 +1,32 @@
+from datetime import datetime
+
+
+def stopwatch(func, *args, **kwargs):
+    """
+    Times to execution of a function.
+    Args:
+        func: the function to execute
+        *args: arguments for the function
+        **kwargs: keyword arguments for the function
+
+    Returns: time in seconds, result of the function
+
+    """
+    start = datetime.now()
+    result = func(*args, **kwargs)
+    end = datetime.now()
+    return (end - start).total_seconds(), result
+
+
+def report_stage(on_stage, stage):
+    """
+    Calls the progress callback of a preprocessing run with the name of the stage that starts next.
+    Args:
+        on_stage: callback taking the stage name, or None
+        stage: name of the stage
+
+    Returns: None
+
+    """
+    if on_stage is not None:
+        on_stage(stage)
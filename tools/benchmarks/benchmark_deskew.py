@@ -0,0 +1,90 @@
+"""
+Compares the deskew estimators of the preprocessor on a set of drawings: the rotation sweep with morphological line
+detection (get_angle) and the projection profile search (estimate_angle).
+Every drawing is rotated by each of the given skew angles first, so the correct result is known: the estimated angle
+should undo the skew.
+
+    python3 benchmark_deskew.py [data_dir] [skew angles, comma separated]
+"""
+
+import os
+import sys
+import time
+
+# make the preprocessor importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessor"))
+
+from src.flask.converter.image_std import (
+    convert_bytestring_to_cv2,
+    convert_pdf_bytestring_to_img,
+    estimate_angle,
+    get_angle,
+    resize_to,
+)
+from src.flask.converter.utils import rotate_image
+
+SCALE = 2048
+ESTIMATORS = {"get_angle": get_angle, "estimate_angle": estimate_angle}
+
+
+def load_drawing(file_path):
+    """
+    Loads a drawing like load_and_standardize does before the alignment.
+    :param file_path: path of a pdf or image file
+    :return: grayscale image resized to SCALE
+    """
+    with open(file_path, "rb") as f:
+        content = f.read()
+    if file_path.lower().endswith(".pdf"):
+        image = convert_pdf_bytestring_to_img(content)
+    else:
+        image = convert_bytestring_to_cv2(content)
+    return resize_to(image, SCALE)
+
+
+def run_benchmark(data_dir, skew_angles):
+    """
+    Runs both estimators on all drawings of data_dir for every skew angle and prints the estimated angles, their error
+    and the runtime.
+    :param data_dir: directory with pdf or image files
+    :param skew_angles: list of angles in degrees the drawings get rotated by
+    :return: dictionary with the total runtime and the mean absolute error of each estimator
+    """
+    totals = {name: {"time": 0.0, "error": 0.0} for name in ESTIMATORS}
+    num_runs = 0
+    file_names = sorted(f for f in os.listdir(data_dir) if f.lower().endswith((".pdf", ".png", ".jpg", ".jpeg")))
+    print(f"{'drawing':40s} {'skew':>6s} " + " ".join(f"{name + ' h/v':>22s} {'time':>7s}" for name in ESTIMATORS))
+    for file_name in file_names:
+        drawing = load_drawing(os.path.join(data_dir, file_name))
+        for skew_angle in skew_angles:
+            image = rotate_image(drawing, skew_angle) if skew_angle != 0 else drawing
+            row = f"{file_name[:40]:40s} {skew_angle:6.2f} "
+            for name, estimator in ESTIMATORS.items():
+                start = time.perf_counter()
+                h_angle = estimator(image, "h")
+                v_angle = estimator(image, "v")
+                runtime = time.perf_counter() - start
+                # rotating by -skew_angle undoes the skew
+                error = (abs(h_angle + skew_angle) + abs(v_angle + skew_angle)) / 2
+                totals[name]["time"] += runtime
+                totals[name]["error"] += error
+                row += f"{h_angle:>10.2f} / {v_angle:<9.2f} {runtime:6.3f}s "
+            print(row)
+            num_runs += 1
+
+    print()
+    for name, total in totals.items():
+        print(
+            f"{name}: total time {total['time']:.2f}s, mean time {total['time'] / max(num_runs, 1):.3f}s, "
+            f"mean absolute error {total['error'] / max(num_runs, 1):.3f} degrees"
+        )
+    return totals
+
+
+if __name__ == "__main__":
+    # Directory of the drawings
+    DATA_DIR = sys.argv[1] if len(sys.argv) > 1 else "../../example_data/drawings"
+    # angles the drawings are rotated by before the estimation
+    SKEW_ANGLES = [float(a) for a in sys.argv[2].split(",")] if len(sys.argv) > 2 else [0, 0.7, -1.6, 3.2]
+
+    run_benchmark(DATA_DIR, SKEW_ANGLES)
@@ -0,0 +1,126 @@
+"""
+Benchmarks the feature scanner of the extraction (scan_features) against the reference implementation, which searches
+each pattern separately on ever shorter slices of the text, on the OCR text of the drawings in
+database/resources/example_data and on long synthetic texts with many features, and checks that both find the same
+surfaces, GDTs, threads and ISOs.
+
+    python3 benchmark_feature_scanner.py [searchdata.csv] [repetitions]
+"""
+
+import csv
+import os
+import sys
+import time
+
+import regex
+
+# make the preprocessor importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessor"))
+
+from src.flask.ocr.extraction import (
+    GDT_REGEX,
+    ISO_REGEX,
+    SURFACE_REGEX,
+    THREAD_REGEXES,
+    scan_features,
+)
+from src.flask.ocr.utils import get_numbers
+
+# lengths of the synthetic texts, in repetitions of a line with one feature of each kind
+SYNTHETIC_LINES = [10, 100, 1000]
+SYNTHETIC_LINE = 'Ra 3.2 ⌖ 0.05 A M10x1.5 G1/2" 1/4"NPT 1/2"-20UNF DIN 912 '
+
+
+def search_for_all_occurrences_of_regex_sliced(re, text):
+    """
+    Reference implementation: the search as it was implemented before the feature scanner.
+    """
+    results = []
+    search_result = regex.search(re, text)
+    while search_result is not None:
+        results.append(text[search_result.start() : search_result.end()])
+        text = text[search_result.end() :]
+        search_result = regex.search(re, text)
+    return results
+
+
+def scan_features_reference(text):
+    """
+    Reference implementation: contains_surface, contains_gdt, contains_thread and contains_isos as they were
+    implemented before the feature scanner.
+    """
+    threads = []
+    for thread_regex in THREAD_REGEXES:
+        threads.extend(search_for_all_occurrences_of_regex_sliced(thread_regex.pattern, text))
+    isos = []
+    for found_iso in search_for_all_occurrences_of_regex_sliced(ISO_REGEX.pattern, text.lower()):
+        iso_nr = get_numbers(found_iso)
+        if iso_nr != "2768" and iso_nr != "7168" and len(iso_nr) > 0:
+            isos.append(iso_nr)
+    return {
+        "surfaces": search_for_all_occurrences_of_regex_sliced(SURFACE_REGEX.pattern, text),
+        "gdts": search_for_all_occurrences_of_regex_sliced(GDT_REGEX.pattern, text),
+        "threads": threads,
+        "other_isos": isos,
+    }
+
+
+def load_ocr_texts(path):
+    """
+    Reads the OCR text blobs of each drawing from the ocr_text column of the example search data.
+    :return: list with the list of text blobs of each drawing
+    """
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    return [row["ocr_text"].strip("{}").replace("\\n", "\n").split(", ") for row in rows]
+
+
+def run(name, texts, repetitions):
+    """
+    Scans the texts with both implementations, prints their runtime and returns whether the results are the same.
+    """
+    timings = {}
+    results = {}
+    for scan in [scan_features_reference, scan_features]:
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            results[scan] = [scan(text) for text in texts]
+        timings[scan] = (time.perf_counter() - start) / repetitions
+    same = results[scan_features_reference] == results[scan_features]
+    features = sum(len(found) for result in results[scan_features] for found in result.values())
+    print(
+        f"{name}: {len(texts)} texts, {features} features, reference {timings[scan_features_reference] * 1000:.2f} ms, "
+        f"scanner {timings[scan_features] * 1000:.2f} ms, "
+        f"{timings[scan_features_reference] / max(timings[scan_features], 1e-9):.1f}x, "
+        f"{'same results' if same else 'DIFFERENT RESULTS'}"
+    )
+    return same
+
+
+if __name__ == "__main__":
+    # search data with the OCR text of the example drawings
+    SEARCHDATA = (
+        sys.argv[1]
+        if len(sys.argv) > 1
+        else os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "..",
+            "..",
+            "database",
+            "resources",
+            "example_data",
+            "searchdata.csv",
+        )
+    )
+    REPETITIONS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    drawings = load_ocr_texts(SEARCHDATA)
+    same = [
+        run("example text blobs", [text for texts in drawings for text in texts], REPETITIONS),
+        run("example drawings as one text", ["\n".join(texts) for texts in drawings], REPETITIONS),
+    ]
+    for lines in SYNTHETIC_LINES:
+        same.append(run(f"synthetic text of {lines} lines", [SYNTHETIC_LINE * lines], max(1, REPETITIONS // lines)))
+    if not all(same):
+        sys.exit(1)
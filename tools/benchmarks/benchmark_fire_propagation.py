@@ -0,0 +1,170 @@
+"""
+Benchmarks the fire propagation of the table extraction (propagate_fire) on synthetic drawings with many rectangles and
+on the example drawings, and checks that the burnt rectangles are the same as with the pairwise reference
+implementation, which checks every burning rectangle against every other rectangle.
+
+    python3 benchmark_fire_propagation.py [data_dir] [numbers of table cells, comma separated]
+"""
+
+import os
+import random
+import sys
+import time
+
+# make the preprocessor importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessor"))
+
+from src.flask.converter.consts import DIST_THRESH
+from src.flask.converter.image_std import (
+    convert_bytestring_to_cv2,
+    convert_pdf_bytestring_to_img,
+    resize_to,
+)
+from src.flask.converter.table_extract import (
+    find_inner_frame,
+    handle_corner_cells,
+    propagate_fire,
+)
+from src.flask.converter.utils import find_rectangles
+
+SCALE = 2048
+# the pairwise reference is quadratic, it is skipped for larger inputs
+MAX_REFERENCE_RECTS = 3000
+
+
+def intersects(a, b):
+    """
+    Checks if two boxes (x, y, w, h) intersect, like Rectangle.intersects did.
+    """
+    return not (a[0] > b[0] + b[2] or a[0] + a[2] < b[0] or a[1] > b[1] + b[3] or a[1] + a[3] < b[1])
+
+
+def propagate_fire_pairwise(rects, inner_frame):
+    """
+    Reference implementation: the fire propagation as it was implemented before the RectangleGrid.
+    """
+    if len(inner_frame) == 0:
+        return []
+    status = ["green"] * len(rects)
+    on_fire = [tuple(inner_frame)]
+    for rectangle in on_fire:
+        x, y, w, h = rectangle
+        edges = [(x, y, w, 0), (x + w, y, 0, h), (x, y + h, w, 0), (x, y, 0, h)]
+        edges = [
+            (ex - DIST_THRESH / 2, ey - DIST_THRESH / 2, ew + DIST_THRESH, eh + DIST_THRESH) for ex, ey, ew, eh in edges
+        ]
+        for i, other in enumerate(rects):
+            if status[i] == "green":
+                for edge in edges:
+                    if intersects(other, edge):
+                        status[i] = "on fire"
+                        on_fire.append(other)
+    return [tuple(rect) for rect, s in zip(rects, status, strict=True) if s != "green"]
+
+
+def generate_rectangles(num_cells, seed=0):
+    """
+    Generates the rectangles of a synthetic drawing: a frame with an inner frame, tables of adjacent cells attached to
+    the inner frame, loose tables, and scattered rectangles inside the drawing area.
+    :param num_cells: approximate number of rectangles
+    :param seed: seed of the random generator
+    :return: list of rectangles (x, y, w, h), inner frame
+    """
+    rng = random.Random(seed)
+    width = height = max(SCALE, int((num_cells * 4000) ** 0.5))
+    inner_frame = (40, 40, width - 80, height - 80)
+    rects = [(0, 0, width - 1, height - 1), inner_frame]
+    while len(rects) < num_cells:
+        cell_w, cell_h = rng.randint(30, 120), rng.randint(15, 40)
+        cols, rows = rng.randint(2, 8), rng.randint(2, 6)
+        attached = rng.random() < 0.5
+        if attached:
+            # table in the lower right corner, sharing the edges of the inner frame
+            x0 = inner_frame[0] + inner_frame[2] - cols * cell_w - rng.randint(0, width // 2)
+            y0 = inner_frame[1] + inner_frame[3] - rows * cell_h
+        else:
+            x0 = rng.randint(100, width - cols * cell_w - 100)
+            y0 = rng.randint(100, height - rows * cell_h - 100)
+        for r in range(rows):
+            for c in range(cols):
+                rects.append((x0 + c * cell_w, y0 + r * cell_h, cell_w, cell_h))
+        # some scattered rectangles, e.g. text boxes or views
+        for _ in range(rng.randint(0, 3)):
+            rects.append(
+                (
+                    rng.randint(100, width - 300),
+                    rng.randint(100, height - 300),
+                    rng.randint(20, 200),
+                    rng.randint(20, 200),
+                )
+            )
+    rng.shuffle(rects)
+    return rects[:num_cells], inner_frame
+
+
+def load_drawing_rectangles(file_path):
+    """
+    Finds the rectangles and the inner frame of a drawing, like separate does before the fire propagation.
+    """
+    with open(file_path, "rb") as f:
+        content = f.read()
+    if file_path.lower().endswith(".pdf"):
+        image = convert_pdf_bytestring_to_img(content)
+    else:
+        image = convert_bytestring_to_cv2(content)
+    image = resize_to(image, SCALE)
+    rects = find_rectangles(image)
+    inner_frame = find_inner_frame(image, rects)
+    return handle_corner_cells(rects, inner_frame, image)
+
+
+def run_case(name, rects, inner_frame):
+    """
+    Runs propagate_fire and, for small enough inputs, the reference, and prints the runtimes.
+    :return: True if the burnt rectangles are the same or the reference was skipped
+    """
+    start = time.perf_counter()
+    burnt = propagate_fire(rects, inner_frame)
+    runtime = time.perf_counter() - start
+    row = f"{name[:40]:40s} {len(rects):7d} {len(burnt):7d} {runtime:9.4f}s"
+    same = True
+    if len(rects) <= MAX_REFERENCE_RECTS:
+        start = time.perf_counter()
+        reference = propagate_fire_pairwise(rects, inner_frame)
+        reference_runtime = time.perf_counter() - start
+        same = burnt == reference
+        row += f" {reference_runtime:9.4f}s {'same' if same else 'DIFFERENT'}"
+    print(row)
+    return same
+
+
+def run_benchmark(data_dir, cell_counts):
+    """
+    Runs the fire propagation on all drawings of data_dir and on synthetic drawings with the given numbers of
+    rectangles.
+    :param data_dir: directory with pdf or image files. skipped if it does not exist
+    :param cell_counts: list of numbers of rectangles of the synthetic drawings
+    :return: True if all burnt rectangles are the same as with the reference
+    """
+    print(f"{'drawing':40s} {'rects':>7s} {'burnt':>7s} {'grid':>10s} {'pairwise':>10s}")
+    all_same = True
+    if os.path.isdir(data_dir):
+        for file_name in sorted(os.listdir(data_dir)):
+            if file_name.lower().endswith((".pdf", ".png", ".jpg", ".jpeg")):
+                rects, inner_frame = load_drawing_rectangles(os.path.join(data_dir, file_name))
+                all_same &= run_case(file_name, rects, inner_frame)
+    for num_cells in cell_counts:
+        rects, inner_frame = generate_rectangles(num_cells)
+        all_same &= run_case(f"synthetic {num_cells}", rects, inner_frame)
+    print()
+    print("burnt rectangles are the same as with the reference" if all_same else "burnt rectangles DIFFER")
+    return all_same
+
+
+if __name__ == "__main__":
+    # Directory of the drawings
+    DATA_DIR = sys.argv[1] if len(sys.argv) > 1 else "../../example_data/drawings"
+    # number of rectangles of the synthetic drawings
+    CELL_COUNTS = [int(n) for n in sys.argv[2].split(",")] if len(sys.argv) > 2 else [500, 2000, 3000, 10000, 50000]
+
+    run_benchmark(DATA_DIR, CELL_COUNTS)
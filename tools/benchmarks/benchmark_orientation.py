@@ -0,0 +1,112 @@
+"""
+Compares the orientation modes of the preprocessor on a set of drawings: Tesseract OSD (get_image_rotation) and the
+PaddleOCR models (get_image_rotation_paddle).
+Every drawing is rotated by 0, 90, 180 and 270 degrees first, so the correct result is known. Both detectors get the
+info block that separate finds in the rotated drawing, like in convert_drawing.
+
+    python3 benchmark_orientation.py [data_dir] [modes, comma separated]
+"""
+
+import os
+import sys
+import time
+
+# make the preprocessor importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessor"))
+
+from src.flask.converter.image_rotation import (
+    get_image_rotation,
+    rotate_image_multiple_of_90,
+)
+from src.flask.converter.image_std import (
+    convert_bytestring_to_cv2,
+    convert_pdf_bytestring_to_img,
+    resize_to,
+)
+from src.flask.converter.table_extract import separate
+
+SCALE = 2048
+ROTATIONS = [0, 90, 180, 270]
+
+
+def load_drawing(file_path):
+    """
+    Loads a drawing like load_and_standardize does before the alignment.
+    :param file_path: path of a pdf or image file
+    :return: grayscale image resized to SCALE
+    """
+    with open(file_path, "rb") as f:
+        content = f.read()
+    if file_path.lower().endswith(".pdf"):
+        image = convert_pdf_bytestring_to_img(content)
+    else:
+        image = convert_bytestring_to_cv2(content)
+    return resize_to(image, SCALE)
+
+
+def get_detectors(modes):
+    """
+    Returns the rotation detection of each orientation mode. The OCR models are only loaded if paddle is compared.
+    :param modes: list of orientation modes, see ORIENTATION_MODES
+    :return: dictionary of functions that get the info block image and return the rotation
+    """
+    detectors = {}
+    for mode in modes:
+        if mode == "osd":
+            detectors[mode] = get_image_rotation
+        elif mode == "paddle":
+            from src.flask.ocr.orientation import get_image_rotation_paddle
+            from src.flask.ocr.paddle_ocr_engine import OCREngine
+
+            ocr_engine = OCREngine(cpu_threads=os.cpu_count() or 1)
+            detectors[mode] = lambda img, ocr_engine=ocr_engine: get_image_rotation_paddle(img, ocr_engine)
+        else:
+            raise ValueError(f"unknown orientation mode {mode}")
+    return detectors
+
+
+def run_benchmark(data_dir, modes):
+    """
+    Runs the rotation detection of all modes on all drawings of data_dir in all four rotations and prints the detected
+    rotations and the runtime.
+    :param data_dir: directory with pdf or image files
+    :param modes: list of orientation modes to compare
+    :return: dictionary with the total runtime and the number of wrong detections of each mode
+    """
+    detectors = get_detectors(modes)
+    totals = {mode: {"time": 0.0, "wrong": 0} for mode in detectors}
+    num_runs = 0
+    file_names = sorted(f for f in os.listdir(data_dir) if f.lower().endswith((".pdf", ".png", ".jpg", ".jpeg")))
+    print(f"{'drawing':40s} {'rotation':>8s} " + " ".join(f"{mode:>8s} {'time':>7s}" for mode in detectors))
+    for file_name in file_names:
+        drawing = load_drawing(os.path.join(data_dir, file_name))
+        for rotation in ROTATIONS:
+            image = rotate_image_multiple_of_90(drawing, rotation) if rotation != 0 else drawing
+            info_block_img = separate(image)[1]
+            row = f"{file_name[:40]:40s} {rotation:8d} "
+            for mode, detector in detectors.items():
+                start = time.perf_counter()
+                detected = detector(info_block_img) if len(info_block_img) > 0 else None
+                runtime = time.perf_counter() - start
+                totals[mode]["time"] += runtime
+                totals[mode]["wrong"] += detected != rotation
+                row += f"{str(detected):>8s} {runtime:6.2f}s "
+            print(row)
+            num_runs += 1
+
+    print()
+    for mode, total in totals.items():
+        print(
+            f"{mode}: {num_runs - total['wrong']} of {num_runs} correct, total time {total['time']:.2f}s, "
+            f"mean time {total['time'] / max(num_runs, 1):.3f}s"
+        )
+    return totals
+
+
+if __name__ == "__main__":
+    # Directory of the drawings
+    DATA_DIR = sys.argv[1] if len(sys.argv) > 1 else "../../example_data/drawings"
+    # orientation modes to compare
+    MODES = sys.argv[2].split(",") if len(sys.argv) > 2 else ["osd", "paddle"]
+
+    run_benchmark(DATA_DIR, MODES)
@@ -0,0 +1,123 @@
+"""
+Benchmarks the search engine of the frontend on the search vectors in database/resources/example_data and on larger
+synthetic datasets made of noisy copies of them: measures the time to build the engine and to query it, and checks the
+returned distances against colibri_distance, the reference distance computed for one pair of vectors at a time.
+
+    python3 benchmark_search_engine.py [searchdata.csv] [dataset sizes]
+"""
+
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+
+# make the frontend importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "frontend", "src"))
+
+from app.search_engine import SECTION_LENGTHS, SearchEngine
+
+WEIGHTS = [1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 6.0]
+# other weights to query the last query vector again with, which reuses its cached section distances
+REWEIGHTS = [0.3, 0.05, 0.05, 0.05, 0.1, 0.3, 0.15]
+K = 5
+QUERIES = 10
+# largest dataset for which the reference distances to every vector are computed
+REFERENCE_SIZE = 5000
+
+
+def load_search_vectors(path):
+    """
+    Reads the search_vector column of the example search data.
+    :return: array of shape (n_drawings, 703)
+    """
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    return np.array([[float(value) for value in row["search_vector"].strip("{}").split(",")] for row in rows])
+
+
+def synthetic_dataset(vectors, size, rng):
+    """
+    Copies of the example vectors with noise on the surface, outer dimension and shape sections.
+    """
+    dataset = vectors[rng.integers(0, len(vectors), size)].copy()
+    surface_start = sum(SECTION_LENGTHS[:2])
+    dim_start = sum(SECTION_LENGTHS[:5])
+    shape_start = sum(SECTION_LENGTHS[:6])
+    dataset[:, surface_start] *= rng.uniform(0.5, 2.0, size)
+    dataset[:, dim_start:shape_start] *= rng.uniform(0.5, 2.0, (size, 3))
+    dataset[:, shape_start:] += rng.normal(0.0, 0.01, (size, SECTION_LENGTHS[-1]))
+    return dataset
+
+
+def run(name, dataset, queries):
+    """
+    Builds the search engine on the dataset, queries it, queries the last query vector again with other weights, prints
+    the runtime and returns the largest difference of the returned distances to the k smallest reference distances.
+    """
+    start = time.perf_counter()
+    engine = SearchEngine(dataset, list(range(len(dataset))), "colibri_distance")
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = [engine.query([query], K, WEIGHTS) for query in queries]
+    query_time = (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    results.append(engine.query([queries[-1]], K, REWEIGHTS))
+    reweight_time = time.perf_counter() - start
+
+    error = None
+    reference_time = None
+    if len(dataset) <= REFERENCE_SIZE:
+        start = time.perf_counter()
+        references = [
+            np.sort([engine.colibri_distance(query, vector, weights) for vector in dataset])[:K]
+            for query, weights in zip(
+                list(queries) + [queries[-1]], [WEIGHTS] * len(queries) + [REWEIGHTS], strict=True
+            )
+        ]
+        reference_time = (time.perf_counter() - start) / len(references)
+        error = max(
+            float(np.max(np.abs(dist[0] - reference))) for (_, dist), reference in zip(results, references, strict=True)
+        )
+
+    print(
+        f"{name}: {len(dataset)} vectors, build {build_time * 1000:.1f} ms, query {query_time * 1000:.2f} ms, "
+        f"query with other weights {reweight_time * 1000:.2f} ms"
+        + (
+            f", reference {reference_time * 1000:.1f} ms, max distance difference {error:.2e}"
+            if error is not None
+            else ""
+        )
+    )
+    return error
+
+
+if __name__ == "__main__":
+    # search data with the search vectors of the example drawings
+    SEARCHDATA = (
+        sys.argv[1]
+        if len(sys.argv) > 1
+        else os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "..",
+            "..",
+            "database",
+            "resources",
+            "example_data",
+            "searchdata.csv",
+        )
+    )
+    SIZES = [int(size) for size in sys.argv[2].split(",")] if len(sys.argv) > 2 else [1000, 10000, 100000]
+
+    rng = np.random.default_rng(0)
+    vectors = load_search_vectors(SEARCHDATA)
+    errors = [run("example search vectors", vectors, vectors)]
+    for size in SIZES:
+        dataset = synthetic_dataset(vectors, size, rng)
+        errors.append(run(f"synthetic dataset of {size}", dataset, dataset[rng.integers(0, size, QUERIES)]))
+    if any(error is not None and error > 1e-4 for error in errors):
+        sys.exit(1)
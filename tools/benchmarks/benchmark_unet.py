@@ -0,0 +1,171 @@
+"""
+Compares the inference settings of the view segmentation UNet of the preprocessor (UNET_PROFILES) on labelled views,
+with the metric of eval_unet.ipynb: IoU and Dice of the classes shape and clutter, their macro average and the micro
+average over all classes.
+The views and their ground truth are expected like in eval_unet.ipynb: img*.png files in data_dir with the
+segmentation seg*.png next to them. Besides the profiles, which predict all views in batched forward passes, the
+per-view sliding window prediction of eval_unet.ipynb is evaluated as reference ("per_view").
+
+    python3 benchmark_unet.py [data_dir] [profiles, comma separated]
+"""
+
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# make the preprocessor importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessor"))
+
+from src.flask.converter.shape_extract import (
+    UNET_PROFILES,
+    init_unet,
+    predict_views,
+    prepare_view_for_unet,
+    set_unet_profile,
+)
+
+BG, CLUTTER, SHAPE = 0, 1, 2
+CLASSES = (BG, CLUTTER, SHAPE)
+
+
+def build_multiclass_gt(view_bin255, gt_shape_bin255):
+    """
+    Same as in eval_unet.ipynb.
+    view_bin255: uint8 image where 255=white (paper), 0=black (ink)
+    gt_shape_bin255: uint8 image where 255=shape, 0=non-shape
+    Returns gt labels in {0:bg, 1:clutter, 2:shape}
+    """
+    shape = gt_shape_bin255 == 0
+    bg = (view_bin255 == 255) & (~shape)
+    clutter = (view_bin255 == 0) & (~shape)
+
+    gt = np.zeros(view_bin255.shape, np.uint8)
+    gt[bg] = BG
+    gt[clutter] = CLUTTER
+    gt[shape] = SHAPE
+    return gt
+
+
+def confusion_per_class(gt, pred, classes=CLASSES):
+    """
+    Counts the true positives, false positives and false negatives of each class, like iou_dice_per_class of
+    eval_unet.ipynb.
+    :return: dictionary {class: (tp, fp, fn)}
+    """
+    counts = {}
+    for c in classes:
+        gt_c = gt == c
+        pr_c = pred == c
+        counts[c] = (
+            int(np.logical_and(gt_c, pr_c).sum()),
+            int(np.logical_and(~gt_c, pr_c).sum()),
+            int(np.logical_and(gt_c, ~pr_c).sum()),
+        )
+    return counts
+
+
+def iou_dice(tp, fp, fn):
+    """
+    IoU and Dice of a class, NaN if the class is neither in the ground truth nor in the prediction.
+    """
+    if tp + fp + fn == 0:
+        return np.nan, np.nan
+    return tp / (tp + fp + fn), 2 * tp / (2 * tp + fp + fn)
+
+
+def load_views(data_dir):
+    """
+    Loads the labelled views of data_dir like eval_unet.ipynb.
+    :return: list of tuples (file name, grayscale view, multiclass ground truth)
+    """
+    views = []
+    for file_name in sorted(os.listdir(data_dir)):
+        if not file_name.startswith("img"):
+            continue
+        view = cv2.imread(os.path.join(data_dir, file_name), cv2.IMREAD_GRAYSCALE)
+        gt_view = cv2.imread(os.path.join(data_dir, file_name.replace("img", "seg")), cv2.IMREAD_GRAYSCALE)
+        view_bin = (view > 248).astype(np.uint8) * 255
+        gt_shape_bin = (gt_view > 248).astype(np.uint8) * 255
+        views.append((file_name, view, build_multiclass_gt(view_bin, gt_shape_bin)))
+    return views
+
+
+def predict(views, predictor, mode):
+    """
+    Segments the views with a profile of UNET_PROFILES, or per view with the sliding window like eval_unet.ipynb.
+    :return: list of segmentations with values in CLASSES, runtime in seconds
+    """
+    start = time.perf_counter()
+    if mode == "per_view":
+        set_unet_profile(predictor, "accurate")
+        inputs = [prepare_view_for_unet(view) for _, view, _ in views]
+        predictions = [
+            predictor.predict_single_npy_array(img, {"spacing": (999, 1, 1)}, None, None, False) for img in inputs
+        ]
+    else:
+        settings = set_unet_profile(predictor, mode)
+        max_shape = predictor.configuration_manager.patch_size if settings["fit_to_patch"] else None
+        predictions = predict_views([prepare_view_for_unet(view, max_shape) for _, view, _ in views], predictor)
+    runtime = time.perf_counter() - start
+    return [np.squeeze(prediction, axis=0).astype(np.uint8) for prediction in predictions], runtime
+
+
+def evaluate(views, predictions):
+    """
+    Computes the metrics of eval_unet.ipynb for the predictions of all views.
+    :return: dictionary with the mean IoU/Dice of shape and clutter, the macro foreground and the micro IoU/Dice
+    """
+    shape_scores, clutter_scores, macro_scores = [], [], []
+    micro = np.zeros(3, dtype=np.int64)
+    for (_, _, gt), prediction in zip(views, predictions, strict=True):
+        # bring the prediction to the size of the ground truth, like eval_unet.ipynb
+        if prediction.shape != gt.shape:
+            prediction = cv2.resize(prediction, (gt.shape[1], gt.shape[0]), interpolation=cv2.INTER_NEAREST)
+        counts = confusion_per_class(gt, prediction)
+        shape_scores.append(iou_dice(*counts[SHAPE]))
+        clutter_scores.append(iou_dice(*counts[CLUTTER]))
+        macro_scores.append(np.nanmean([shape_scores[-1], clutter_scores[-1]], axis=0))
+        micro += np.sum([counts[c] for c in CLASSES], axis=0)
+    return {
+        "shape": np.nanmean(shape_scores, axis=0),
+        "clutter": np.nanmean(clutter_scores, axis=0),
+        "macro_fg": np.mean(macro_scores, axis=0),
+        "micro": np.array(iou_dice(*micro)),
+    }
+
+
+def run_benchmark(data_dir, modes):
+    """
+    Evaluates the UNet with each mode on the labelled views of data_dir and prints the metrics and the runtime.
+    :param data_dir: directory with img*.png views and seg*.png ground truth
+    :param modes: list of keys of UNET_PROFILES or "per_view"
+    :return: dictionary with the metrics and the runtime of each mode
+    """
+    views = load_views(data_dir)
+    predictor = init_unet()
+    print(f"{len(views)} views")
+    header = ["shape IoU/Dice", "clutter IoU/Dice", "macro-FG", "micro"]
+    print(f"{'mode':10s} " + " ".join(f"{name:>14s}" for name in header) + f" {'time':>8s}")
+    results = {}
+    for mode in modes:
+        predictions, runtime = predict(views, predictor, mode)
+        metrics = evaluate(views, predictions)
+        results[mode] = {**metrics, "time": runtime}
+        print(
+            f"{mode:10s} "
+            + " ".join(f"{metrics[name][0]:>7.3f}/{metrics[name][1]:<6.3f}" for name in metrics)
+            + f" {runtime:7.2f}s"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    # Directory of the labelled views, see eval_unet.ipynb
+    DATA_DIR = sys.argv[1] if len(sys.argv) > 1 else "test_data"
+    # UNet profiles to compare
+    MODES = sys.argv[2].split(",") if len(sys.argv) > 2 else ["per_view", *UNET_PROFILES]
+
+    run_benchmark(DATA_DIR, MODES)
@@ -0,0 +1,106 @@
+"""
+Exports the visual encoder of the CLIP model of the preprocessor to ONNX for the onnx backend of vectorizer
+(PP_CLIP_BACKEND=onnx), once with float32 weights and once with 8 bit quantized weights.
+Afterwards both exported models are checked against the torch model: the views of the drawings in data_dir are embedded
+by the torch model with the PIL preprocessing and by the exported models with the batch preprocessing, and the cosine
+similarity of the embeddings has to reach the minimum for every view. Otherwise the shape vectors of the onnx backend
+are not comparable with those already in the database.
+
+    python3 export_clip.py [data_dir] [minimum cosine similarity]
+
+Exits with code 1 if the float32 model does not reach the minimum cosine similarity.
+"""
+
+import os
+import sys
+import time
+
+import clip
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# make the preprocessor importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "preprocessor"))
+
+from src.flask.converter.pipeline import load_drawing_views
+from src.flask.shapes.clip_onnx import (
+    CLIP_MIN_COSINE,
+    CLIP_ONNX_INT8_PATH,
+    CLIP_ONNX_PATH,
+    OnnxClipEncoder,
+    export_clip,
+    quantize_clip,
+)
+from src.flask.shapes.vectorizer import (
+    CLIP_BATCH_SIZE,
+    CLIP_MODEL_NAME,
+    prepare_views,
+    preprocess_views,
+)
+
+
+def embed(model, batch):
+    """
+    Embeds a batch of preprocessed views in chunks of CLIP_BATCH_SIZE, like generate_embeddings_batch.
+    :return: tuple (embeddings, seconds)
+    """
+    start = time.perf_counter()
+    with torch.no_grad():
+        embeddings = torch.cat(
+            [model.encode_image(batch[i : i + CLIP_BATCH_SIZE]).float() for i in range(0, len(batch), CLIP_BATCH_SIZE)]
+        )
+    return embeddings, time.perf_counter() - start
+
+
+def run_export(data_dir, min_cosine):
+    """
+    Exports and quantizes the visual encoder and checks both exported models against the torch model.
+    :param data_dir: directory with the drawings used for the check
+    :param min_cosine: minimum cosine similarity to the embedding of the torch model in every view
+    :return: dictionary with the name of each checked variant and whether it reached the minimum cosine similarity
+    """
+    model, preprocess = clip.load(CLIP_MODEL_NAME, device="cpu")
+    export_clip(model, CLIP_ONNX_PATH)
+    quantize_clip(CLIP_ONNX_PATH, CLIP_ONNX_INT8_PATH)
+
+    views = load_drawing_views(data_dir)
+    print(f"{len(views)} views")
+
+    start = time.perf_counter()
+    reference_batch = prepare_views(views, preprocess)
+    print(f"PIL preprocessing: {time.perf_counter() - start:.2f} s")
+    start = time.perf_counter()
+    batch = preprocess_views(views)
+    print(f"batch preprocessing: {time.perf_counter() - start:.2f} s")
+
+    reference, seconds = embed(model, reference_batch)
+    print(f"torch: {seconds:.2f} s")
+
+    # the torch model with the batch preprocessing shows the share of the preprocessing in the difference
+    variants = {"torch + batch preprocessing": model}
+    for path in [CLIP_ONNX_PATH, CLIP_ONNX_INT8_PATH]:
+        print(f"{os.path.basename(path)}: {os.path.getsize(path) / 2**20:.1f} MB")
+        variants[os.path.basename(path)] = OnnxClipEncoder(path)
+
+    passed = {}
+    for name, encoder in variants.items():
+        embeddings, seconds = embed(encoder, batch)
+        similarities = F.cosine_similarity(reference, embeddings, dim=1).tolist()
+        passed[name] = len(similarities) > 0 and min(similarities) >= min_cosine
+        print(
+            f"{name}: {seconds:.2f} s, cosine similarity min {min(similarities, default=0):.4f} "
+            f"mean {np.mean(similarities) if similarities else 0:.4f}, "
+            f"{'ok' if passed[name] else 'BELOW ' + str(min_cosine)}"
+        )
+    return passed
+
+
+if __name__ == "__main__":
+    # Directory of the drawings used for the check
+    DATA_DIR = sys.argv[1] if len(sys.argv) > 1 else "../example_data/drawings"
+    # minimum cosine similarity to the embeddings of the torch model, in every view
+    MIN_COSINE = float(sys.argv[2]) if len(sys.argv) > 2 else CLIP_MIN_COSINE
+
+    if not run_export(DATA_DIR, MIN_COSINE)[os.path.basename(CLIP_ONNX_PATH)]:
+        sys.exit(1)
@@ -0,0 +1,83 @@
+"""
+Exports the view segmentation UNet of the preprocessor (Dataset001_ViewSegmentation) to ONNX for the onnx backend of
+shape_extract (PP_UNET_BACKEND=onnx), once with float32 weights and once with 8 bit quantized weights.
+Afterwards both exported models are checked against the nnUNet network: the views of the drawings in data_dir are
+segmented with both, and the share of pixels with the same class has to reach the minimum agreement for every view.
+
+    python3 export_unet.py [data_dir] [minimum pixel agreement]
+
+Exits with code 1 if the float32 model does not reach the minimum agreement.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+# make the preprocessor importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "preprocessor"))
+
+from src.flask.converter.pipeline import load_drawing_views
+from src.flask.converter.shape_extract import (
+    init_unet,
+    predict_views,
+    prepare_view_for_unet,
+)
+from src.flask.converter.unet_onnx import (
+    UNET_ONNX_INT8_PATH,
+    UNET_ONNX_PATH,
+    OnnxUNet,
+    export_unet,
+    quantize_unet,
+)
+
+
+def pixel_agreement(predictor, onnx_path, inputs):
+    """
+    Segments the prepared views with the nnUNet network and with an exported model.
+    :return: list with the share of pixels with the same class for each view
+    """
+    predictor.exported_network = None
+    reference = predict_views(inputs, predictor)
+    predictor.exported_network = OnnxUNet(onnx_path)
+    exported = predict_views(inputs, predictor)
+    predictor.exported_network = None
+    return [float(np.mean(a == b)) for a, b in zip(reference, exported, strict=True)]
+
+
+def run_export(data_dir, min_agreement):
+    """
+    Exports and quantizes the UNet and checks both exported models against the nnUNet network.
+    :param data_dir: directory with the drawings used for the check
+    :param min_agreement: minimum share of pixels with the same class in every view
+    :return: dictionary with the path of each exported model and whether it reached the minimum agreement
+    """
+    predictor = init_unet()
+    export_unet(predictor, UNET_ONNX_PATH)
+    quantize_unet(UNET_ONNX_PATH, UNET_ONNX_INT8_PATH)
+
+    # views are shrunk to a single patch, so that all of them go through the batched forward pass of the exported model
+    patch_size = predictor.configuration_manager.patch_size
+    inputs = [prepare_view_for_unet(view, patch_size) for view in load_drawing_views(data_dir)]
+    print(f"{len(inputs)} views")
+
+    passed = {}
+    for path in [UNET_ONNX_PATH, UNET_ONNX_INT8_PATH]:
+        agreements = pixel_agreement(predictor, path, inputs)
+        passed[path] = len(agreements) > 0 and min(agreements) >= min_agreement
+        print(
+            f"{os.path.basename(path)}: {os.path.getsize(path) / 2**20:.1f} MB, pixel agreement "
+            f"min {min(agreements, default=0):.4f} mean {np.mean(agreements) if agreements else 0:.4f}, "
+            f"{'ok' if passed[path] else 'BELOW ' + str(min_agreement)}"
+        )
+    return passed
+
+
+if __name__ == "__main__":
+    # Directory of the drawings used for the check
+    DATA_DIR = sys.argv[1] if len(sys.argv) > 1 else "../example_data/drawings"
+    # minimum share of pixels with the same class as the nnUNet network, in every view
+    MIN_AGREEMENT = float(sys.argv[2]) if len(sys.argv) > 2 else 0.99
+
+    if not run_export(DATA_DIR, MIN_AGREEMENT)[UNET_ONNX_PATH]:
+        sys.exit(1)
@@ -11,35 +11,37 @@ import requests
 
 from get_llm_examples import get_llm_examples
 
-def send_request_to_preprocessor(resource, content=None, type="post"):
+def send_request_to_preprocessor(resource, content=None, type="post", timeout=100):
     """
     Sends request preprocessor resource and returns response json. If return status code is not 200, will return
     dictionary with key "ERROR".
     :param resource: the REST resource to be called, e.g. /drawing/get/1 (include leading /)
     :param content: the payload of the request, e.g. json data for saving a drawing
     :param type: post, get, or delete
+    :param timeout: timeout of the request in seconds
     :return: json response from endpoint
     """
     url = "localhost:6201" + resource
-    return send_request_to(url, content, type)
+    return send_request_to(url, content, type, timeout)
 
 
-def send_request_to(url, content, type="post"):
+def send_request_to(url, content, type="post", timeout=100):
     """
     Sends request to url and returns response json. If return status code is not 200, will return dictionary with key
     "ERROR".
     :param url: url to sent content to
     :param content: content to sent to url
     :param type: post, get, or delete
+    :param timeout: timeout of the request in seconds
     :return: json response from endpoint
     """
     try:
         if type == "get":
-            response = requests.get(url, json=content, timeout=100)  # timeout of 100 seconds
+            response = requests.get(url, json=content, timeout=timeout)
         elif type == "post":
-            response = requests.post(url, json=content, timeout=100)
+            response = requests.post(url, json=content, timeout=timeout)
         elif type == "delete":
-            response = requests.delete(url, json=content, timeout=100)
+            response = requests.delete(url, json=content, timeout=timeout)
         else:
             return {"ERROR", "invalid request type"}
     except requests.exceptions.Timeout:
@@ -136,13 +138,14 @@ def handle_preprocessing_result(prepro_result: dict, drawing_id, part_number, pa
     return pd.DataFrame(response_data).set_index("drawing_id")
 
 
-def iterate_preprocess(drawing_ids, part_numbers, drawing_paths, data_dir):
+def iterate_preprocess(drawing_ids, part_numbers, drawing_paths, data_dir, batch_size=8):
     """
-    Iterates through the given lists and calls the preprocessor every iteration.
+    Iterates through the given lists and calls the preprocessor batch endpoint for every batch_size drawings.
     :param drawing_ids: List of drawing IDs.
     :param part_numbers: List of part numbers.
     :param drawing_paths: List of drawing paths.
     :param data_dir: Path to the data directory.
+    :param batch_size: Number of drawings sent to the preprocessor in one request.
     :return: dataframe with preprocessor response data for all drawings.
     """
     batch_df = pd.DataFrame(
@@ -163,27 +166,31 @@ def iterate_preprocess(drawing_ids, part_numbers, drawing_paths, data_dir):
             "llm_vector",
         ]
     ).set_index("drawing_id")
-    for drawing_id, part_number, drawing_path in zip(drawing_ids, part_numbers, drawing_paths, strict=True):
-        print(f"Processing drawing {drawing_id}...: {drawing_path}")
-        # try:
-        file = file_to_base64(os.path.join(data_dir, drawing_path))  # load file as bytes
-        file_data = {"file_name": drawing_path, "file_content": file}
-        preprocessing_result = send_request_to_preprocessor(
-            resource="/image_to_vector", content=file_data, type="post"
+    drawings = list(zip(drawing_ids, part_numbers, drawing_paths, strict=True))
+    for start in range(0, len(drawings), batch_size):
+        batch = drawings[start : start + batch_size]
+        print(f"Processing drawings {start} to {start + len(batch) - 1}...: {[path for _, _, path in batch]}")
+        files = [
+            {"file_name": drawing_path, "file_content": file_to_base64(os.path.join(data_dir, drawing_path))}
+            for _, _, drawing_path in batch
+        ]  # load files as bytes
+        preprocessing_results = send_request_to_preprocessor(
+            resource="/image_to_vector_batch", content={"files": files}, type="post", timeout=100 * len(batch)
         )
-        print("preprocessing result:", preprocessing_result)
 
-        llm_text, llm_vector = get_llm_examples(preprocessing_result)
+        for (drawing_id, part_number, drawing_path), preprocessing_result in zip(
+            batch, preprocessing_results, strict=True
+        ):
+            print("preprocessing result:", preprocessing_result)
 
-        result_df = handle_preprocessing_result(
-            preprocessing_result, drawing_id, part_number, drawing_path, "", "", "", llm_text,
-            llm_vector
-        )  # convert the dictionary from preprocessor to a dataframe
+            llm_text, llm_vector = get_llm_examples(preprocessing_result)
 
-        batch_df = pd.concat([batch_df, result_df])
-        # except Exception as e:
-        #     print("Exception occured during preprcoess iteration:", e)
-        #     continue
+            result_df = handle_preprocessing_result(
+                preprocessing_result, drawing_id, part_number, drawing_path, "", "", "", llm_text,
+                llm_vector
+            )  # convert the dictionary from preprocessor to a dataframe
+
+            batch_df = pd.concat([batch_df, result_df])
 
     return batch_df
 
@@ -0,0 +1,136 @@
+"""
+Computes the search_vector of all drawings in the database again from their stored search data, without applying the
+OCR, e.g. after materials.json, norms.json or the vectorization of the preprocessor changed.
+The search data is read in batches from the database service, sent to the /revectorize endpoint of the preprocessor and
+written back with the /searchdata/save-all endpoint. While a batch is processed, the next one is already read.
+After each saved batch, the id of its last search data is written to the checkpoint file, so an interrupted run
+continues after the last saved batch when it is started again. The checkpoint file is removed once all batches are done.
+
+    python3 revectorize_database.py [database url] [preprocessor url] [batch size] [checkpoint file]
+"""
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+TIMEOUT = 600
+
+
+class PreprocessorError(Exception):
+    """
+    The preprocessor answered with an error instead of the revectorized search data.
+    """
+
+    def __init__(self, result):
+        super().__init__(f"preprocessor error: {result}")
+
+
+def load_checkpoint(path):
+    """
+    :return: dictionary with the id of the last saved search data (after), the number of saved search data and the
+             seconds spent so far. All are initial if there is no checkpoint file.
+    """
+    if not os.path.exists(path):
+        return {"after": -1, "saved": 0, "seconds": 0.0}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    """
+    Writes the checkpoint to a temporary file first, so an interruption never leaves a broken checkpoint file.
+    """
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+def fetch_batch(database_url, after, batch_size):
+    """
+    :return: at most batch_size search data with an id greater than after, ordered by their id
+    """
+    response = requests.get(
+        database_url + "/searchdata/get-batch", params={"after": after, "size": batch_size}, timeout=TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def revectorize(preprocessor_url, batch):
+    """
+    :return: the search data of the batch with the new search_vector, timings of the preprocessor
+    """
+    response = requests.post(preprocessor_url + "/revectorize", json={"searchdata": batch}, timeout=TIMEOUT)
+    response.raise_for_status()
+    result = response.json()
+    if not isinstance(result, dict):
+        raise PreprocessorError(result)
+    return result["searchdata"], result["timings"]
+
+
+def save_batch(database_url, batch):
+    response = requests.post(database_url + "/searchdata/save-all", json=batch, timeout=TIMEOUT)
+    response.raise_for_status()
+
+
+def run(database_url, preprocessor_url, batch_size, checkpoint_path):
+    """
+    Revectorizes all search data after the checkpoint and reports the throughput after each batch.
+    :return: the final checkpoint
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint["saved"] > 0:
+        print(f"resuming after search data {checkpoint['after']}, {checkpoint['saved']} already saved")
+
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        start = time.perf_counter()
+        next_batch = prefetch.submit(fetch_batch, database_url, checkpoint["after"], batch_size)
+        while True:
+            batch = next_batch.result()
+            if len(batch) == 0:
+                break
+            # read the next batch while this one is revectorized and saved
+            next_batch = prefetch.submit(fetch_batch, database_url, batch[-1]["searchdata_id"], batch_size)
+
+            batch_start = time.perf_counter()
+            revectorized, timings = revectorize(preprocessor_url, batch)
+            save_batch(database_url, revectorized)
+            batch_seconds = time.perf_counter() - batch_start
+
+            now = time.perf_counter()
+            checkpoint = {
+                "after": batch[-1]["searchdata_id"],
+                "saved": checkpoint["saved"] + len(batch),
+                "seconds": checkpoint["seconds"] + now - start,
+            }
+            start = now
+            save_checkpoint(checkpoint_path, checkpoint)
+            print(
+                f"saved {checkpoint['saved']} (up to search data {checkpoint['after']}): "
+                f"batch {len(batch) / batch_seconds:.1f}/s, total {checkpoint['saved'] / checkpoint['seconds']:.1f}/s, "
+                f"preprocessor {(timings['rebuild_time'] + timings['vectorize_time']) * 1000:.1f} ms"
+            )
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    print(
+        f"done: {checkpoint['saved']} search data in {checkpoint['seconds']:.1f} s "
+        f"({checkpoint['saved'] / max(checkpoint['seconds'], 1e-9):.1f}/s)"
+    )
+    return checkpoint
+
+
+if __name__ == "__main__":
+    # database service and preprocessor, as exposed by docker-compose.yml
+    DATABASE_URL = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:7201"
+    PREPROCESSOR_URL = sys.argv[2] if len(sys.argv) > 2 else "http://localhost:6201"
+    # number of search data per batch
+    BATCH_SIZE = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    # file with the id of the last saved search data, to resume an interrupted run
+    CHECKPOINT = sys.argv[4] if len(sys.argv) > 4 else "revectorize_checkpoint.json"
+
+    run(DATABASE_URL, PREPROCESSOR_URL, BATCH_SIZE, CHECKPOINT)